@@ -2,15 +2,476 @@
 统一API网关 - 整合所有服务
 整合认证、胶囊存储、胶囊交易三个系统
 """
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+import asyncio
 import httpx
+import json
 import os
-from typing import Dict, Any
+import time
+from typing import Awaitable, Callable, Dict, Optional
+from urllib.parse import quote
 
 # ===================== 配置 =====================
-app = FastAPI(title="Kai API Gateway", version="2.0.0")
+def upstream_config(name: str, default_url: str) -> dict:
+    """后端服务配置，可用 GATEWAY_<NAME>_* 环境变量逐项覆盖"""
+    prefix = f"GATEWAY_{name.upper()}_"
+    return {
+        "base_url": os.getenv(prefix + "URL", default_url),
+        "max_connections": int(os.getenv(prefix + "MAX_CONNECTIONS", "100")),  # 连接数上限
+        "max_keepalive": int(os.getenv(prefix + "MAX_KEEPALIVE", "20")),  # 保持的空闲长连接数
+        "keepalive_expiry": float(os.getenv(prefix + "KEEPALIVE_EXPIRY", "30")),  # 空闲连接保留秒数
+        "connect_timeout": float(os.getenv(prefix + "CONNECT_TIMEOUT", "2")),
+        "read_timeout": float(os.getenv(prefix + "READ_TIMEOUT", "10")),
+        "pool_timeout": float(os.getenv(prefix + "POOL_TIMEOUT", "5")),  # 连接池满时等待空闲连接的秒数
+        "fanout_timeout": float(os.getenv(prefix + "FANOUT_TIMEOUT_MS", "1000")) / 1000,  # 聚合查询中单个分区的时限
+        "hedge_after": float(os.getenv(prefix + "HEDGE_MS", "200")) / 1000,  # 聚合查询中超过此时长未返回即发对冲请求
+        "breaker_failures": int(os.getenv(prefix + "BREAKER_FAILURES", "5")),  # 连续失败多少次熔断
+        "breaker_cooldown": float(os.getenv(prefix + "BREAKER_COOLDOWN_MS", "5000")) / 1000,  # 熔断后多久放行探测请求
+        "limit_initial": int(os.getenv(prefix + "LIMIT_INITIAL", "20")),  # 自适应并发上限的初值
+        "limit_min": int(os.getenv(prefix + "LIMIT_MIN", "2")),
+        "latency_target": float(os.getenv(prefix + "LATENCY_TARGET_MS", "500")) / 1000,  # 超过即视为拥塞
+    }
+
+# 后端服务地址
+UPSTREAMS = {
+    "auth": upstream_config("auth", "http://localhost:8004"),
+    "capsule": upstream_config("capsule", "http://localhost:8005"),
+    "trade": upstream_config("trade", "http://localhost:8010"),
+}
+AUTH_SERVICE = UPSTREAMS["auth"]["base_url"]
+CAPSULE_SERVICE = UPSTREAMS["capsule"]["base_url"]
+TRADE_SERVICE = UPSTREAMS["trade"]["base_url"]
+
+# 路由表: (网关路径前缀, 上游, 上游路径前缀, 允许的方法)
+# 按最长前缀匹配，前缀之后的路径与查询串原样拼接到上游路径
+ROUTES = [
+    ("/api/auth/register", "auth", "/register", {"POST"}),
+    ("/api/auth/login", "auth", "/login", {"POST"}),
+    ("/api/auth/me", "auth", "/me", {"GET"}),
+    ("/api/auth/regenerate-key", "auth", "/regenerate-api-key", {"POST"}),
+    ("/api/capsules/collisions", "capsule", "/collisions", {"GET", "POST"}),
+    ("/api/capsules/stats", "capsule", "/stats", {"GET"}),
+    ("/api/capsules/issue", "trade", "/issue", {"POST"}),
+    ("/api/capsules/buy", "trade", "/buy", {"POST"}),
+    ("/api/capsules", "capsule", "/capsules", {"GET", "POST", "DELETE"}),
+    ("/api/wallets", "trade", "/wallets", {"GET", "POST"}),
+    ("/api/transfer", "trade", "/transfer", {"POST"}),
+    ("/api/market", "trade", "/market", {"GET"}),
+    ("/api/transactions", "trade", "/transactions", {"GET"}),
+]
+ROUTES_BY_LENGTH = sorted(ROUTES, key=lambda route: len(route[0]), reverse=True)
+
+def cache_rule(name: str, ttl: float, stale: float, require_param: Optional[str] = None) -> tuple:
+    """响应缓存规则: (新鲜期秒, 过期后仍返回旧值并后台刷新的宽限秒, 必须带的查询参数)
+    可用 GATEWAY_CACHE_<NAME>_TTL / _STALE 覆盖，TTL 为 0 即关闭该路由缓存"""
+    prefix = f"GATEWAY_CACHE_{name.upper()}_"
+    return (float(os.getenv(prefix + "TTL", str(ttl))), float(os.getenv(prefix + "STALE", str(stale))), require_param)
+
+# 读多写少、后端需全表聚合的 GET 路由（按网关路径精确匹配）
+CACHE_RULES = {
+    "/api/market": cache_rule("market", 5, 30),
+    "/api/capsules/stats": cache_rule("stats", 10, 60),
+    "/api/capsules": cache_rule("capsules", 5, 30, require_param="domain"),
+}
+CACHE_ENABLED = os.getenv("GATEWAY_CACHE", "1") == "1"
+DASHBOARD_DEADLINE = float(os.getenv("GATEWAY_DASHBOARD_DEADLINE_MS", "1500")) / 1000  # 仪表板整体时限
+CACHE_MAX_ENTRIES = int(os.getenv("GATEWAY_CACHE_MAX_ENTRIES", "1024"))
+
+# 逐跳头部，不转发（RFC 9110 §7.6.1）
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host",
+}
+
+# ===================== 熔断与自适应限流 =====================
+class CircuitBreaker:
+    """熔断器: 连续失败（连接错误、超时、5xx）达到阈值即打开，冷却期内直接拒绝；
+    冷却后半开，只放行一个探测请求，成功即关闭、失败则重新打开"""
+    
+    def __init__(self, failures: int, cooldown: float):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+        self.rejected = 0
+    
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+        if self.probing:
+            self.rejected += 1
+            return False
+        self.probing = True
+        return True
+    
+    def record(self, ok: bool):
+        if self.state == "open":
+            # 熔断前发出的请求陆续返回，不影响冷却计时
+            return
+        self.probing = False
+        if ok:
+            self.consecutive_failures = 0
+            self.state = "closed"
+            return
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.trips += 1
+    
+    def release(self):
+        """请求被取消、没有结果时归还探测名额"""
+        if self.state == "half_open":
+            self.probing = False
+    
+    def retry_after(self) -> int:
+        return max(1, round(self.cooldown - (time.monotonic() - self.opened_at)))
+    
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "threshold": self.threshold,
+            "cooldown_s": self.cooldown,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+class AdaptiveLimit:
+    """AIMD 自适应并发上限: 请求在目标延迟内成功则加性增长（每 limit 次成功约 +1），
+    超过目标延迟或失败则乘性收缩（每个目标延迟周期至多一次，避免同一批慢请求连续收缩）"""
+    
+    def __init__(self, initial: int, min_limit: int, max_limit: int, target: float, backoff: float = 0.9):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.target = target
+        self.backoff = backoff
+        self.last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.rejected = 0
+    
+    def admit(self, in_flight: int) -> bool:
+        if in_flight < int(self.limit):
+            return True
+        self.rejected += 1
+        return False
+    
+    def record(self, latency: float, ok: bool):
+        if ok and latency <= self.target:
+            if self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.increases += 1
+            return
+        now = time.monotonic()
+        if now - self.last_decrease >= self.target:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self.last_decrease = now
+            self.decreases += 1
+    
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "min": self.min_limit,
+            "max": self.max_limit,
+            "latency_target_ms": round(self.target * 1000, 1),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "rejected": self.rejected,
+        }
+
+# ===================== 上游连接池 =====================
+class SettledStream(httpx.AsyncByteStream):
+    """流式响应体的包装: 响应体关闭时（读完、调用方 aclose 或后台任务关闭）才结算在途名额与耗时；
+    读取中途的传输错误按失败结算"""
+    
+    def __init__(self, stream: httpx.AsyncByteStream, settle):
+        self._stream = stream
+        self._settle = settle
+        self._failed = False
+    
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        except httpx.TransportError:
+            self._failed = True
+            raise
+    
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            settle, self._settle = self._settle, None
+            if settle is not None:
+                settle(self._failed)
+
+class Upstream:
+    """一个后端服务: 独立的长连接池、超时设置、熔断器、自适应并发上限与调用统计"""
+    
+    def __init__(self, name: str, config: dict):
+        self.name = name
+        self.config = config
+        self.breaker = CircuitBreaker(config["breaker_failures"], config["breaker_cooldown"])
+        self.limiter = AdaptiveLimit(config["limit_initial"], config["limit_min"], config["max_connections"],
+                                     config["latency_target"])
+        self.client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.latency_ms = 0.0
+    
+    def open(self):
+        config = self.config
+        self._transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive"],
+            keepalive_expiry=config["keepalive_expiry"],
+        ))
+        self.client = httpx.AsyncClient(
+            base_url=config["base_url"],
+            transport=self._transport,
+            # 透传原始响应体: 不替客户端声明可接受的压缩编码，由客户端自带的 Accept-Encoding 决定
+            headers={"accept-encoding": "identity"},
+            timeout=httpx.Timeout(
+                config["read_timeout"], connect=config["connect_timeout"], pool=config["pool_timeout"]
+            ),
+        )
+    
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+    
+    async def request(self, method: str, path: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """经共享连接池发送请求（连接复用，不再逐请求建连/断开）
+        stream=True 时只等到响应头，响应体由调用方流式读取并 aclose()；在途名额一直占到响应体关闭，
+        耗时也按关闭时计（含传输响应体），不会在收到响应头时就放出名额
+        熔断打开或在途请求达到自适应上限时立即以 503 拒绝，不再等到超时"""
+        if self.client is None:
+            raise HTTPException(status_code=503, detail=f"网关未就绪: {self.name}")
+        if not self.breaker.allow():
+            raise HTTPException(status_code=503, detail=f"服务熔断中: {self.name}",
+                                headers={"Retry-After": str(self.breaker.retry_after())})
+        if not self.limiter.admit(self.in_flight):
+            self.breaker.release()
+            raise HTTPException(status_code=503, detail=f"服务繁忙: {self.name} 并发已达上限",
+                                headers={"Retry-After": "1"})
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.perf_counter()
+        
+        def settle(ok: Optional[bool]):
+            elapsed = time.perf_counter() - start
+            self.in_flight -= 1
+            self.requests += 1
+            self.latency_ms += elapsed * 1000
+            if ok is None:
+                # 被取消（客户端断开、对冲落败），不计入健康判断
+                self.breaker.release()
+            else:
+                self.breaker.record(ok)
+                self.limiter.record(elapsed, ok)
+        
+        try:
+            resp = await self.client.send(self.client.build_request(method, path, **kwargs), stream=stream)
+        except httpx.RequestError:
+            self.errors += 1
+            settle(False)
+            raise
+        except BaseException:
+            settle(None)
+            raise
+        ok = resp.status_code < 500
+        if not stream:
+            settle(ok)
+            return resp
+        
+        def settle_stream(failed: bool):
+            if failed:
+                self.errors += 1
+            settle(ok and not failed)
+        
+        resp.stream = SettledStream(resp.stream, settle_stream)
+        return resp
+    
+    def stats(self) -> dict:
+        # httpx 未公开连接池状态，这里读取底层 httpcore 连接池（读取失败时只返回调用统计）
+        connections = getattr(getattr(self._transport, "_pool", None), "connections", None) or []
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "base_url": self.config["base_url"],
+            "connections": len(connections),
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+            "max_connections": self.config["max_connections"],
+            "max_keepalive": self.config["max_keepalive"],
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "breaker": self.breaker.stats(),
+            "concurrency": self.limiter.stats(),
+            "avg_latency_ms": round(self.latency_ms / self.requests, 3) if self.requests else 0,
+            "timeouts": {
+                "connect": self.config["connect_timeout"],
+                "read": self.config["read_timeout"],
+                "pool": self.config["pool_timeout"],
+                "fanout": self.config["fanout_timeout"],
+                "hedge_after": self.config["hedge_after"],
+            },
+        }
+
+upstreams = {name: Upstream(name, config) for name, config in UPSTREAMS.items()}
+
+# ===================== 响应缓存 =====================
+class CacheEntry:
+    """一次上游响应的原始状态码、头部与响应体"""
+    
+    def __init__(self, upstream: str, status_code: int, headers: list, body: bytes):
+        self.upstream = upstream
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.stored_at = time.monotonic()
+
+class ResponseCache:
+    """上游 GET 响应缓存（LRU）
+    新鲜期内直接命中；过期后的宽限期内先返回旧值、后台刷新（stale-while-revalidate）；
+    同一键并发的未命中与刷新合并为一次上游请求（singleflight）"""
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+        self.generations: Dict[str, int] = {}  # 每个上游的写入代数，写入后丢弃旧代数的在途结果
+        self._tasks = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+    
+    async def get(self, key: tuple, ttl: float, stale: float,
+                  fetch: Callable[[], Awaitable[CacheEntry]]) -> tuple:
+        """返回 (CacheEntry, 状态)，状态为 HIT / STALE / MISS / COALESCED"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.stored_at
+            if age < ttl + stale:
+                self.entries.move_to_end(key)
+                if age < ttl:
+                    self.hits += 1
+                    return entry, "HIT"
+                self.stale_hits += 1
+                if key not in self.inflight:
+                    self.refreshes += 1
+                    self._start(key, entry.upstream, fetch, refresh=True)
+                return entry, "STALE"
+        if key in self.inflight:
+            self.coalesced += 1
+            state = "COALESCED"
+        else:
+            self.misses += 1
+            self._start(key, None, fetch, refresh=False)
+            state = "MISS"
+        # shield: 单个客户端断开不取消共享的上游请求
+        return await asyncio.shield(self.inflight[key]), state
+    
+    def _start(self, key: tuple, upstream: Optional[str], fetch, refresh: bool):
+        future = asyncio.get_running_loop().create_future()
+        # 后台刷新失败时可能无人等待，这里取走异常避免告警
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.inflight[key] = future
+        task = asyncio.create_task(self._fill(key, fetch, future, refresh))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _fill(self, key: tuple, fetch, future: asyncio.Future, refresh: bool):
+        generations = dict(self.generations)
+        try:
+            entry = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            if refresh:
+                self.refresh_errors += 1
+            future.set_exception(e)
+        else:
+            if entry.status_code == 200 and generations.get(entry.upstream, 0) == self.generations.get(entry.upstream, 0):
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+            future.set_result(entry)
+        finally:
+            self.inflight.pop(key, None)
+    
+    def invalidate(self, upstream: str):
+        """上游发生写入: 丢弃其全部缓存，并使在途的旧请求结果不再入缓存"""
+        self.generations[upstream] = self.generations.get(upstream, 0) + 1
+        for key in [key for key, entry in self.entries.items() if entry.upstream == upstream]:
+            del self.entries[key]
+    
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "enabled": CACHE_ENABLED,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "evictions": self.evictions,
+            "in_flight": len(self.inflight),
+            "hit_ratio": round((self.hits + self.stale_hits + self.coalesced) / lookups, 4) if lookups else 0,
+            "rules": {path: {"ttl": ttl, "stale": stale, "require_param": param}
+                      for path, (ttl, stale, param) in CACHE_RULES.items()},
+        }
+
+response_cache = ResponseCache(CACHE_MAX_ENTRIES)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时建立各上游的连接池，关闭时释放"""
+    for upstream in upstreams.values():
+        upstream.open()
+    yield
+    await response_cache.close()
+    for upstream in upstreams.values():
+        await upstream.close()
+
+app = FastAPI(title="Kai API Gateway", version="2.0.0", lifespan=lifespan)
 
 # 启用CORS
 app.add_middleware(
@@ -21,30 +482,95 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 后端服务地址
-AUTH_SERVICE = "http://localhost:8004"
-CAPSULE_SERVICE = "http://localhost:8005"
-TRADE_SERVICE = "http://localhost:8010"
-
 # ===================== 工具函数 =====================
-async def proxy_request(url: str, method: str, data: Dict = None, headers: Dict = None):
-    """代理请求到后端服务"""
-    async with httpx.AsyncClient() as client:
+def match_route(path: str, method: str):
+    """按路由表最长前缀匹配，返回 (上游, 上游路径)"""
+    if any(segment in (".", "..") for segment in path.split("/")):
+        # 拒绝点段，避免经前缀拼接访问到路由表之外的上游路径
+        raise HTTPException(status_code=404, detail="未找到路由")
+    allowed = False
+    for prefix, upstream, target, methods in ROUTES_BY_LENGTH:
+        if path == prefix or path.startswith(prefix + "/"):
+            if method in methods:
+                return upstream, target + path[len(prefix):]
+            allowed = True
+    if allowed:
+        raise HTTPException(status_code=405, detail="不支持的方法")
+    raise HTTPException(status_code=404, detail="未找到路由")
+
+def forward_headers(headers) -> list:
+    """去掉逐跳头部后的原始头部列表（保留重复头，如 set-cookie）"""
+    return [(k, v) for k, v in headers.raw if k.decode("latin-1").lower() not in HOP_BY_HOP_HEADERS]
+
+def decoded_headers(resp: httpx.Response) -> list:
+    """非流式响应的头部: httpx 已按 content-encoding 解码响应体，去掉编码头并按解码后的长度重写 content-length"""
+    headers = [(k, v) for k, v in forward_headers(resp.headers)
+               if k.lower() not in (b"content-encoding", b"content-length")]
+    return headers + [(b"content-length", str(len(resp.content)).encode())]
+
+async def proxy_request(request: Request, upstream: str, path: str):
+    """代理请求到后端服务: 请求体、响应体与头部按原始字节流转发，不做 JSON 解析/重编码"""
+    if request.url.query:
+        path = f"{path}?{request.url.query}"
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    try:
+        resp = await upstreams[upstream].request(
+            request.method, path, stream=True,
+            content=request.stream() if has_body else None,
+            headers=forward_headers(request.headers),
+        )
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"服务不可用: {str(e)}")
+    
+    async def relay():
+        # 客户端断开时 StreamingResponse 不会运行后台任务，生成器结束时也关闭上游响应，及时归还在途名额
         try:
-            if method == "GET":
-                resp = await client.get(url, headers=headers)
-            elif method == "POST":
-                resp = await client.post(url, json=data, headers=headers)
-            elif method == "PUT":
-                resp = await client.put(url, json=data, headers=headers)
-            elif method == "DELETE":
-                resp = await client.delete(url, headers=headers)
-            else:
-                raise HTTPException(status_code=405, detail="不支持的方法")
-            
-            return JSONResponse(content=resp.json(), status_code=resp.status_code)
+            async for chunk in resp.aiter_raw():
+                yield chunk
+        finally:
+            await resp.aclose()
+    
+    response = StreamingResponse(relay(), status_code=resp.status_code, background=BackgroundTask(resp.aclose))
+    response.raw_headers = forward_headers(resp.headers)
+    return response
+
+def cache_key(path: str, query_items) -> tuple:
+    # 缓存条目一律存未压缩的响应体（上游按 identity 请求，仍被压缩时解码后再存），
+    # 键不随客户端的 Accept-Encoding 变化: 仪表板分区与直接代理的 GET 命中同一条目
+    return path, str(sorted(query_items))
+
+def cache_rule_for(request: Request) -> Optional[tuple]:
+    """命中缓存规则且不带用户凭据的 GET 请求返回规则，否则 None"""
+    if not CACHE_ENABLED or request.method != "GET":
+        return None
+    rule = CACHE_RULES.get(request.url.path)
+    if rule is None or rule[0] <= 0:
+        return None
+    if rule[2] and not request.query_params.get(rule[2]):
+        return None
+    if "authorization" in request.headers or "cookie" in request.headers:
+        return None
+    return rule
+
+async def cached_proxy_request(request: Request, upstream: str, path: str, rule: tuple):
+    """经响应缓存代理 GET 请求: 上游响应体整体缓冲（缓存路由均为小体积聚合结果），按未压缩形式缓存"""
+    if request.url.query:
+        path = f"{path}?{request.url.query}"
+    # 不转发客户端的 Accept-Encoding，连接池默认的 identity 生效
+    headers = [(k, v) for k, v in forward_headers(request.headers) if k.lower() != b"accept-encoding"]
+    
+    async def fetch() -> CacheEntry:
+        try:
+            resp = await upstreams[upstream].request("GET", path, headers=headers)
         except httpx.RequestError as e:
             raise HTTPException(status_code=503, detail=f"服务不可用: {str(e)}")
+        return CacheEntry(upstream, resp.status_code, decoded_headers(resp), resp.content)
+    
+    key = cache_key(request.url.path, request.query_params.multi_items())
+    entry, state = await response_cache.get(key, rule[0], rule[1], fetch)
+    response = Response(content=entry.body, status_code=entry.status_code)
+    response.raw_headers = entry.headers + [(b"x-cache", state.encode())]
+    return response
 
 # ===================== 根路由 =====================
 
@@ -67,135 +593,125 @@ async def health():
     """健康检查"""
     return {"status": "healthy"}
 
-# ===================== 认证服务路由 =====================
-
-@app.post("/api/auth/register")
-async def auth_register(request: Request):
-    """用户注册"""
-    data = await request.json()
-    return await proxy_request(f"{AUTH_SERVICE}/register", "POST", data)
-
-@app.post("/api/auth/login")
-async def auth_login(request: Request):
-    """用户登录"""
-    data = await request.json()
-    return await proxy_request(f"{AUTH_SERVICE}/login", "POST", data)
-
-@app.get("/api/auth/me")
-async def auth_me(authorization: str = None):
-    """获取当前用户"""
-    headers = {"Authorization": authorization} if authorization else {}
-    return await proxy_request(f"{AUTH_SERVICE}/me", "GET", headers=headers)
-
-@app.post("/api/auth/regenerate-key")
-async def auth_regenerate_key(authorization: str = None):
-    """重新生成API Key"""
-    headers = {"Authorization": authorization} if authorization else {}
-    return await proxy_request(f"{AUTH_SERVICE}/regenerate-api-key", "POST", headers=headers)
-
-# ===================== 胶囊服务路由 =====================
-
-@app.post("/api/capsules")
-async def create_capsule(request: Request):
-    """创建胶囊"""
-    data = await request.json()
-    return await proxy_request(f"{CAPSULE_SERVICE}/capsules", "POST", data)
-
-@app.get("/api/capsules")
-async def list_capsules(domain: str = None, min_score: float = None, limit: int = 20):
-    """查询胶囊列表"""
-    params = {"limit": limit}
-    if domain: params["domain"] = domain
-    if min_score: params["min_score"] = min_score
-    
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{CAPSULE_SERVICE}/capsules", params=params)
-        return JSONResponse(content=resp.json(), status_code=resp.status_code)
-
-@app.get("/api/capsules/{capsule_id}")
-async def get_capsule(capsule_id: str):
-    """获取单个胶囊"""
-    return await proxy_request(f"{CAPSULE_SERVICE}/capsules/{capsule_id}", "GET")
-
-@app.delete("/api/capsules/{capsule_id}")
-async def delete_capsule(capsule_id: str):
-    """删除胶囊"""
-    return await proxy_request(f"{CAPSULE_SERVICE}/capsules/{capsule_id}", "DELETE")
-
-@app.post("/api/capsules/collisions")
-async def detect_collisions(request: Request):
-    """碰撞检测"""
-    data = await request.json()
-    return await proxy_request(f"{CAPSULE_SERVICE}/collisions", "POST", data)
-
-@app.get("/api/capsules/stats")
-async def capsule_stats():
-    """胶囊统计"""
-    return await proxy_request(f"{CAPSULE_SERVICE}/stats", "GET")
-
-# ===================== 交易服务路由 =====================
-
-@app.post("/api/wallets")
-async def create_wallet(request: Request):
-    """创建钱包"""
-    data = await request.json()
-    return await proxy_request(f"{TRADE_SERVICE}/wallets", "POST", data)
-
-@app.get("/api/wallets/{user_id}")
-async def get_wallet(user_id: str):
-    """查询钱包"""
-    return await proxy_request(f"{TRADE_SERVICE}/wallets/{user_id}", "GET")
-
-@app.post("/api/transfer")
-async def transfer(request: Request):
-    """转账"""
-    data = await request.json()
-    return await proxy_request(f"{TRADE_SERVICE}/transfer", "POST", data)
-
-@app.post("/api/capsules/issue")
-async def issue_capsule(request: Request):
-    """发行胶囊"""
-    data = await request.json()
-    return await proxy_request(f"{TRADE_SERVICE}/issue", "POST", data)
-
-@app.post("/api/capsules/buy")
-async def buy_capsule(request: Request):
-    """购买胶囊"""
-    data = await request.json()
-    return await proxy_request(f"{TRADE_SERVICE}/buy", "POST", data)
-
-@app.get("/api/market")
-async def get_market():
-    """市场概览"""
-    return await proxy_request(f"{TRADE_SERVICE}/market", "GET")
-
-@app.get("/api/transactions/{user_id}")
-async def get_transactions(user_id: str, limit: int = 20):
-    """交易记录"""
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{TRADE_SERVICE}/transactions/{user_id}", params={"limit": limit})
-        return JSONResponse(content=resp.json(), status_code=resp.status_code)
+@app.get("/stats/upstreams")
+async def upstream_stats():
+    """各上游连接池与调用统计"""
+    return {name: upstream.stats() for name, upstream in upstreams.items()}
+
+@app.get("/stats/cache")
+async def cache_stats():
+    """响应缓存统计"""
+    return response_cache.stats()
 
 # ===================== 聚合查询 =====================
 
+# 仪表板分区: (字段, 上游, 路径模板, 查询参数, 失败时的默认值, 可复用缓存的网关路径)
+DASHBOARD_SECTIONS = [
+    ("wallet", "trade", "/wallets/{user_id}", None, None, None),
+    ("recent_capsules", "capsule", "/capsules", {"limit": 10}, [], None),
+    ("recent_transactions", "trade", "/transactions/{user_id}", {"limit": 10}, [], None),
+    ("market", "trade", "/market", None, {}, "/api/market"),
+]
+
+def attempt_ok(task: asyncio.Task) -> bool:
+    return task.exception() is None and task.result().status_code < 500
+
+async def hedged_get(upstream: Upstream, path: str, params: Optional[dict], status: dict) -> httpx.Response:
+    """带对冲的 GET: 首个请求超过对冲延迟未返回、或提前失败（连接错误/5xx）时再发一次，取先成功者
+    最多两次尝试，避免放大故障后端的压力；发出对冲时在 status 中标记 hedged"""
+    attempts = [asyncio.create_task(upstream.request("GET", path, params=params))]
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=upstream.config["hedge_after"])
+        rejected = bool(done) and isinstance(attempts[0].exception(), HTTPException)  # 熔断/限流拒绝，不对冲
+        if not rejected and (not done or not attempt_ok(attempts[0])):
+            status["hedged"] = True
+            upstream.hedges += 1
+            attempts.append(asyncio.create_task(upstream.request("GET", path, params=params)))
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if attempt_ok(task):
+                    return task.result()
+        # 全部失败: 以最后一次尝试的结果为准（5xx 响应或异常）
+        return attempts[-1].result()
+    finally:
+        for task in attempts:
+            task.cancel()
+
+async def fetch_section(user_id: str, section: tuple) -> dict:
+    """取一个分区，返回值与分区状态；分区时限取上游配置与整体时限中较小者"""
+    name, upstream_name, template, params, default, cache_path = section
+    upstream = upstreams[upstream_name]
+    path = template.format(user_id=quote(user_id, safe=""))
+    status = {"upstream": upstream_name, "hedged": False}
+    start = time.perf_counter()
+    
+    async def fetch() -> CacheEntry:
+        resp = await hedged_get(upstream, path, params, status)
+        # 与 /api/market 等直接代理的 GET 共用缓存条目，须带上头部，否则命中时缺 content-type
+        return CacheEntry(upstream_name, resp.status_code, decoded_headers(resp), resp.content)
+    
+    try:
+        timeout = min(upstream.config["fanout_timeout"], DASHBOARD_DEADLINE)
+        rule = CACHE_RULES.get(cache_path) if CACHE_ENABLED and cache_path else None
+        if rule and rule[0] > 0:
+            entry, status["cache"] = await asyncio.wait_for(
+                response_cache.get(cache_key(cache_path, []), rule[0], rule[1], fetch), timeout
+            )
+        else:
+            entry = await asyncio.wait_for(fetch(), timeout)
+        if entry.status_code == 200:
+            value, status["status"] = json.loads(entry.body), "ok"
+        else:
+            value, status["status"], status["status_code"] = default, "error", entry.status_code
+    except asyncio.TimeoutError:
+        value, status["status"] = default, "timeout"
+    except (httpx.RequestError, HTTPException, ValueError) as e:
+        value, status["status"], status["detail"] = default, "unavailable", str(e) or type(e).__name__
+    status["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return {"value": value, "status": status}
+
 @app.get("/api/dashboard/{user_id}")
 async def dashboard(user_id: str):
-    """用户仪表板 - 聚合查询"""
-    async with httpx.AsyncClient() as client:
-        # 并行查询
-        wallet, capsules, transactions = await asyncio.gather(
-            client.get(f"{TRADE_SERVICE}/wallets/{user_id}"),
-            client.get(f"{CAPSULE_SERVICE}/capsules", params={"limit": 10}),
-            client.get(f"{TRADE_SERVICE}/transactions/{user_id}", params={"limit": 10}),
-            client.get(f"{TRADE_SERVICE}/market"),
-        )
-        
-        return {
-            "wallet": wallet.json() if wallet.status_code == 200 else None,
-            "recent_capsules": capsules.json() if capsules.status_code == 200 else [],
-            "recent_transactions": transactions.json() if transactions.status_code == 200 else [],
-            "market": market.json() if market.status_code == 200 else {}
-        }
+    """用户仪表板 - 聚合查询
+    各分区并行获取，慢分区发对冲请求；到整体时限仍未完成的分区按超时处理并返回默认值，
+    页面延迟取决于时限内最慢的分区，sections 给出每个分区的状态"""
+    start = time.perf_counter()
+    tasks = {section[0]: asyncio.create_task(fetch_section(user_id, section)) for section in DASHBOARD_SECTIONS}
+    await asyncio.wait(tasks.values(), timeout=DASHBOARD_DEADLINE)
+    
+    result, sections = {}, {}
+    for name, upstream_name, _, _, default, _ in DASHBOARD_SECTIONS:
+        task = tasks[name]
+        if task.done():
+            section = task.result()
+        else:
+            task.cancel()
+            section = {"value": default, "status": {"upstream": upstream_name, "status": "timeout",
+                                                     "latency_ms": round(DASHBOARD_DEADLINE * 1000, 1)}}
+        result[name] = section["value"]
+        sections[name] = section["status"]
+    
+    result["sections"] = sections
+    result["partial"] = any(status["status"] != "ok" for status in sections.values())
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+# ===================== 透传代理 =====================
+# 须最后注册: 上面的网关自有路由（如仪表板）优先匹配
+
+@app.api_route("/api/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def proxy(path: str, request: Request):
+    """按路由表透传到后端服务"""
+    upstream, target = match_route(request.url.path, request.method)
+    rule = cache_rule_for(request)
+    if rule is not None:
+        return await cached_proxy_request(request, upstream, target, rule)
+    response = await proxy_request(request, upstream, target)
+    if request.method != "GET":
+        response_cache.invalidate(upstream)
+    return response
 
 # ===================== 启动 =====================
 if __name__ == "__main__":
@@ -5,12 +5,13 @@ from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import Optional
-import sqlite3
 import jwt
 import hashlib
 import os
 from datetime import datetime, timedelta
 
+from kai_shared.storage import AsyncStorage, ConnectionPool  # 与胶囊服务共用 SQLite 连接池与异步适配层
+
 # ===================== 配置 =====================
 SECRET_KEY = os.getenv("AUTH_SECRET_KEY", "kai-huangzhong-2026")
 ALGORITHM = "HS256"
@@ -21,36 +22,29 @@ security = HTTPBearer()
 
 # ===================== 数据库 =====================
 DB_PATH = "/Users/wanyview/clawd/auth_service/users.db"
-_db_conn = None
+READ_POOL_SIZE = int(os.getenv("AUTH_READ_POOL_SIZE", "4"))
+pool = ConnectionPool(DB_PATH, readers=READ_POOL_SIZE)
+db = AsyncStorage(pool)  # 查询经线程池执行，不阻塞事件循环
 
 def init_db():
     """初始化数据库"""
-    global _db_conn
-    _db_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cursor = _db_conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            api_key TEXT UNIQUE,
-            role TEXT DEFAULT 'user',
-            created_at TEXT,
-            updated_at TEXT
-        )
-    ''')
-    _db_conn.commit()
+    with pool.writer() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                api_key TEXT UNIQUE,
+                role TEXT DEFAULT 'user',
+                created_at TEXT,
+                updated_at TEXT
+            )
+        ''')
+        conn.commit()
 
 init_db()
 
-def get_db():
-    """获取数据库连接（线程安全）"""
-    global _db_conn
-    if _db_conn is None:
-        _db_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    return _db_conn
-
 # ===================== 数据模型 =====================
 class UserCreate(BaseModel):
     username: str
@@ -113,11 +107,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 
 async def get_admin_user(current_user: str = Depends(get_current_user)):
     """管理员权限检查"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE username = ?", (current_user,))
-    row = cursor.fetchone()
-    conn.close()
+    row = await db.fetchone("SELECT role FROM users WHERE username = ?", (current_user,))
     if row is None or row[0] != "admin":
         raise HTTPException(status_code=403, detail="需要管理员权限")
     return current_user
@@ -125,32 +115,33 @@ async def get_admin_user(current_user: str = Depends(get_current_user)):
 # ===================== API路由 =====================
 
 @app.post("/register", response_model=UserResponse)
-async def register(user: UserCreate, conn = Depends(get_db)):
+async def register(user: UserCreate):
     """用户注册"""
-    cursor = conn.cursor()
-    
-    # 检查用户名
-    cursor.execute("SELECT id FROM users WHERE username = ?", (user.username,))
-    if cursor.fetchone():
-        raise HTTPException(status_code=400, detail="用户名已存在")
-    
-    # 检查邮箱
-    cursor.execute("SELECT id FROM users WHERE email = ?", (user.email,))
-    if cursor.fetchone():
-        raise HTTPException(status_code=400, detail="邮箱已存在")
-    
-    # 创建用户
     now = datetime.utcnow().isoformat()
     password_hash = hash_password(user.password)
     api_key = generate_api_key()
     
-    cursor.execute('''
-        INSERT INTO users (username, email, password_hash, api_key, role, created_at, updated_at)
-        VALUES (?, ?, ?, ?, 'user', ?, ?)
-    ''', (user.username, user.email, password_hash, api_key, now, now))
+    def create(conn):
+        cursor = conn.cursor()
+        
+        # 检查用户名
+        cursor.execute("SELECT id FROM users WHERE username = ?", (user.username,))
+        if cursor.fetchone():
+            raise HTTPException(status_code=400, detail="用户名已存在")
+        
+        # 检查邮箱
+        cursor.execute("SELECT id FROM users WHERE email = ?", (user.email,))
+        if cursor.fetchone():
+            raise HTTPException(status_code=400, detail="邮箱已存在")
+        
+        # 创建用户
+        cursor.execute('''
+            INSERT INTO users (username, email, password_hash, api_key, role, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'user', ?, ?)
+        ''', (user.username, user.email, password_hash, api_key, now, now))
+        return cursor.lastrowid
     
-    conn.commit()
-    user_id = cursor.lastrowid
+    user_id = await db.run_write(create)
     
     return {
         "id": user_id,
@@ -161,17 +152,15 @@ async def register(user: UserCreate, conn = Depends(get_db)):
     }
 
 @app.post("/login", response_model=Token)
-async def login(user: UserLogin, conn = Depends(get_db)):
+async def login(user: UserLogin):
     """用户登录"""
-    cursor = conn.cursor()
     password_hash = hash_password(user.password)
     
-    cursor.execute('''
+    row = await db.fetchone('''
         SELECT id, username, role FROM users 
         WHERE username = ? AND password_hash = ?
     ''', (user.username, password_hash))
     
-    row = cursor.fetchone()
     if row is None:
         raise HTTPException(status_code=401, detail="用户名或密码错误")
     
@@ -179,14 +168,12 @@ async def login(user: UserLogin, conn = Depends(get_db)):
     return {"access_token": access_token}
 
 @app.get("/me", response_model=UserResponse)
-async def get_me(current_user: str = Depends(get_current_user), conn = Depends(get_db)):
+async def get_me(current_user: str = Depends(get_current_user)):
     """获取当前用户信息"""
-    cursor = conn.cursor()
-    cursor.execute('''
+    row = await db.fetchone('''
         SELECT id, username, email, api_key, role FROM users WHERE username = ?
     ''', (current_user,))
     
-    row = cursor.fetchone()
     if row is None:
         raise HTTPException(status_code=404, detail="用户不存在")
     
@@ -199,25 +186,21 @@ async def get_me(current_user: str = Depends(get_current_user), conn = Depends(g
     }
 
 @app.post("/regenerate-api-key")
-async def regenerate_api_key(current_user: str = Depends(get_current_user), conn = Depends(get_db)):
+async def regenerate_api_key(current_user: str = Depends(get_current_user)):
     """重新生成API密钥"""
-    cursor = conn.cursor()
     new_api_key = generate_api_key()
     now = datetime.utcnow().isoformat()
     
-    cursor.execute('''
+    await db.execute('''
         UPDATE users SET api_key = ?, updated_at = ? WHERE username = ?
     ''', (new_api_key, now, current_user))
     
-    conn.commit()
     return {"api_key": new_api_key}
 
 @app.get("/users")
-async def list_users(_admin = Depends(get_admin_user), conn = Depends(get_db)):
+async def list_users(_admin = Depends(get_admin_user)):
     """列出所有用户（仅管理员）"""
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, email, role, created_at FROM users")
-    rows = cursor.fetchall()
+    rows = await db.fetchall("SELECT id, username, email, role, created_at FROM users")
     return {"users": [dict(row) for row in rows]}
 
 # ===================== 启动 =====================
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+组提交基准: 并发单条创建在「每请求一次提交」与不同组大小的组提交下的吞吐与延迟
+每种配置使用全新的临时库，写连接 synchronous=FULL（确认即持久）
+用法: python bench_group_commit.py [--requests 2000] [--concurrency 64] [--sizes 1,4,16,64,256] [--wait-ms 5] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# 使用临时库，避免污染正式数据
+_tmpdir = tempfile.mkdtemp(prefix="capsule_bench_")
+os.environ["CAPSULE_DB_PATH"] = os.path.join(_tmpdir, "bench.db")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main  # noqa: E402
+from kai_shared.storage import GroupCommitter  # noqa: E402
+
+PHRASES = [
+    "知识胶囊把一次深度思考压缩成可检索的最小单元",
+    "市场情绪在短期内主导价格波动",
+    "注意力机制让模型关注上下文中最相关的部分",
+    "复利效应需要足够长的时间才能显现",
+    "第一性原理要求回到问题最基本的事实",
+    "分布式系统中的一致性与可用性需要取舍",
+]
+DOMAINS = ("科技", "商业", "投资", "哲学")
+
+
+def make_records(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    records = [main.build_capsule_record(main.CapsuleCreate(
+        title=f"组提交样本 {seed}-{i}",
+        content="。".join(rng.choice(PHRASES) for _ in range(6)) + f"（{i}）",
+        domain=DOMAINS[i % len(DOMAINS)],
+        tags=[f"t{rng.randrange(40)}", f"g{i % 7}"],
+    )) for i in range(n)]
+    # CPU 预计算不计入写入耗时
+    main.prepare_records(records, main.shards[0])
+    return records
+
+
+def fresh_shard(name: str) -> "main.Shard":
+    shard = main.Shard(0, os.path.join(_tmpdir, f"{name}.db"))
+    main.init_db(shard)
+    main.sync_vectors(shard)
+    with shard.pool.writer() as conn:
+        conn.execute("PRAGMA synchronous=FULL")
+    return shard
+
+
+async def drive(submit, records: list, concurrency: int) -> dict:
+    """concurrency 个并发客户端各自逐条提交，统计吞吐与单请求延迟"""
+    queue = list(reversed(records))
+    latencies = []
+
+    async def client():
+        while queue:
+            record = queue.pop()
+            start = time.perf_counter()
+            await submit(record)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rows_per_s": round(len(records) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 2),
+    }
+
+
+async def run(args) -> list:
+    results = []
+
+    shard = fresh_shard("per_request")
+    records = make_records(args.requests, seed=0)
+
+    async def per_request(record):
+        await shard.db.run_write(lambda conn: main.insert_capsule_records(conn.cursor(), [record], shard))
+
+    results.append({"mode": "per_request", **await drive(per_request, records, args.concurrency)})
+
+    for size in args.sizes:
+        shard = fresh_shard(f"group_{size}")
+        committer = GroupCommitter(shard.db, lambda items, shard=shard: main.write_group(items, shard),
+                                   max_rows=size, max_wait_ms=args.wait_ms)
+        records = make_records(args.requests, seed=size)
+        stats = await drive(committer.submit, records, args.concurrency)
+        await committer.close()
+        results.append({"mode": f"group_{size}", **stats, "avg_group": committer.stats()["avg_group"]})
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=[1, 4, 16, 64, 256])
+    parser.add_argument("--wait-ms", type=float, default=5.0)
+    parser.add_argument("--json", help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    print(f"requests={args.requests}, concurrency={args.concurrency}, wait_ms={args.wait_ms}, 临时目录 {_tmpdir}")
+    results = asyncio.run(run(args))
+    baseline = results[0]["rows_per_s"]
+    for row in results:
+        print(f"  {row['mode']:<12} {row['rows_per_s']:>9} 条/秒  x{row['rows_per_s'] / baseline:<5.1f}"
+              f" p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms"
+              + (f"  平均组大小 {row['avg_group']}" if "avg_group" in row else ""))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+列表响应序列化基准: 预序列化响应体拼接 vs. 逐行解析 + Pydantic 校验 + JSON 编码
+用法: python bench_serialization.py [--capsules 2000] [--limit 100] [--rounds 200]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# 使用临时库，避免污染正式数据
+_tmpdir = tempfile.mkdtemp(prefix="capsule_bench_")
+os.environ["CAPSULE_DB_PATH"] = os.path.join(_tmpdir, "bench.db")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from typing import List  # noqa: E402
+
+import main  # noqa: E402
+
+LIST_ADAPTER = TypeAdapter(List[main.CapsuleResponse])
+PARAGRAPH = "知识胶囊把一次深度思考压缩成可检索、可碰撞、可交易的最小单元。" * 12
+
+
+def seed(n: int):
+    records = [main.build_capsule_record(main.CapsuleCreate(
+        title=f"基准胶囊 {i}",
+        content=f"{PARAGRAPH}\n第{i}号样本",
+        domain=("科技", "商业", "投资", "哲学")[i % 4],
+        tags=["基准", f"t{i % 50}", f"g{i % 7}"],
+    )) for i in range(n)]
+    for start in range(0, n, main.BULK_CHUNK_SIZE):
+        chunk = list(enumerate(records[start:start + main.BULK_CHUNK_SIZE], start))
+        for shard, sub in main.group_by_shard(chunk):
+            main.write_capsule_chunk(sub, shard)
+
+
+def legacy_path(limit: int) -> bytes:
+    """原路径: SELECT * -> dict -> json.loads(tags) -> response_model 校验 -> JSON"""
+    with main.shards[0].pool.reader() as conn:
+        rows = conn.execute("SELECT * FROM capsules_full ORDER BY created_at DESC, id DESC LIMIT ?", (limit,)).fetchall()
+    validated = LIST_ADAPTER.validate_python([main.row_to_capsule(row) for row in rows])
+    return JSONResponse(content=jsonable_encoder(validated)).body
+
+
+def blob_path(limit: int) -> bytes:
+    """新路径: 读取预序列化响应体、拼入正文并拼接"""
+    with main.shards[0].pool.reader() as conn:
+        rows = conn.execute(
+            f"SELECT {main.CAPSULE_BODY_SQL} AS body FROM capsules c "
+            "JOIN capsule_json j ON j.capsule_id = c.id JOIN capsule_content t ON t.capsule_id = c.id "
+            "ORDER BY c.created_at DESC, c.id DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return main.json_array(row['body'] for row in rows)
+
+
+def measure(fn, limit: int, rounds: int) -> dict:
+    fn(limit)  # 预热
+    samples = []
+    cpu_start = time.process_time()
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(limit)
+        samples.append((time.perf_counter() - start) * 1000)
+    cpu_ms = (time.process_time() - cpu_start) * 1000 / rounds
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        "cpu_ms_per_request": round(cpu_ms, 3),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--capsules", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"写入 {args.capsules} 个胶囊到 {main.DB_PATH} ...")
+    seed(args.capsules)
+
+    assert json.loads(legacy_path(args.limit)) == json.loads(blob_path(args.limit)), "两条路径输出不一致"
+
+    legacy = measure(legacy_path, args.limit, args.rounds)
+    blob = measure(blob_path, args.limit, args.rounds)
+    print(f"list limit={args.limit}, rounds={args.rounds}")
+    print(f"  原路径      : {legacy}")
+    print(f"  预序列化路径: {blob}")
+    print(f"  CPU 加速比  : {legacy['cpu_ms_per_request'] / max(blob['cpu_ms_per_request'], 1e-9):.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+capsule_service 基准套件
+在合成语料库（corpus.py）上分别经进程内 ASGI 与真实 HTTP 压测 list / get / collisions / stats / create，
+输出 p50/p95/p99 延迟与吞吐到 JSON；指定基线时，任一场景超出容差即以非零状态退出
+
+语料库按 (规模, seed, 分片数) 生成一次后缓存在 --data-dir，每次运行复制一份工作副本，
+create 场景的写入不会污染缓存语料。首次生成为批量灌库: 分块单事务写入（签名、向量、评分走与服务写入相同的
+prepare_records），全部写入后再单独一遍计算碰撞；
+两阶段的实测耗时存于语料目录的 seed.json，写入结果的 meta.seeding，实际灌入的条数见 meta.corpus_rows
+
+用法:
+  python bench_suite.py --size 10000 --out bench_baseline.json          # 生成/更新基线
+  python bench_suite.py --size 10000 --baseline bench_baseline.json     # 回退检查
+  python bench_suite.py --size 100000 --transport http --requests 2000
+  python bench_suite.py --size 100000 --requests 500 --baseline bench_baseline_100k.json  # 10 万条基线（单核）
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from corpus import CorpusGenerator  # noqa: E402
+from keywords import select_keywords, term_counts, term_positions  # noqa: E402
+from minhash import LSH_BANDS  # noqa: E402
+
+SCENARIOS = ("list", "get", "collisions", "stats", "create")
+TRANSPORTS = ("inproc", "http")
+SEED_CHUNK = 500
+ID_SAMPLE = 2000
+KEYWORD_SAMPLE = "人工智能正在改变世界。深度学习和大模型带来新的机遇。"
+
+
+# ===================== 语料库 =====================
+def corpus_dir(args) -> str:
+    shards = int(os.getenv("CAPSULE_SHARDS", "1"))
+    return os.path.join(args.data_dir, f"corpus_{args.size}_s{args.seed}_x{shards}")
+
+
+def prepare_workdir(args) -> str:
+    """复制缓存的语料库到工作目录；缓存不存在时返回空工作目录，由 seed_corpus 生成"""
+    workdir = tempfile.mkdtemp(prefix="capsule_bench_run_")
+    cached = corpus_dir(args)
+    if os.path.exists(os.path.join(cached, "READY")):
+        shutil.copytree(cached, workdir, dirs_exist_ok=True)
+    return workdir
+
+
+def seed_chunks(main, args):
+    """合成语料 -> [(序号, 待写入记录)] 分块"""
+    chunk = []
+    for i, item in enumerate(CorpusGenerator(args.seed).generate(args.size)):
+        record = main.build_capsule_record(main.CapsuleCreate(**{k: v for k, v in item.items() if k != "created_at"}))
+        record["created_at"] = record["updated_at"] = item["created_at"]
+        chunk.append((i, record))
+        if len(chunk) >= SEED_CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed_corpus(main, args, workdir: str):
+    """批量灌入语料并缓存: 分块单事务写入（评分、标签、向量、签名照常），
+    写完后单独一遍计算碰撞；两阶段耗时写入 seed.json"""
+    with main.shards[0].pool.reader() as conn:
+        existing = conn.execute("SELECT COUNT(*) FROM capsules").fetchone()[0]
+    if existing and os.path.exists(os.path.join(workdir, "READY")):
+        return
+    started = time.perf_counter()
+    written = 0
+    for chunk in seed_chunks(main, args):
+        for shard, sub in main.group_by_shard(chunk):
+            main.write_capsule_chunk(sub, shard)
+        written += len(chunk)
+        rate = written / (time.perf_counter() - started)
+        print(f"\r  灌入 {written}/{args.size}（{rate:.0f} 条/秒）", end="", file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+    inserted = time.perf_counter()
+
+    print("  计算碰撞…", file=sys.stderr, flush=True)
+    if main.collision_builder is not None:
+        main.collision_builder.drain()
+    finished = time.perf_counter()
+    for shard in main.shards:
+        with shard.pool.writer() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    insert_s, collisions_s = inserted - started, finished - inserted
+    timings = {
+        "rows": written,
+        "insert_s": round(insert_s, 2),
+        "insert_rows_per_s": round(written / insert_s, 1) if insert_s else 0,
+        "collisions_s": round(collisions_s, 2),
+        "collision_rows_per_s": round(written / collisions_s, 1) if collisions_s else 0,
+        "total_s": round(finished - started, 2),
+    }
+    print(f"  灌库 {timings}", file=sys.stderr)
+    with open(os.path.join(workdir, "seed.json"), "w") as f:
+        json.dump(timings, f)
+    open(os.path.join(workdir, "READY"), "w").close()
+    shutil.copytree(workdir, corpus_dir(args), dirs_exist_ok=True)
+
+
+def seed_timings(workdir: str) -> dict:
+    """语料生成时记录的灌库耗时（缓存语料沿用首次生成的记录）"""
+    path = os.path.join(workdir, "seed.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def corpus_rows(main) -> int:
+    """工作副本中实际的胶囊条数（各分片之和），即本次结果所对应的语料规模"""
+    total = 0
+    for shard in main.shards:
+        with shard.pool.reader() as conn:
+            total += conn.execute("SELECT COUNT(*) FROM capsules").fetchone()[0]
+    return total
+
+
+def sample_ids(main, n: int, seed: int) -> list:
+    ids = []
+    for shard in main.shards:
+        with shard.pool.reader() as conn:
+            ids.extend(row[0] for row in conn.execute("SELECT id FROM capsules ORDER BY rowid"))
+    return random.Random(seed).sample(ids, min(n, len(ids)))
+
+
+# ===================== 自检 =====================
+def self_checks(main) -> list:
+    """灌入语料后的自检: 热路径查询计划与搜索冒烟，返回问题列表（非空时整轮按回退处理）"""
+    problems = []
+    params = [0] * (2 * LSH_BANDS) + [""]
+    for shard in main.shards:
+        with shard.pool.reader() as conn:
+            plan = [row[3] for row in conn.execute(
+                "EXPLAIN QUERY PLAN " + main.content_candidates_sql(LSH_BANDS), params
+            )]
+        if not any(step.startswith("SEARCH l USING PRIMARY KEY") for step in plan):
+            problems.append(f"分片 {shard.index}: 内容碰撞的 LSH 召回未按主键查找: {' / '.join(plan)}")
+
+    # 搜索: 取一个标题的首个汉字与前两个汉字，单字（前缀查询）与二元组短语都必须有结果
+    with main.shards[0].pool.reader() as conn:
+        title = conn.execute("SELECT title FROM capsules ORDER BY rowid LIMIT 1").fetchone()
+        hans = [ch for ch in (title[0] if title else "") if main._CJK_CHAR.match(ch)]
+        for q in (hans[:1], hans[:2]) if len(hans) >= 2 else ():
+            q = "".join(q)
+            hits = conn.execute("SELECT COUNT(*) FROM capsules_fts WHERE capsules_fts MATCH ?", (main.fts_query(q),)).fetchone()[0]
+            if not hits:
+                problems.append(f"搜索 q={q} 无结果（MATCH {main.fts_query(q)}）")
+
+    # 自动标签: 无语料统计时示例句应切出完整的二字词，而不是跨词边界的三字片段（「工智能」「改变世」）
+    expected = ["人工", "智能", "改变", "世界", "深度"]
+    got = select_keywords(term_counts("", KEYWORD_SAMPLE), {}, 0, positions=term_positions("", KEYWORD_SAMPLE))
+    if got != expected:
+        problems.append(f"自动标签: 示例句得到 {got}，应为 {expected}")
+    return problems
+
+
+# ===================== 场景 =====================
+def make_scenarios(ids: list, domains: list, args) -> dict:
+    generator = CorpusGenerator(args.seed + 1)
+    counter = iter(range(args.size, 1 << 62))
+
+    def op_list(rng):
+        params = {"limit": 20}
+        if rng.random() < 0.5:
+            params["domain"] = rng.choice(domains)
+        return "GET", "/capsules", {"params": params}
+
+    def op_get(rng):
+        return "GET", f"/capsules/{rng.choice(ids)}", {}
+
+    def op_collisions(rng):
+        mode = rng.choice(("tags", "content", "semantic"))
+        return "GET", f"/collisions/{rng.choice(ids)}", {"params": {"mode": mode}}
+
+    def op_stats(rng):
+        return "GET", "/stats", {}
+
+    def op_create(rng):
+        item = generator.capsule(next(counter))
+        item.pop("created_at")
+        return "POST", "/capsules", {"json": item}
+
+    return {"list": op_list, "get": op_get, "collisions": op_collisions, "stats": op_stats, "create": op_create}
+
+
+async def run_scenario(client: httpx.AsyncClient, op, requests: int, concurrency: int, seed: int) -> dict:
+    """concurrency 个并发客户端共执行 requests 次操作"""
+    rng = random.Random(seed)
+    plan = [op(rng) for _ in range(requests)]
+    plan.reverse()
+    latencies, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        while plan:
+            method, url, kwargs = plan.pop()
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": pct(0.5),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+async def run_transport(client: httpx.AsyncClient, scenarios: dict, args) -> dict:
+    results = {}
+    # create 放在最后，避免写入影响读场景
+    for name in sorted(args.scenarios, key=lambda s: s == "create"):
+        await run_scenario(client, scenarios[name], min(args.warmup, args.requests), args.concurrency, args.seed - 1)
+        results[name] = await run_scenario(client, scenarios[name], args.requests, args.concurrency, args.seed)
+        print(f"  {name:<11} {results[name]}", file=sys.stderr)
+    return results
+
+
+def start_server(workdir: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ, CAPSULE_DB_PATH=os.path.join(workdir, "capsules.db"))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env,
+    )
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("HTTP 服务启动超时")
+
+
+# ===================== 基线比较 =====================
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """返回回退项: p95 变慢或吞吐下降超过容差"""
+    regressions = []
+    for transport, scenarios in results.items():
+        for name, current in scenarios.items():
+            base = baseline.get("results", {}).get(transport, {}).get(name)
+            if base is None:
+                continue
+            if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{transport}/{name}: p95 {base['p95_ms']} -> {current['p95_ms']} ms")
+            if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+                regressions.append(f"{transport}/{name}: 吞吐 {base['throughput_rps']} -> {current['throughput_rps']} rps")
+            if current["errors"] > base["errors"]:
+                regressions.append(f"{transport}/{name}: 错误数 {base['errors']} -> {current['errors']}")
+    return regressions
+
+
+async def run(args) -> dict:
+    workdir = prepare_workdir(args)
+    os.environ["CAPSULE_DB_PATH"] = os.path.join(workdir, "capsules.db")
+    import main  # 须在设置数据库路径之后导入
+
+    seed_corpus(main, args, workdir)
+    seeding = seed_timings(workdir)
+    rows = corpus_rows(main)
+    if rows != args.size:
+        print(f"警告: 语料实际 {rows} 条，与 --size {args.size} 不一致，结果按 {rows} 条解读", file=sys.stderr)
+    checks = self_checks(main)
+    ids = sample_ids(main, ID_SAMPLE, args.seed)
+    with main.shards[0].pool.reader() as conn:
+        domains = [row[0] for row in conn.execute("SELECT domain FROM domain_stats")] or ["general"]
+    scenarios = make_scenarios(ids, domains, args)
+
+    results = {}
+    if "inproc" in args.transport:
+        print("进程内（ASGI）:", file=sys.stderr)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            results["inproc"] = await run_transport(client, scenarios, args)
+    if "http" in args.transport:
+        print(f"HTTP（uvicorn :{args.port}）:", file=sys.stderr)
+        server = start_server(workdir, args.port)
+        try:
+            limits = httpx.Limits(max_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=300, limits=limits) as client:
+                results["http"] = await run_transport(client, scenarios, args)
+        finally:
+            server.terminate()
+            server.wait()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "size": args.size,
+            "corpus_rows": rows,
+            "seed": args.seed,
+            "shards": main.SHARD_COUNT,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seeding": seeding,
+        },
+        "checks": checks,
+        "results": results,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=10000, help="语料规模，如 10000 / 100000 / 1000000")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "capsule_bench"))
+    parser.add_argument("--transport", type=lambda v: v.split(","), default=list(TRANSPORTS))
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500, help="每个场景的请求数")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--out", help="结果 JSON 输出路径")
+    parser.add_argument("--baseline", help="基线 JSON，超出容差时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的相对回退幅度")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"未知场景: {name}")
+    for name in args.transport:
+        if name not in TRANSPORTS:
+            parser.error(f"未知传输方式: {name}")
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if report["checks"]:
+        print("自检失败:", file=sys.stderr)
+        for line in report["checks"]:
+            print(f"  {line}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("size") != args.size:
+            print(f"警告: 基线语料规模 {baseline.get('meta', {}).get('size')} 与本次 {args.size} 不一致", file=sys.stderr)
+        regressions = compare(report["results"], baseline, args.tolerance)
+        if regressions:
+            print("性能回退:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print(f"未发现超过 {args.tolerance:.0%} 的回退", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,104 @@
+"""
+进程内 LRU 缓存
+按胶囊 ID 缓存序列化后的响应体，带命中/未命中计数；
+每个键有失效代数，回源读取期间键被失效时丢弃读到的旧值
+"""
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import threading
+
+
+class LRUCache:
+    """线程安全的定长 LRU"""
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+        # 键 -> 最近一次失效时的代数（全局单调递增）；超出容量时淘汰最旧的记录并把下限抬到其代数，
+        # 没有记录的键按下限计，保证代数只增不减
+        self._generations: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _put(self, key: Hashable, value: Any):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key: Hashable, value: Any):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._put(key, value)
+
+    def generation(self, key: Hashable) -> int:
+        """回源读取前取键的当前代数，读完后交给 put_if_current"""
+        with self._lock:
+            return self._generations.get(key, self._floor)
+
+    def put_if_current(self, key: Hashable, value: Any, generation: int) -> bool:
+        """读取期间键未被失效才写入；否则读到的可能是失效前的旧值，丢弃"""
+        if self.capacity <= 0:
+            return False
+        with self._lock:
+            if self._generations.get(key, self._floor) != generation:
+                self.stale_puts += 1
+                return False
+            self._put(key, value)
+            return True
+
+    def _bump(self, key: Hashable):
+        self._clock += 1
+        self._generations[key] = self._clock
+        self._generations.move_to_end(key)
+        while len(self._generations) > max(self.capacity, 1):
+            _, generation = self._generations.popitem(last=False)
+            self._floor = generation
+
+    def invalidate(self, *keys: Hashable):
+        with self._lock:
+            for key in keys:
+                self._bump(key)
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+            # 全部键失效: 抬高下限并清空逐键记录
+            self._clock += 1
+            self._floor = self._clock
+            self._generations.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+合成语料 - 基准测试用的中文知识胶囊
+领域按偏斜权重抽样，标签服从 Zipf 分布（少数热门标签 + 长尾），正文由领域词表套句式生成、
+长度近似对数正态；约 5% 为已有胶囊的改写，用于触发内容碰撞。同一 seed 生成的语料完全一致
+用法: python corpus.py --size 10000 [--seed 42] --out corpus.ndjson   （可直接 POST 到 /capsules/bulk）
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List
+import argparse
+import bisect
+import itertools
+import json
+import math
+import random
+
+# ===================== 参数 =====================
+DOMAIN_WEIGHTS = {
+    "科技": 0.28, "商业": 0.18, "投资": 0.14, "哲学": 0.1,
+    "历史": 0.1, "医学": 0.08, "教育": 0.07, "general": 0.05,
+}
+ZIPF_EXPONENT = 1.1        # 标签热度分布
+NEAR_DUPLICATE_RATE = 0.05
+UNTAGGED_RATE = 0.1        # 不带标签、走自动关键词抽取的比例
+SENTENCES_MEDIAN = 8       # 正文句数中位数
+SENTENCES_SIGMA = 0.6      # 句数对数正态分布的 sigma
+START_TIME = datetime(2025, 1, 1)
+SPAN_SECONDS = 600 * 24 * 3600
+
+VOCAB: Dict[str, List[str]] = {
+    "科技": ["人工智能", "大模型", "注意力机制", "向量检索", "分布式系统", "一致性协议", "芯片", "算力",
+             "开源社区", "编译器", "数据库", "缓存", "微服务", "边缘计算", "量子计算", "强化学习",
+             "知识图谱", "操作系统", "网络协议", "推荐系统", "机器人", "自动驾驶", "云原生", "存储引擎"],
+    "商业": ["商业模式", "用户增长", "渠道", "品牌", "定价", "供应链", "组织管理", "现金流", "客户留存",
+             "网络效应", "平台", "护城河", "单位经济", "规模效应", "产品市场匹配", "销售漏斗", "企业文化"],
+    "投资": ["复利", "估值", "安全边际", "资产配置", "风险溢价", "市场情绪", "周期", "流动性", "利率",
+             "指数基金", "价值投资", "成长股", "回撤", "杠杆", "分散化", "现金流折现", "市盈率"],
+    "哲学": ["第一性原理", "认识论", "存在主义", "辩证法", "自由意志", "伦理", "逻辑", "怀疑论",
+             "实用主义", "意识", "因果", "语言哲学", "斯多葛", "道家", "心学", "现象学"],
+    "历史": ["工业革命", "丝绸之路", "文艺复兴", "王朝更替", "科举制度", "大航海时代", "印刷术",
+             "城邦", "变法", "冷战", "殖民", "货币史", "启蒙运动", "农业革命", "帝国兴衰"],
+    "医学": ["免疫系统", "临床试验", "慢性病", "睡眠", "营养", "肠道菌群", "基因编辑", "疫苗",
+             "流行病学", "运动医学", "神经科学", "循证医学", "抗生素", "代谢", "心血管"],
+    "教育": ["刻意练习", "费曼学习法", "间隔重复", "元认知", "教育公平", "课程设计", "终身学习",
+             "阅读能力", "项目式学习", "评价体系", "学习动机", "认知负荷", "师生关系", "通识教育"],
+    "general": ["效率", "习惯", "沟通", "写作", "决策", "时间管理", "系统思维", "复盘", "协作", "专注"],
+}
+TEMPLATES = [
+    "{a}的核心在于{b}，而不是表面上的{c}。",
+    "在{a}领域，{b}往往决定了{c}的上限。",
+    "理解{a}需要先拆解{b}与{c}之间的关系。",
+    "很多人高估了{a}的短期作用，却低估了{b}的长期影响。",
+    "{a}和{b}看似无关，实际上都受{c}约束。",
+    "如果把{a}看作一个系统，{b}就是其中的反馈回路。",
+    "历史经验表明，{a}的突破通常伴随着{b}的成熟。",
+    "评估{a}时，应当同时考虑{b}和{c}的成本。",
+    "{a}不是孤立存在的，它依赖于{b}提供的基础。",
+    "从{a}到{b}的迁移，本质上是一次{c}的重构。",
+]
+CROSS_DOMAIN_RATE = 0.15   # 句子借用其它领域词汇的概率（制造跨领域碰撞）
+
+
+# ===================== 抽样 =====================
+class _Weighted:
+    """按累计权重二分抽样"""
+
+    def __init__(self, items: List, weights: List[float]):
+        self.items = items
+        self.cumulative = list(itertools.accumulate(weights))
+
+    def pick(self, rng: random.Random):
+        return self.items[bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+def _zipf(items: List[str]) -> _Weighted:
+    return _Weighted(items, [1 / (rank ** ZIPF_EXPONENT) for rank in range(1, len(items) + 1)])
+
+
+# ===================== 生成 =====================
+class CorpusGenerator:
+    """确定性的合成胶囊流；第 i 条只依赖 (seed, i) 与之前的少量状态"""
+
+    def __init__(self, seed: int = 42):
+        self.seed = seed
+        self.domains = _Weighted(list(DOMAIN_WEIGHTS), list(DOMAIN_WEIGHTS.values()))
+        self.terms = {domain: _zipf(terms) for domain, terms in VOCAB.items()}
+        self.all_terms = [t for terms in VOCAB.values() for t in terms]
+        self._recent: List[dict] = []
+
+    def _sentence(self, rng: random.Random, domain: str) -> str:
+        def term():
+            if rng.random() < CROSS_DOMAIN_RATE:
+                return rng.choice(self.all_terms)
+            return self.terms[domain].pick(rng)
+        return rng.choice(TEMPLATES).format(a=term(), b=term(), c=term())
+
+    def capsule(self, i: int) -> dict:
+        """第 i 条胶囊（CapsuleCreate 字段 + created_at）"""
+        rng = random.Random(self.seed * 1_000_003 + i)
+        created_at = (START_TIME + timedelta(seconds=rng.randrange(SPAN_SECONDS))).isoformat()
+        if self._recent and rng.random() < NEAR_DUPLICATE_RATE:
+            # 改写: 沿用某条近期胶囊的大部分句子，替换一句
+            base = rng.choice(self._recent)
+            sentences = base["content"].split("。")[:-1]
+            sentences[rng.randrange(len(sentences))] = self._sentence(rng, base["domain"])[:-1]
+            capsule = dict(base, title=base["title"] + "（修订）", content="。".join(sentences) + "。",
+                           created_at=created_at)
+            return capsule
+
+        domain = self.domains.pick(rng)
+        n_sentences = max(2, round(math.exp(rng.gauss(math.log(SENTENCES_MEDIAN), SENTENCES_SIGMA))))
+        content = "".join(self._sentence(rng, domain) for _ in range(n_sentences))
+        focus = self.terms[domain].pick(rng)
+        tags = [] if rng.random() < UNTAGGED_RATE else sorted({
+            self.terms[domain].pick(rng) for _ in range(rng.randint(2, 5))
+        })
+        capsule = {
+            "title": f"{focus}：{self._sentence(rng, domain)[:-1][:24]}",
+            "content": content,
+            "domain": domain,
+            "tags": tags,
+            "author": f"作者{rng.randrange(500)}",
+            "source": rng.choice([None, "读书笔记", "播客", "论文", "对话"]),
+            "created_at": created_at,
+        }
+        self._recent.append(capsule)
+        if len(self._recent) > 256:
+            self._recent.pop(0)
+        return capsule
+
+    def generate(self, n: int, start: int = 0) -> Iterator[dict]:
+        for i in range(start, start + n):
+            yield self.capsule(i)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", required=True, help="输出 NDJSON 文件")
+    args = parser.parse_args()
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        for capsule in CorpusGenerator(args.seed).generate(args.size):
+            f.write(json.dumps(capsule, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main_cli()
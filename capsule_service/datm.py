@@ -0,0 +1,114 @@
+"""
+DATM 评分引擎 - 确定性、批量向量化
+从内容特征计算 真(truth) / 善(goodness) / 美(beauty) / 智(intelligence) 四维评分
+"""
+from typing import Dict, List
+import hashlib
+import re
+
+import numpy as np
+
+# ===================== 参数 =====================
+SCORER_VERSION = 1        # 特征或权重变化时递增，触发全量重评
+DIMENSIONS = ("truth", "goodness", "beauty", "intelligence")
+SCORE_FLOOR = 50.0
+SCORE_RANGE = 48.0        # 评分落在 [50, 98]
+
+_EVIDENCE_WORDS = ("研究", "实验", "数据", "证据", "论文", "证明", "统计", "引用", "报告",
+                   "study", "data", "evidence", "research", "experiment")
+_ACTION_WORDS = ("建议", "方法", "步骤", "实践", "如何", "应用", "技巧", "操作", "应该",
+                 "how to", "should", "step", "tip")
+_INSIGHT_WORDS = ("本质", "原理", "洞见", "思维", "为什么", "因为", "所以", "模型", "框架", "第一性",
+                  "why", "because", "principle", "insight")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?%?")
+_LIST_MARKER = re.compile(r"^\s*(?:\d+[.、)]|[-*•]|【)", re.MULTILINE)
+_SENTENCE_END = re.compile(r"[。！？!?.]+")
+
+# 特征 × 维度 权重矩阵，列顺序同 DIMENSIONS
+_FEATURES = ("length", "numbers", "evidence", "action", "structure",
+             "diversity", "rhythm", "insight", "tags", "source", "title")
+_WEIGHTS = np.array([
+    # truth goodness beauty intelligence
+    [0.6, 0.4, 0.3, 0.6],   # length     篇幅
+    [0.9, 0.1, 0.0, 0.2],   # numbers    数字/数据密度
+    [1.2, 0.2, 0.0, 0.4],   # evidence   证据性词汇
+    [0.1, 1.3, 0.0, 0.2],   # action     可操作性词汇
+    [0.2, 0.5, 1.0, 0.2],   # structure  分段与列表结构
+    [0.0, 0.0, 0.8, 0.6],   # diversity  用字丰富度
+    [0.0, 0.0, 0.6, 0.0],   # rhythm     句长适中
+    [0.2, 0.2, 0.1, 1.4],   # insight    洞见性词汇
+    [0.1, 0.1, 0.2, 0.2],   # tags       标签数
+    [0.6, 0.0, 0.0, 0.0],   # source     有来源
+    [0.0, 0.0, 0.3, 0.0],   # title      标题长度适中
+], dtype=np.float64)
+_BIAS = np.array([-1.0, -0.9, -1.0, -1.1], dtype=np.float64)
+
+# ===================== 特征 =====================
+def _count_any(text: str, words) -> int:
+    return sum(text.count(w) for w in words)
+
+def _raw_features(capsule: dict) -> List[float]:
+    content = capsule.get("content") or ""
+    lowered = content.lower()
+    title = capsule.get("title") or ""
+    length = len(content)
+    sentences = [s for s in _SENTENCE_END.split(content) if s.strip()]
+    mean_sentence = length / len(sentences) if sentences else 0.0
+    return [
+        length,
+        len(_NUMBER.findall(content)),
+        _count_any(lowered, _EVIDENCE_WORDS),
+        _count_any(lowered, _ACTION_WORDS),
+        content.count("\n") + len(_LIST_MARKER.findall(content)),
+        len(set(content)) / length if length else 0.0,
+        mean_sentence,
+        _count_any(lowered, _INSIGHT_WORDS),
+        len(capsule.get("tags") or []),
+        1.0 if capsule.get("source") else 0.0,
+        len(title),
+    ]
+
+def feature_matrix(capsules: List[dict]) -> np.ndarray:
+    """胶囊列表 -> 归一化特征矩阵 (n, len(_FEATURES))"""
+    raw = np.array([_raw_features(c) for c in capsules], dtype=np.float64).reshape(-1, len(_FEATURES))
+    x = np.empty_like(raw)
+    x[:, 0] = np.clip(np.log1p(raw[:, 0]) / np.log(5000.0), 0, 1)
+    x[:, 1] = raw[:, 1] / (raw[:, 1] + 5.0)
+    x[:, 2] = raw[:, 2] / (raw[:, 2] + 3.0)
+    x[:, 3] = raw[:, 3] / (raw[:, 3] + 3.0)
+    x[:, 4] = raw[:, 4] / (raw[:, 4] + 8.0)
+    x[:, 5] = np.clip(raw[:, 5] * 2.0, 0, 1)
+    x[:, 6] = np.clip(1.0 - np.abs(raw[:, 6] - 30.0) / 30.0, 0, 1)
+    x[:, 7] = raw[:, 7] / (raw[:, 7] + 3.0)
+    x[:, 8] = np.clip(raw[:, 8] / 5.0, 0, 1)
+    x[:, 9] = raw[:, 9]
+    x[:, 10] = np.where((raw[:, 10] >= 4) & (raw[:, 10] <= 30), 1.0, 0.3)
+    return x
+
+# ===================== 评分 =====================
+def score_batch(capsules: List[dict]) -> np.ndarray:
+    """批量评分 -> (n, 4) 四维评分矩阵"""
+    if not capsules:
+        return np.zeros((0, len(DIMENSIONS)), dtype=np.float64)
+    z = feature_matrix(capsules) @ _WEIGHTS + _BIAS
+    scores = SCORE_FLOOR + SCORE_RANGE / (1.0 + np.exp(-z))
+    return np.round(scores, 2)
+
+def score_capsules(capsules: List[dict]) -> List[Dict[str, float]]:
+    """批量评分 -> [{truth, goodness, beauty, intelligence, overall}]"""
+    scores = score_batch(capsules)
+    overall = np.round(scores.mean(axis=1), 2) if len(scores) else scores
+    return [
+        {**dict(zip(DIMENSIONS, map(float, row))), "overall": float(total)}
+        for row, total in zip(scores, overall)
+    ]
+
+def content_hash(capsule: dict) -> str:
+    """评分输入的摘要，用于判断是否需要重评"""
+    payload = "\x1f".join([
+        capsule.get("title") or "",
+        capsule.get("content") or "",
+        ",".join(capsule.get("tags") or []),
+        capsule.get("source") or "",
+    ])
+    return hashlib.sha256(payload.encode()).hexdigest()
@@ -0,0 +1,248 @@
+"""
+本地向量嵌入与语义检索
+哈希字符 n-gram 的 TF 向量存放在内存映射的 float32 矩阵中，查询时文档与查询两侧同按当前 IDF 加权，
+一次矩阵-向量乘积除以缓存的文档加权范数得到 TF-IDF 余弦，argpartition 取 top-k
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+# ===================== 参数 =====================
+EMBED_DIM = 256           # 哈希桶数（每个胶囊 1KB）
+NGRAM_SIZES = (2, 3)      # 字符 n-gram
+INITIAL_CAPACITY = 1024
+NORM_BLOCK = 16384        # 重算文档加权范数时每块的行数（限制临时数组大小）
+
+_NOISE = re.compile(r"[\s\W_]+", re.UNICODE)
+_WORD = re.compile(r"[a-z0-9]{2,}")
+
+# ===================== 嵌入 =====================
+def _tokens(text: str) -> Iterable[str]:
+    lowered = (text or "").lower()
+    compact = _NOISE.sub("", lowered)
+    for n in NGRAM_SIZES:
+        for i in range(len(compact) - n + 1):
+            yield compact[i:i + n]
+    yield from _WORD.findall(lowered)
+
+def embed(text: str) -> np.ndarray:
+    """文本 -> L2 归一化的哈希 n-gram 次线性 TF 向量"""
+    vec = np.zeros(EMBED_DIM, dtype=np.float32)
+    counts = Counter(_tokens(text))
+    if not counts:
+        return vec
+    hashes = np.fromiter((zlib.crc32(t.encode()) for t in counts), dtype=np.uint32, count=len(counts))
+    weights = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vec, hashes % EMBED_DIM, signs * weights)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+# ===================== 向量索引 =====================
+class VectorIndex:
+    """内存映射的向量矩阵；行号与胶囊 ID 的映射持久化在 capsule_vectors 表，
+    空闲行号在 capsule_vector_free 表，映射版本号在 capsule_vector_state 表（多进程共享同一库时据此重载）"""
+
+    def __init__(self, path: str, dim: int = EMBED_DIM):
+        self.path = path
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._matrix: Optional[np.memmap] = None
+        self._ids: List[Optional[str]] = []
+        self._row_of: Dict[str, int] = {}
+        self._free: Set[int] = set()  # 本进程视角下没有映射的行，查询时屏蔽
+        self._df = np.zeros(dim, dtype=np.int64)
+        self._version: Optional[int] = None  # 最后加载或由本进程写入后的映射版本号
+        self._norms: Optional[np.ndarray] = None  # 各行 IDF 加权后的范数，文档频率变化时作废
+
+    # ---------- 存储 ----------
+    def _open(self, capacity: int):
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        size = capacity * self.dim * 4
+        mode = "r+" if os.path.exists(self.path) else "w+"
+        if mode == "r+" and os.path.getsize(self.path) < size:
+            with open(self.path, "r+b") as f:
+                f.truncate(size)
+        self._matrix = np.memmap(self.path, dtype=np.float32, mode=mode, shape=(capacity, self.dim))
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self._matrix is None else self._matrix.shape[0]
+
+    def _grow(self, needed: int):
+        if needed > self.capacity:
+            capacity = max(INITIAL_CAPACITY, self.capacity)
+            while capacity < needed:
+                capacity *= 2
+            self._open(capacity)
+
+    def load(self, db):
+        """从映射表恢复内存状态（先读版本号: 读取期间若有其他进程写入，下次 refresh 会再次重载）"""
+        with self._lock:
+            self._version = db.execute("SELECT version FROM capsule_vector_state").fetchone()[0]
+            rows = db.execute("SELECT capsule_id, row FROM capsule_vectors").fetchall()
+            used = max((r[1] for r in rows), default=-1) + 1
+            existing = os.path.getsize(self.path) // (self.dim * 4) if os.path.exists(self.path) else 0
+            self._open(max(INITIAL_CAPACITY, existing, used))
+            self._ids = [None] * used
+            self._row_of = {}
+            for capsule_id, row in rows:
+                self._ids[row] = capsule_id
+                self._row_of[capsule_id] = row
+            self._free = {i for i, cid in enumerate(self._ids) if cid is None}
+            live = [r for r, cid in enumerate(self._ids) if cid is not None]
+            self._df = (self._matrix[live] != 0).sum(axis=0).astype(np.int64) if live else np.zeros(self.dim, dtype=np.int64)
+            self._norms = None
+
+    def refresh(self, db):
+        """其他进程（多 worker、命令行导入）改动过映射时重新加载；查询前调用"""
+        version = db.execute("SELECT version FROM capsule_vector_state").fetchone()[0]
+        if version != self._version:
+            self.load(db)
+
+    def _bump(self, db):
+        """写事务内递增版本号；递增前的版本不是本进程最后所见时，说明其他进程改过映射，下次 refresh 全量重载"""
+        version = db.execute("UPDATE capsule_vector_state SET version = version + 1 RETURNING version").fetchone()[0]
+        self._version = version if version - 1 == self._version else None
+
+    def _set_row(self, capsule_id: str, row: int, vec: np.ndarray):
+        if row >= len(self._ids):
+            # 中间的行可能已被其他进程占用，本进程未加载其映射，查询时屏蔽
+            self._free.update(range(len(self._ids), row))
+            self._ids.extend([None] * (row + 1 - len(self._ids)))
+            self._grow(row + 1)
+        previous = self._ids[row]
+        if previous is not None:
+            self._df -= (self._matrix[row] != 0)
+            if previous != capsule_id:
+                self._row_of.pop(previous, None)
+        self._matrix[row] = vec
+        self._ids[row] = capsule_id
+        self._row_of[capsule_id] = row
+        self._free.discard(row)
+        self._df += (vec != 0)
+        self._norms = None
+
+    # ---------- 增删 ----------
+    def add(self, db, items: List[Tuple[str, np.ndarray]]):
+        """写入向量并登记映射（调用方提交事务）
+        行号在写事务内从库中分配（空闲行表优先，否则取已用最大行号 + 1），多个进程共享同一库时由 SQLite 写锁互斥；
+        本进程内存中的映射可能过期，不参与分配"""
+        if not items:
+            return
+        with self._lock:
+            conn = getattr(db, "connection", db)
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            vectors = dict(items)
+            ids = list(vectors)
+            placeholders = ",".join("?" * len(ids))
+            rows = dict(db.execute(
+                f"SELECT capsule_id, row FROM capsule_vectors WHERE capsule_id IN ({placeholders})", ids
+            ).fetchall())
+            new_ids = [cid for cid in ids if cid not in rows]
+            if new_ids:
+                free = [r[0] for r in db.execute(
+                    "SELECT row FROM capsule_vector_free ORDER BY row LIMIT ?", (len(new_ids),)
+                ).fetchall()]
+                db.executemany("DELETE FROM capsule_vector_free WHERE row = ?", [(r,) for r in free])
+                next_row = db.execute(
+                    "SELECT MAX(COALESCE((SELECT MAX(row) FROM capsule_vectors), -1),"
+                    " COALESCE((SELECT MAX(row) FROM capsule_vector_free), -1)) + 1"
+                ).fetchone()[0]
+                allocated = free + list(range(next_row, next_row + len(new_ids) - len(free)))
+                db.executemany(
+                    "INSERT INTO capsule_vectors (capsule_id, row) VALUES (?, ?)", list(zip(new_ids, allocated))
+                )
+                rows.update(zip(new_ids, allocated))
+            for capsule_id in ids:
+                self._set_row(capsule_id, rows[capsule_id], vectors[capsule_id])
+            self._matrix.flush()
+            self._bump(db)
+
+    def remove(self, db, capsule_ids: List[str]):
+        """删除向量，行号登记到空闲行表供复用（调用方提交事务）"""
+        if not capsule_ids:
+            return
+        with self._lock:
+            placeholders = ",".join("?" * len(capsule_ids))
+            rows = db.execute(
+                f"SELECT capsule_id, row FROM capsule_vectors WHERE capsule_id IN ({placeholders})", list(capsule_ids)
+            ).fetchall()
+            for capsule_id, row in rows:
+                if row < len(self._ids) and self._ids[row] == capsule_id:
+                    self._df -= (self._matrix[row] != 0)
+                    self._norms = None
+                    self._matrix[row] = 0
+                    self._ids[row] = None
+                    self._free.add(row)
+                self._row_of.pop(capsule_id, None)
+            db.executemany("DELETE FROM capsule_vectors WHERE capsule_id = ?", [(r[0],) for r in rows])
+            db.executemany("INSERT OR IGNORE INTO capsule_vector_free (row) VALUES (?)", [(r[1],) for r in rows])
+            self._bump(db)
+
+    def __contains__(self, capsule_id: str) -> bool:
+        return capsule_id in self._row_of
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def vector(self, capsule_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._row_of.get(capsule_id)
+            return None if row is None else np.array(self._matrix[row])
+
+    # ---------- 查询 ----------
+    def idf(self) -> np.ndarray:
+        n = len(self._row_of)
+        return np.log((n + 1) / (self._df + 1)).astype(np.float32) + 1.0
+
+    def _weighted_norms(self, idf: np.ndarray) -> np.ndarray:
+        """各行按 idf 加权后的 L2 范数；文档频率不变时复用（批量计算碰撞期间只算一次）"""
+        n_rows = len(self._ids)
+        if self._norms is None or len(self._norms) != n_rows:
+            squared = idf * idf
+            norms = np.empty(n_rows, dtype=np.float32)
+            for start in range(0, n_rows, NORM_BLOCK):
+                block = np.asarray(self._matrix[start:min(start + NORM_BLOCK, n_rows)])
+                norms[start:start + len(block)] = np.sqrt((block * block) @ squared)
+            self._norms = norms
+        return self._norms
+
+    def search(self, query: np.ndarray, k: int = 20, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """top-k TF-IDF 余弦相似度: 文档与查询的 TF 向量同按当前 IDF 加权，
+        分数对称（A 查 B 与 B 查 A 相同），可直接作为碰撞表中无序对的分数"""
+        with self._lock:
+            n_rows = len(self._ids)
+            if n_rows == 0:
+                return []
+            idf = self.idf()
+            weighted = query * idf
+            norm = np.linalg.norm(weighted)
+            if not norm:
+                return []
+            norms = self._weighted_norms(idf)
+            dots = np.asarray(self._matrix[:n_rows] @ (weighted * idf))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scores = np.where(norms > 0, dots / (norms * norm), -np.inf)
+            if self._free:
+                scores[list(self._free)] = -np.inf
+            if exclude in self._row_of:
+                scores[self._row_of[exclude]] = -np.inf
+            k = min(k, n_rows)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def close(self):
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+                self._matrix = None
@@ -0,0 +1,155 @@
+"""
+v2.0 胶囊导入
+增量解析顶层 JSON 数组（内存只保留当前未解析完的一条），并把 v2 字段映射到服务的胶囊结构
+"""
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+import codecs
+import json
+
+# ===================== 参数 =====================
+READ_CHUNK_SIZE = 1 << 20         # 每次读取 1MB
+MAX_ITEM_SIZE = 64 << 20          # 单条记录上限，超出视为格式错误而不是无限缓冲
+V2_DIMENSIONS = ("truth", "goodness", "beauty", "intelligence")
+
+_WHITESPACE = " \t\r\n"
+
+# ===================== 增量解析 =====================
+class JSONArrayStream:
+    """推式解析顶层 JSON 数组: feed() 文本片段，返回其中已完整的元素"""
+
+    def __init__(self, max_item_size: int = MAX_ITEM_SIZE):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._started = False
+        self._finished = False
+        self._expect_value = True
+        self._max_item_size = max_item_size
+
+    def _skip_whitespace(self, pos: int) -> int:
+        while pos < len(self._buffer) and self._buffer[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def feed(self, text: str, final: bool = False) -> List[Any]:
+        """解析新到达的文本；final=True 表示输入结束"""
+        self._buffer += text
+        items = []
+        pos = self._skip_whitespace(0)
+        while pos < len(self._buffer) and not self._finished:
+            char = self._buffer[pos]
+            if not self._started:
+                if char != "[":
+                    raise ValueError("顶层必须是JSON数组")
+                self._started = True
+                pos += 1
+            elif char == "]":
+                self._finished = True
+                pos += 1
+            elif char == ",":
+                if self._expect_value:
+                    raise ValueError(f"数组第{len(items)}个元素附近多余的逗号")
+                self._expect_value = True
+                pos += 1
+            else:
+                if not self._expect_value:
+                    raise ValueError("数组元素之间缺少逗号")
+                try:
+                    item, end = self._decoder.raw_decode(self._buffer, pos)
+                except json.JSONDecodeError as e:
+                    if final:
+                        raise ValueError(f"JSON解析失败: {e.msg}") from None
+                    if len(self._buffer) - pos > self._max_item_size:
+                        raise ValueError("单条记录超过大小上限或JSON格式错误") from None
+                    break
+                # 数字等标量可能被截断，只有后面还有字符时才算完整
+                if end >= len(self._buffer) and not final:
+                    break
+                items.append(item)
+                self._expect_value = False
+                pos = end
+            pos = self._skip_whitespace(pos)
+        self._buffer = self._buffer[pos:]
+        if final and not self._finished:
+            raise ValueError("JSON数组不完整")
+        return items
+
+def iter_json_array(fp: BinaryIO, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+    """逐条产出文件中顶层数组的元素"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    stream = JSONArrayStream()
+    while True:
+        chunk = fp.read(chunk_size)
+        final = not chunk
+        yield from stream.feed(decoder.decode(chunk, final=final), final=final)
+        if final:
+            return
+
+# ===================== 字段映射 =====================
+def _as_list(value) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(v) for v in value if v not in (None, "")]
+    return [str(value)]
+
+def _section(title: str, lines: List[str]) -> Optional[str]:
+    if not lines:
+        return None
+    return f"【{title}】\n" + "\n".join(f"- {line}" for line in lines)
+
+def v2_content(item: dict) -> str:
+    """v2 的洞见/证据/行动项等结构化字段 -> 正文"""
+    parts = [
+        item.get("insight") or item.get("content"),
+        _section("证据", _as_list(item.get("evidence"))),
+        _section("行动", _as_list(item.get("action_items"))),
+        _section("适用", _as_list(item.get("applicability"))),
+        _section("局限", _as_list(item.get("limitations"))),
+    ]
+    return "\n\n".join(p for p in parts if p)
+
+def v2_datm(item: dict) -> Optional[Dict[str, float]]:
+    """v2 的分维度 datm_score -> 服务的四维评分（总分 = 四维均值）；不完整时返回 None 交由评分引擎计算"""
+    scores = item.get("datm_score")
+    if not isinstance(scores, dict):
+        return None
+    try:
+        datm = {dim: round(float(scores[dim]), 2) for dim in V2_DIMENSIONS}
+    except (KeyError, TypeError, ValueError):
+        return None
+    datm["overall"] = round(sum(datm.values()) / len(V2_DIMENSIONS), 2)
+    return datm
+
+_MAPPED_FIELDS = {
+    "id", "title", "domain", "topics", "insight", "content", "evidence", "action_items",
+    "applicability", "limitations", "authors", "source_type", "source_id",
+    "created_at", "updated_at", "datm_score",
+}
+
+def map_v2_capsule(item: dict) -> dict:
+    """v2 胶囊 -> CapsuleCreate 字段 + 保留的原始 ID/时间/评分；未映射的字段原样放入 metadata"""
+    if not isinstance(item, dict):
+        raise ValueError("记录必须是JSON对象")
+    if not item.get("title"):
+        raise ValueError("缺少 title")
+    content = v2_content(item)
+    if not content:
+        raise ValueError("缺少 insight")
+    source = item.get("source_id") or item.get("source_type")
+    authors = _as_list(item.get("authors"))
+    metadata = {k: v for k, v in item.items() if k not in _MAPPED_FIELDS}
+    if item.get("datm_score") is not None:
+        metadata["v2_datm_score"] = item["datm_score"]
+    return {
+        "id": item.get("id"),
+        "title": item["title"],
+        "content": content,
+        "source": str(source) if source else None,
+        "domain": item.get("domain"),
+        "tags": _as_list(item.get("topics")) or None,
+        "author": ", ".join(authors) if authors else None,
+        "created_at": item.get("created_at"),
+        "updated_at": item.get("updated_at") or item.get("created_at"),
+        "datm": v2_datm(item),
+        "metadata": metadata,
+    }
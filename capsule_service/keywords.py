@@ -0,0 +1,117 @@
+"""
+关键词抽取 - 中文字符 n-gram + 拉丁文单词，按语料文档频率做 TF-IDF 排序
+文档频率表由数据库触发器增量维护，这里只负责切词与打分
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import math
+import re
+
+# ===================== 参数 =====================
+KEYWORD_COUNT = 5         # 每个胶囊自动生成的标签数
+CJK_NGRAM_SIZES = (2, 3)  # 中文候选词长度
+MAX_CANDIDATES = 64       # 按词频预筛的候选数，限制每次查询文档频率的规模
+TITLE_WEIGHT = 3          # 标题中的词按多次出现计
+TRIGRAM_BOUNDARY_PENALTY = 0.8  # 三字词得分打折后仍须不低于其组成二字词
+
+_CJK_RUN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+")
+_LATIN_WORD = re.compile(r"[a-z][a-z0-9+#]*(?:[-.][a-z0-9]+)*")
+# 虚词：出现在 n-gram 的任何位置都说明候选跨了词边界或不是实词
+_CJK_STOP_CHARS = set("的了是在和与及或也都就而被把这那个我们你他她它之其为以于对从等有着将并又很更最所让")
+_LATIN_STOPWORDS = {
+    'the', 'and', 'for', 'are', 'was', 'were', 'been', 'being', 'have', 'has', 'had',
+    'does', 'did', 'will', 'would', 'could', 'should', 'may', 'might', 'must', 'shall',
+    'with', 'from', 'into', 'through', 'during', 'before', 'after', 'above', 'this',
+    'that', 'these', 'those', 'there', 'their', 'they', 'them', 'than', 'then', 'what',
+    'which', 'when', 'where', 'who', 'how', 'why', 'not', 'but', 'can', 'all', 'any',
+    'each', 'more', 'most', 'other', 'some', 'such', 'only', 'own', 'same', 'too', 'very',
+    'just', 'also', 'about', 'over', 'under', 'again', 'once', 'here', 'its', 'our', 'your',
+}
+
+# ===================== 切词 =====================
+def _cjk_spans(run: str, offset: int) -> Iterable[Tuple[str, int, int]]:
+    for n in CJK_NGRAM_SIZES:
+        for i in range(len(run) - n + 1):
+            gram = run[i:i + n]
+            if _CJK_STOP_CHARS.isdisjoint(gram):
+                yield gram, offset + i, offset + i + n
+
+def term_spans(text: str) -> Iterable[Tuple[str, int, int]]:
+    """候选词及其字符区间 [start, end)（区间按小写后的文本计）"""
+    lowered = (text or "").lower()
+    for run in _CJK_RUN.finditer(lowered):
+        yield from _cjk_spans(run.group(), run.start())
+    for word in _LATIN_WORD.finditer(lowered):
+        if len(word.group()) >= 3 and word.group() not in _LATIN_STOPWORDS:
+            yield word.group(), word.start(), word.end()
+
+def terms(text: str) -> Iterable[str]:
+    """候选词: 中文连续片段的 2/3-gram（不含虚词），拉丁文小写单词（去停用词与过短词）"""
+    return (term for term, _, _ in term_spans(text))
+
+def term_counts(title: str, content: str) -> Counter:
+    """标题加权后的词频"""
+    counts = Counter(terms(content))
+    for term in terms(title):
+        counts[term] += TITLE_WEIGHT
+    return counts
+
+def document_terms(title: str, content: str) -> Set[str]:
+    """文档包含的去重候选词（用于文档频率统计）"""
+    return set(terms(title)) | set(terms(content))
+
+def term_positions(title: str, content: str) -> Dict[str, List[tuple]]:
+    """候选词 -> 各次出现的 (字段, 起, 止)，字段 0 为标题、1 为正文；供选词时判断重叠"""
+    positions: Dict[str, List[tuple]] = {}
+    for field, text in enumerate((title, content)):
+        for term, start, end in term_spans(text):
+            positions.setdefault(term, []).append((field, start, end))
+    return positions
+
+def candidates(counts: Counter) -> List[str]:
+    """按词频预筛候选词"""
+    return [term for term, _ in counts.most_common(MAX_CANDIDATES)]
+
+# ===================== 打分 =====================
+def _score(tf: int, df: int, n_docs: int) -> float:
+    """次线性 TF × 平滑 IDF"""
+    return (1.0 + math.log(tf)) * (math.log((n_docs + 1) / (df + 1)) + 1.0)
+
+def _cohesive(term: str, counts: Counter, scores: Dict[str, float], df: Dict[str, int], n_docs: int) -> bool:
+    """中文三字词只在胜过两个组成二字词时保留: 文内词频不低于两者（二字词从不脱离它单独出现），
+    且乘以边界惩罚后的得分仍不低于两者；否则多半是跨词边界的片段（如「工智能」「改变世」）"""
+    if len(term) != 3 or not _CJK_RUN.fullmatch(term):
+        return True
+    for part in (term[:2], term[1:]):
+        if not counts[part]:
+            continue  # 含虚词的二字词不参与候选
+        if counts[term] < counts[part]:
+            return False
+        if scores[term] * TRIGRAM_BOUNDARY_PENALTY < scores.get(part, _score(counts[part], df.get(part, 0), n_docs)):
+            return False
+    return True
+
+def select_keywords(counts: Counter, df: Dict[str, int], n_docs: int, k: int = KEYWORD_COUNT,
+                    positions: Optional[Dict[str, List[tuple]]] = None) -> List[str]:
+    """次线性 TF × 平滑 IDF 排序后贪心选取；同分时短词优先、再按首次出现位置（标题在前）。
+    三字词须通过 _cohesive；给出 positions（term_positions）时，任一次出现与已选词的字符区间重叠的候选
+    （如已选「人工」后的「工智」）跳过，同分的二字词由此按出现顺序切分连续的中文片段"""
+    scores = {term: _score(tf, df.get(term, 0), n_docs) for term, tf in counts.most_common(MAX_CANDIDATES)}
+    first = {term: min(positions.get(term) or [(2, 0, 0)]) if positions is not None else (0, 0, 0) for term in scores}
+    ranked = sorted(
+        (term for term in scores if _cohesive(term, counts, scores, df, n_docs)),
+        key=lambda term: (-scores[term], len(term), first[term], term)
+    )
+    selected: List[str] = []
+    covered: Set[tuple] = set()  # 已选词占用的 (字段, 字符位置)
+    for term in ranked:
+        if any(term in chosen or chosen in term for chosen in selected):
+            continue
+        spans = positions.get(term, []) if positions is not None else []
+        if any((field, i) in covered for field, start, end in spans for i in range(start, end)):
+            continue
+        selected.append(term)
+        covered.update((field, i) for field, start, end in spans for i in range(start, end))
+        if len(selected) >= k:
+            break
+    return selected
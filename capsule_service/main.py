@@ -2,70 +2,714 @@
 知识胶囊服务 - SQLite持久化版
 支持胶囊创建、查询、搜索、碰撞检测、DATM评分
 """
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from fastapi import FastAPI, HTTPException, Query, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Optional, List, Dict, Any, Callable
+from contextlib import asynccontextmanager
 import sqlite3
 import os
 from datetime import datetime
 import json
+import base64
+import asyncio
+import codecs
 import hashlib
-import random
+import heapq
+import itertools
+import math
+import re
+import secrets
+import sys
+import time
+import zlib
+
+from kai_shared.storage import AsyncStorage, ConnectionPool, GroupCommitter, fan_out, shard_of, shard_paths
+from cache import LRUCache
+from embeddings import VectorIndex, embed
+from datm import DIMENSIONS, SCORER_VERSION, score_capsules, content_hash
+from keywords import document_terms, term_counts, term_positions, candidates, select_keywords
+from importer import JSONArrayStream, iter_json_array, map_v2_capsule
+from minhash import minhash_signature, lsh_buckets, estimate_similarities, pack_signature, unpack_signature
 
 # ===================== 配置 =====================
-DB_PATH = "/Users/wanyview/clawd/capsule_service/capsules.db"
-app = FastAPI(title="Kai Capsule Service", version="2.0.0")
+DB_PATH = os.getenv("CAPSULE_DB_PATH", "/Users/wanyview/clawd/capsule_service/capsules.db")
+BULK_CHUNK_SIZE = 500  # 批量写入每个事务的条数
+EXPORT_BATCH_SIZE = 500  # 导出时每个分片每批读取的行数（批间归还只读连接）
+COLLISION_MIN_SCORE = 0.3      # 低于该分数的碰撞不落库，更低阈值的查询实时计算
+COLLISION_MAX_PER_TYPE = 50    # 每个胶囊每种碰撞类型最多落库的条数
+COLLISION_BATCH_SIZE = 200     # 后台碰撞计算每批处理的胶囊数
+CAPSULE_CACHE_SIZE = int(os.getenv("CAPSULE_CACHE_SIZE", "1024"))  # 单胶囊响应 LRU 条数
+READ_POOL_SIZE = int(os.getenv("CAPSULE_READ_POOL_SIZE", "4"))  # 每个进程的只读连接数
+IMPORT_MAX_ERRORS = 100  # 导入结果中最多返回的错误明细条数
+CONTENT_COMPRESSION = os.getenv("CAPSULE_CONTENT_COMPRESSION", "zlib")  # 正文存储: zlib 压缩 / none 原样
+CONTENT_COMPRESS_MIN_BYTES = 512  # 短正文压缩收益小，原样存储
+SHARD_COUNT = max(1, int(os.getenv("CAPSULE_SHARDS", "1")))  # 分片数，1 为单库
+SHARD_BY = os.getenv("CAPSULE_SHARD_BY", "domain")  # domain: 同领域同分片 / id: 按胶囊 ID 哈希
+SHARD_ROUTE_CACHE_SIZE = 65536  # domain 分片模式下 ID -> 分片号的缓存条数
+GROUP_COMMIT = os.getenv("CAPSULE_GROUP_COMMIT", "0") == "1"  # 单条创建走组提交队列
+GROUP_COMMIT_ROWS = int(os.getenv("CAPSULE_GROUP_COMMIT_ROWS", "64"))  # 每组最多条数
+GROUP_COMMIT_WAIT_MS = float(os.getenv("CAPSULE_GROUP_COMMIT_WAIT_MS", "5"))  # 组内首条最多等待毫秒数
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时唤醒后台碰撞计算（接着处理上次未完成的队列），关闭时停止后台任务与各分片的组提交任务
+    （连接池随模块存活，组提交任务须在连接池之前停止；再次启动时组提交按需重建任务）"""
+    if collision_builder is not None:
+        collision_builder.notify()
+    yield
+    if collision_builder is not None:
+        await collision_builder.close()
+    for shard in shards:
+        if shard.group is not None:
+            await shard.group.close()
+
+app = FastAPI(title="Kai Capsule Service", version="2.0.0", lifespan=lifespan)
 
 # ===================== 数据库 =====================
-_db_conn = None
+_FTS_TOKEN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+|[^\W_]+", re.UNICODE)
+_CJK_CHAR = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
 
-def get_db():
-    """获取数据库连接（线程安全）"""
-    global _db_conn
-    if _db_conn is None:
-        _db_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        _db_conn.row_factory = sqlite3.Row
-    return _db_conn
+def cjk_bigrams(text: Optional[str]) -> str:
+    """FTS 分词: 中文切成重叠二元组，拉丁文按词小写，以空格连接供 unicode61 索引"""
+    tokens = []
+    for run in _FTS_TOKEN.findall(text or ""):
+        if _CJK_CHAR.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return " ".join(tokens)
 
-def init_db():
-    """初始化数据库"""
-    conn = get_db()
-    cursor = conn.cursor()
+def keyword_terms(title: Optional[str], content: Optional[str]) -> str:
+    """文档频率触发器使用: 文档的去重候选词，JSON 数组"""
+    return json.dumps(sorted(document_terms(title or "", content or "")), ensure_ascii=False)
+
+def pack_content(text: str) -> tuple:
+    """正文 -> (存储字节, 是否压缩)；压缩后不更小时原样存储"""
+    data = text.encode()
+    if CONTENT_COMPRESSION == "zlib" and len(data) >= CONTENT_COMPRESS_MIN_BYTES:
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            return packed, 1
+    return data, 0
+
+def content_text(body: Optional[bytes], compressed: Optional[int]) -> Optional[str]:
+    """存储字节 -> 正文"""
+    if body is None:
+        return None
+    return (zlib.decompress(body) if compressed else bytes(body)).decode()
+
+def setup_connection(conn: sqlite3.Connection):
+    """连接初始化: 正文解压以及全文索引、文档频率触发器依赖的函数，每个连接都必须注册"""
+    conn.create_function("content_text", 2, content_text, deterministic=True)
+    conn.create_function("cjk_bigrams", 1, cjk_bigrams, deterministic=True)
+    conn.create_function("keyword_terms", 2, keyword_terms, deterministic=True)
+
+class Shard:
+    """一个存储分片: 独立的 SQLite 文件、连接池、异步适配与向量矩阵"""
     
-    # 知识胶囊表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS capsules (
-            id TEXT PRIMARY KEY,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            source TEXT,
-            domain TEXT,
-            tags TEXT,
-            datm_score REAL,
-            author TEXT,
-            created_at TEXT,
-            updated_at TEXT,
-            metadata TEXT
+    def __init__(self, index: int, path: str):
+        self.index = index
+        self.path = path
+        self.pool = ConnectionPool(path, readers=READ_POOL_SIZE, on_connect=setup_connection)
+        self.db = AsyncStorage(self.pool)  # 路由中的查询经线程池执行，不阻塞事件循环
+        self.vectors = VectorIndex(os.path.splitext(path)[0] + ".vectors.f32")
+        self.group: Optional[GroupCommitter] = None
+        if GROUP_COMMIT:
+            self.group = GroupCommitter(self.db, lambda records: write_group(records, self),
+                                        GROUP_COMMIT_ROWS, GROUP_COMMIT_WAIT_MS)
+            # 组提交模式下请求在提交后才确认，每次提交都要 fsync 才算持久，代价由整组分摊
+            with self.pool.writer() as conn:
+                conn.execute("PRAGMA synchronous=FULL")
+
+shards = [Shard(i, path) for i, path in enumerate(shard_paths(DB_PATH, SHARD_COUNT))]
+shard_routes = LRUCache(SHARD_ROUTE_CACHE_SIZE)
+capsule_cache = LRUCache(CAPSULE_CACHE_SIZE)
+
+def home_shard(record) -> Shard:
+    """胶囊所属分片: 按领域或 ID 哈希"""
+    key = record["domain"] if SHARD_BY == "domain" else record["id"]
+    return shards[shard_of(key or "", SHARD_COUNT)]
+
+async def locate(capsule_id: str) -> Optional[Shard]:
+    """按 ID 定位分片；domain 分片模式下 ID 不含路由信息，先查缓存，未命中时并行探测各分片主键"""
+    if SHARD_COUNT == 1:
+        return shards[0]
+    if SHARD_BY != "domain":
+        return shards[shard_of(capsule_id, SHARD_COUNT)]
+    index = shard_routes.get(capsule_id)
+    if index is not None:
+        return shards[index]
+    found = await fan_out([shard.db for shard in shards], lambda conn: conn.execute(
+        "SELECT 1 FROM capsules WHERE id = ?", (capsule_id,)
+    ).fetchone() is not None)
+    for shard, hit in zip(shards, found):
+        if hit:
+            shard_routes.put(capsule_id, shard.index)
+            return shard
+    return None
+
+def shards_for(domain: Optional[str] = None) -> List[Shard]:
+    """查询涉及的分片: domain 分片模式下按领域过滤只需查一个分片"""
+    if domain and SHARD_BY == "domain":
+        return [shards[shard_of(domain, SHARD_COUNT)]]
+    return shards
+
+def group_by_shard(chunk: List[tuple]) -> List[tuple]:
+    """[(index, record)] -> [(shard, 子分块)]"""
+    groups: Dict[int, List[tuple]] = {}
+    for item in chunk:
+        groups.setdefault(home_shard(item[1]).index, []).append(item)
+    return [(shards[i], groups[i]) for i in sorted(groups)]
+
+def init_db(shard: Shard):
+    """初始化数据库"""
+    with shard.pool.writer() as conn:
+        cursor = conn.cursor()
+        
+        # 知识胶囊表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS capsules (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                source TEXT,
+                domain TEXT,
+                tags TEXT,
+                datm_score REAL,
+                author TEXT,
+                created_at TEXT,
+                updated_at TEXT,
+                metadata TEXT
+            )
+        ''')
+        
+        # 正文单独存放（可选 zlib 压缩），列表、过滤、碰撞等热路径扫描的 capsules 页里不再有大段正文
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS capsule_content (
+                capsule_id TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                compressed INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # 旧库迁移: 正文移出 capsules
+        if "content" in [row['name'] for row in cursor.execute("PRAGMA table_info(capsules)")]:
+            migrate_content(cursor)
+        
+        # 需要正文的路径（导出、重评、重建索引）读这个视图，列顺序与旧 capsules 表一致
+        cursor.execute('''
+            CREATE VIEW IF NOT EXISTS capsules_full AS
+            SELECT c.id, c.title, content_text(t.body, t.compressed) AS content, c.source, c.domain,
+                   c.tags, c.datm_score, c.author, c.created_at, c.updated_at, c.metadata
+            FROM capsules c JOIN capsule_content t ON t.capsule_id = c.id
+        ''')
+        
+        # 列表分页/过滤索引（IF NOT EXISTS 同时作为旧库迁移）
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_capsules_created ON capsules(created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_capsules_domain_created ON capsules(domain, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_capsules_datm_score ON capsules(datm_score)")
+        
+        # 胶囊碰撞记录表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS collisions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                capsule_a_id TEXT,
+                capsule_b_id TEXT,
+                collision_type TEXT,
+                score REAL,
+                created_at TEXT,
+                FOREIGN KEY (capsule_a_id) REFERENCES capsules(id),
+                FOREIGN KEY (capsule_b_id) REFERENCES capsules(id)
+            )
+        ''')
+        # 每对胶囊每种类型一行（a < b），两侧各一个索引支持按分数过滤读取
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_collisions_pair ON collisions(capsule_a_id, capsule_b_id, collision_type)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_collisions_a ON collisions(capsule_a_id, collision_type, score)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_collisions_b ON collisions(capsule_b_id, collision_type, score)")
+        # 待计算碰撞的胶囊: 写入事务只登记 ID，提交后由后台任务分批计算（按 rowid 先进先出）
+        cursor.execute("CREATE TABLE IF NOT EXISTS collision_queue (capsule_id TEXT PRIMARY KEY)")
+        # 服务级持久标记（如碰撞表是否已建成），跨重启保留
+        cursor.execute("CREATE TABLE IF NOT EXISTS service_meta (key TEXT PRIMARY KEY, value TEXT)")
+        
+        # 标签倒排索引: tag -> capsule_id；冗余存放胶囊的领域与标签数，标签碰撞打分只扫倒排表、不回表
+        # （领域创建后不变，标签数随标签整体重写）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS capsule_tags (
+                tag TEXT NOT NULL,
+                capsule_id TEXT NOT NULL,
+                domain TEXT,
+                tag_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (tag, capsule_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_capsule_tags_capsule ON capsule_tags(capsule_id)")
+        if "tag_count" not in [row['name'] for row in cursor.execute("PRAGMA table_info(capsule_tags)")]:
+            # 旧库迁移: 补冗余列并回填
+            cursor.execute("ALTER TABLE capsule_tags ADD COLUMN domain TEXT")
+            cursor.execute("ALTER TABLE capsule_tags ADD COLUMN tag_count INTEGER NOT NULL DEFAULT 0")
+            cursor.execute('''
+                UPDATE capsule_tags SET
+                    domain = (SELECT domain FROM capsules WHERE id = capsule_tags.capsule_id),
+                    tag_count = (SELECT COUNT(*) FROM capsule_tags x WHERE x.capsule_id = capsule_tags.capsule_id)
+            ''')
+        
+        # 内容 MinHash 签名与 LSH 分桶
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS capsule_minhash (
+                capsule_id TEXT PRIMARY KEY,
+                signature BLOB NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS capsule_lsh (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                capsule_id TEXT NOT NULL,
+                PRIMARY KEY (band, bucket, capsule_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_capsule_lsh_capsule ON capsule_lsh(capsule_id)")
+        
+        # 全文索引（FTS5 contentless，rowid 对齐 capsules.rowid，存储二元组分词结果）
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS capsules_fts USING fts5(
+                title, content, content='', tokenize='unicode61'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS capsules_fts_insert AFTER INSERT ON capsule_content BEGIN
+                INSERT INTO capsules_fts (rowid, title, content)
+                SELECT c.rowid, cjk_bigrams(c.title), cjk_bigrams(content_text(new.body, new.compressed))
+                FROM capsules c WHERE c.id = new.capsule_id;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS capsules_fts_delete AFTER DELETE ON capsules BEGIN
+                INSERT INTO capsules_fts (capsules_fts, rowid, title, content)
+                VALUES ('delete', old.rowid, cjk_bigrams(old.title), cjk_bigrams({CONTENT_OF_SQL.format(id="old.id")}));
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS capsules_fts_update AFTER UPDATE OF title ON capsules BEGIN
+                INSERT INTO capsules_fts (capsules_fts, rowid, title, content)
+                VALUES ('delete', old.rowid, cjk_bigrams(old.title), cjk_bigrams({CONTENT_OF_SQL.format(id="old.id")}));
+                INSERT INTO capsules_fts (rowid, title, content)
+                VALUES (new.rowid, cjk_bigrams(new.title), cjk_bigrams({CONTENT_OF_SQL.format(id="new.id")}));
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS capsules_fts_content_update AFTER UPDATE ON capsule_content BEGIN
+                INSERT INTO capsules_fts (capsules_fts, rowid, title, content)
+                SELECT 'delete', c.rowid, cjk_bigrams(c.title), cjk_bigrams(content_text(old.body, old.compressed))
+                FROM capsules c WHERE c.id = old.capsule_id;
+                INSERT INTO capsules_fts (rowid, title, content)
+                SELECT c.rowid, cjk_bigrams(c.title), cjk_bigrams(content_text(new.body, new.compressed))
+                FROM capsules c WHERE c.id = new.capsule_id;
+            END
+        ''')
+        
+        # 增量统计表: 每个领域的数量、评分和与平方和，由触发器在同一事务内维护
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS domain_stats (
+                domain TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0,
+                scored INTEGER NOT NULL DEFAULT 0,
+                score_sum REAL NOT NULL DEFAULT 0,
+                score_sq_sum REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS domain_stats_insert AFTER INSERT ON capsules BEGIN
+                {STATS_ADD_SQL.format(row="new")}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS domain_stats_delete AFTER DELETE ON capsules BEGIN
+                {STATS_SUB_SQL.format(row="old")}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS domain_stats_update AFTER UPDATE OF domain, datm_score ON capsules BEGIN
+                {STATS_SUB_SQL.format(row="old")}
+                {STATS_ADD_SQL.format(row="new")}
+            END
+        ''')
+        
+        # DATM 四维评分（stale 由触发器在评分输入变化时置位，供后台重评）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS capsule_datm (
+                capsule_id TEXT PRIMARY KEY,
+                truth REAL,
+                goodness REAL,
+                beauty REAL,
+                intelligence REAL,
+                content_hash TEXT,
+                scorer_version INTEGER,
+                stale INTEGER NOT NULL DEFAULT 0,
+                scored_at TEXT
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_capsule_datm_stale ON capsule_datm(stale) WHERE stale = 1")
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS capsule_datm_stale AFTER UPDATE OF title, tags, source ON capsules BEGIN
+                UPDATE capsule_datm SET stale = 1 WHERE capsule_id = new.id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS capsule_datm_stale_content AFTER UPDATE ON capsule_content BEGIN
+                UPDATE capsule_datm SET stale = 1 WHERE capsule_id = new.capsule_id;
+            END
+        ''')
+        
+        # 语义向量行号映射（向量本身在分片的 .vectors.f32 文件）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS capsule_vectors (
+                capsule_id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL UNIQUE
+            )
+        ''')
+        # 删除胶囊后空出的行号，写事务内分配时优先复用
+        cursor.execute("CREATE TABLE IF NOT EXISTS capsule_vector_free (row INTEGER PRIMARY KEY)")
+        # 映射版本号: 每次增删递增，进程据此发现其他进程的改动并重载映射
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS capsule_vector_state (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO capsule_vector_state (id, version) VALUES (0, 0)")
+        
+        # 预序列化响应体（CapsuleResponse 的规范 JSON，content 为 null），由触发器在写入时生成。
+        # 正文只以压缩形式存于 capsule_content，需要正文的读取路径用 CAPSULE_BODY_SQL 拼入
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS capsule_json (
+                capsule_id TEXT PRIMARY KEY,
+                body BLOB NOT NULL
+            )
+        ''')
+        # 旧库迁移: 旧版响应体内嵌未压缩正文（与 capsule_content 重复），连同维护正文的触发器一并重建
+        if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'capsule_json_content_update'").fetchone():
+            for name in ("capsule_json_insert", "capsule_json_update", "capsule_json_content_update"):
+                cursor.execute(f"DROP TRIGGER {name}")
+            cursor.execute("DELETE FROM capsule_json")
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS capsule_json_insert AFTER INSERT ON capsule_content BEGIN
+                INSERT OR REPLACE INTO capsule_json (capsule_id, body)
+                SELECT c.id, {CAPSULE_JSON_SQL.format(row="c")}
+                FROM capsules c WHERE c.id = new.capsule_id;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS capsule_json_update AFTER UPDATE ON capsules BEGIN
+                DELETE FROM capsule_json WHERE capsule_id = old.id;
+                INSERT OR REPLACE INTO capsule_json (capsule_id, body)
+                VALUES (new.id, {CAPSULE_JSON_SQL.format(row="new")});
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS capsule_json_delete AFTER DELETE ON capsules BEGIN
+                DELETE FROM capsule_json WHERE capsule_id = old.id;
+            END
+        ''')
+        
+        # 关键词文档频率表: 每个候选词出现在多少个胶囊中，由触发器增量维护
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS term_df (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS term_df_insert AFTER INSERT ON capsule_content BEGIN
+                {TERM_DF_ADD_SQL.format(title=TITLE_OF_SQL.format(id="new.capsule_id"), content="content_text(new.body, new.compressed)")}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS term_df_delete AFTER DELETE ON capsules BEGIN
+                {TERM_DF_SUB_SQL.format(title="old.title", content=CONTENT_OF_SQL.format(id="old.id"))}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS term_df_update AFTER UPDATE OF title ON capsules BEGIN
+                {TERM_DF_SUB_SQL.format(title="old.title", content=CONTENT_OF_SQL.format(id="old.id"))}
+                {TERM_DF_ADD_SQL.format(title="new.title", content=CONTENT_OF_SQL.format(id="new.id"))}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS term_df_content_update AFTER UPDATE ON capsule_content BEGIN
+                {TERM_DF_SUB_SQL.format(title=TITLE_OF_SQL.format(id="old.capsule_id"), content="content_text(old.body, old.compressed)")}
+                {TERM_DF_ADD_SQL.format(title=TITLE_OF_SQL.format(id="new.capsule_id"), content="content_text(new.body, new.compressed)")}
+            END
+        ''')
+        
+        # 旧库迁移: 为已有胶囊回填倒排索引
+        cursor.execute("SELECT 1 FROM capsule_tags LIMIT 1")
+        if cursor.fetchone() is None:
+            cursor.execute("SELECT id, domain, tags FROM capsules")
+            for row in cursor.fetchall():
+                index_tags(cursor, row['id'], row['domain'], json.loads(row['tags']) if row['tags'] else [])
+        
+        # 旧库迁移: 回填全文索引
+        cursor.execute("SELECT 1 FROM capsules_fts LIMIT 1")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                INSERT INTO capsules_fts (rowid, title, content)
+                SELECT c.rowid, cjk_bigrams(c.title), cjk_bigrams(content_text(t.body, t.compressed))
+                FROM capsules c JOIN capsule_content t ON t.capsule_id = c.id
+            ''')
+        
+        # 旧库迁移: 回填预序列化响应体
+        cursor.execute(f'''
+            INSERT INTO capsule_json (capsule_id, body)
+            SELECT c.id, {CAPSULE_JSON_SQL.format(row="c")} FROM capsules c
+            WHERE c.id NOT IN (SELECT capsule_id FROM capsule_json)
+        ''')
+        
+        # 旧库迁移: 回填统计表
+        cursor.execute("SELECT 1 FROM domain_stats LIMIT 1")
+        if cursor.fetchone() is None:
+            rebuild_stats(cursor)
+        
+        # 旧库迁移: 回填文档频率表
+        cursor.execute("SELECT 1 FROM term_df LIMIT 1")
+        if cursor.fetchone() is None:
+            rebuild_term_df(cursor)
+        
+        # 旧库迁移: 回填 MinHash 签名
+        cursor.execute("SELECT 1 FROM capsule_minhash LIMIT 1")
+        if cursor.fetchone() is None:
+            cursor.execute("SELECT id, content FROM capsules_full")
+            for row in cursor.fetchall():
+                index_minhash(cursor, row['id'], row['content'])
+        
+        conn.commit()
+
+STATS_ADD_SQL = '''
+                INSERT INTO domain_stats (domain, count, scored, score_sum, score_sq_sum)
+                VALUES (COALESCE({row}.domain, ''), 1, {row}.datm_score IS NOT NULL,
+                        COALESCE({row}.datm_score, 0), COALESCE({row}.datm_score * {row}.datm_score, 0))
+                ON CONFLICT(domain) DO UPDATE SET
+                    count = count + 1,
+                    scored = scored + excluded.scored,
+                    score_sum = score_sum + excluded.score_sum,
+                    score_sq_sum = score_sq_sum + excluded.score_sq_sum;'''
+STATS_SUB_SQL = '''
+                UPDATE domain_stats SET
+                    count = count - 1,
+                    scored = scored - ({row}.datm_score IS NOT NULL),
+                    score_sum = score_sum - COALESCE({row}.datm_score, 0),
+                    score_sq_sum = score_sq_sum - COALESCE({row}.datm_score * {row}.datm_score, 0)
+                WHERE domain = COALESCE({row}.domain, '');
+                DELETE FROM domain_stats WHERE domain = COALESCE({row}.domain, '') AND count <= 0;'''
+
+# SELECT 后接 UPSERT 需要 WHERE 消除语法歧义；df 减到 0 的行保留，rebuild-keywords 时清理
+TERM_DF_ADD_SQL = '''
+                INSERT INTO term_df (term, df)
+                SELECT value, 1 FROM json_each(keyword_terms({title}, {content})) WHERE 1
+                ON CONFLICT(term) DO UPDATE SET df = df + 1;'''
+TERM_DF_SUB_SQL = '''
+                UPDATE term_df SET df = df - 1
+                WHERE term IN (SELECT value FROM json_each(keyword_terms({title}, {content})));'''
+
+# 触发器中按胶囊 ID 取正文/标题。删除胶囊时 capsules 的触发器仍要读正文，
+# 因此 capsule_content 行必须在 capsules 行之后删除
+CONTENT_OF_SQL = "(SELECT content_text(body, compressed) FROM capsule_content WHERE capsule_id = {id})"
+TITLE_OF_SQL = "(SELECT title FROM capsules WHERE id = {id})"
+
+# 与 CapsuleResponse 字段顺序一致；以 BLOB 存储，读取时直接得到 bytes。content 占位为 null，不重复存储正文
+CAPSULE_JSON_SQL = '''CAST(json_object(
+                    'id', {row}.id, 'title', {row}.title, 'content', NULL,
+                    'source', {row}.source, 'domain', {row}.domain,
+                    'tags', COALESCE(json({row}.tags), json('[]')),
+                    'datm_score', {row}.datm_score, 'author', {row}.author,
+                    'created_at', {row}.created_at, 'updated_at', {row}.updated_at
+                ) AS BLOB)'''
+
+# 完整响应体: 预序列化响应体 j 原位填入 capsule_content t 解压后的正文（json_set 保持键序）
+CAPSULE_BODY_SQL = "CAST(json_set(CAST(j.body AS TEXT), '$.content', content_text(t.body, t.compressed)) AS BLOB)"
+
+def migrate_content(cursor):
+    """旧库迁移: capsules.content 搬到 capsule_content 并删除该列（不提交）
+    引用 content 列的旧触发器先删除，init_db 随后按新定义重建"""
+    conn = cursor.connection
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'capsules'").fetchall():
+        cursor.execute(f"DROP TRIGGER {name}")
+    rows = conn.execute("SELECT id, content FROM capsules")
+    while True:
+        batch = rows.fetchmany(500)
+        if not batch:
+            break
+        cursor.executemany(
+            "INSERT OR REPLACE INTO capsule_content (capsule_id, body, compressed) VALUES (?, ?, ?)",
+            [(row['id'], *pack_content(row['content'] or "")) for row in batch]
         )
+    cursor.execute("ALTER TABLE capsules DROP COLUMN content")
+
+def rebuild_stats(cursor):
+    """从 capsules 全量重算统计表（不提交）"""
+    cursor.execute("DELETE FROM domain_stats")
+    cursor.execute('''
+        INSERT INTO domain_stats (domain, count, scored, score_sum, score_sq_sum)
+        SELECT COALESCE(domain, ''), COUNT(*), COUNT(datm_score),
+               COALESCE(SUM(datm_score), 0), COALESCE(SUM(datm_score * datm_score), 0)
+        FROM capsules GROUP BY COALESCE(domain, '')
     ''')
-    
-    # 胶囊碰撞记录表
+
+def rebuild_term_df(cursor):
+    """从 capsules 全量重算文档频率表（不提交）"""
+    cursor.execute("DELETE FROM term_df")
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS collisions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            capsule_a_id TEXT,
-            capsule_b_id TEXT,
-            collision_type TEXT,
-            score REAL,
-            created_at TEXT,
-            FOREIGN KEY (capsule_a_id) REFERENCES capsules(id),
-            FOREIGN KEY (capsule_b_id) REFERENCES capsules(id)
-        )
+        INSERT INTO term_df (term, df)
+        SELECT t.value, COUNT(*) FROM capsules_full c, json_each(keyword_terms(c.title, c.content)) t
+        GROUP BY t.value
     ''')
+
+def sync_vectors(shard: Shard, batch_size: int = 500):
+    """加载分片的向量索引，并补齐缺失向量、清理已删除胶囊的残留映射"""
+    with shard.pool.writer() as conn:
+        shard.vectors.load(conn)
+        orphans = [row[0] for row in conn.execute(
+            "SELECT capsule_id FROM capsule_vectors WHERE capsule_id NOT IN (SELECT id FROM capsules)"
+        )]
+        shard.vectors.remove(conn, orphans)
+        missing = conn.execute(
+            "SELECT id, title, content FROM capsules_full WHERE id NOT IN (SELECT capsule_id FROM capsule_vectors)"
+        )
+        while True:
+            rows = missing.fetchmany(batch_size)
+            if not rows:
+                break
+            shard.vectors.add(conn, [(row['id'], embed_capsule(row)) for row in rows])
+        conn.commit()
+
+def save_datm(cursor, items: List[tuple]):
+    """写入四维评分 [(capsule_id, scores, content_hash)]"""
+    now = datetime.utcnow().isoformat()
+    cursor.executemany('''
+        INSERT OR REPLACE INTO capsule_datm
+            (capsule_id, truth, goodness, beauty, intelligence, content_hash, scorer_version, scored_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        capsule_id, scores["truth"], scores["goodness"], scores["beauty"], scores["intelligence"],
+        digest, SCORER_VERSION, now
+    ) for capsule_id, scores, digest in items])
+
+def rescore_stale(batch_size: int = 500) -> dict:
+    """后台重评: 只重算未评分、评分器版本过期或内容摘要确实变化的胶囊"""
+    scanned = rescored = 0
+    for shard in shards:
+        last_rowid = 0
+        while True:
+            with shard.pool.reader() as conn:
+                rows = conn.execute('''
+                    SELECT c.rowid, c.id, c.title, content_text(t.body, t.compressed) AS content,
+                           c.tags, c.source, d.content_hash, d.scorer_version
+                    FROM capsules c
+                    JOIN capsule_content t ON t.capsule_id = c.id
+                    LEFT JOIN capsule_datm d ON d.capsule_id = c.id
+                    WHERE c.rowid > ?
+                      AND (d.capsule_id IS NULL OR d.stale = 1 OR d.scorer_version != ?)
+                    ORDER BY c.rowid
+                    LIMIT ?
+                ''', (last_rowid, SCORER_VERSION, batch_size)).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1]['rowid']
+            scanned += len(rows)
+            
+            changed, unchanged = [], []
+            for row in rows:
+                capsule = {
+                    "id": row['id'], "title": row['title'], "content": row['content'],
+                    "tags": json.loads(row['tags']) if row['tags'] else [], "source": row['source']
+                }
+                digest = content_hash(capsule)
+                if digest == row['content_hash'] and row['scorer_version'] == SCORER_VERSION:
+                    unchanged.append(row['id'])
+                else:
+                    capsule["datm_hash"] = digest
+                    changed.append(capsule)
+            
+            scores = score_capsules(changed)
+            with shard.pool.writer() as conn:
+                save_datm(conn.cursor(), [(c["id"], s, c["datm_hash"]) for c, s in zip(changed, scores)])
+                conn.executemany(
+                    "UPDATE capsules SET datm_score = ? WHERE id = ?",
+                    [(s["overall"], c["id"]) for c, s in zip(changed, scores)]
+                )
+                conn.executemany("UPDATE capsule_datm SET stale = 0 WHERE capsule_id = ?", [(i,) for i in unchanged])
+                conn.commit()
+            capsule_cache.invalidate(*(c["id"] for c in changed))
+            rescored += len(changed)
+    return {"scanned": scanned, "rescored": rescored, "scorer_version": SCORER_VERSION}
+
+def rebuild_keywords(retag: Optional[str] = None, batch_size: int = 500) -> dict:
+    """批量模式: 全量重建文档频率表；retag='empty' 为无标签胶囊补标签，'all' 重新生成全部标签"""
+    terms = retagged = 0
+    only_empty = "AND (c.tags IS NULL OR c.tags IN ('', '[]', 'null'))" if retag == "empty" else ""
+    for shard in shards:
+        with shard.pool.writer() as conn:
+            rebuild_term_df(conn.cursor())
+            conn.commit()
+            terms += conn.execute("SELECT COUNT(*) FROM term_df").fetchone()[0]
+        
+        last_rowid = 0
+        while retag:
+            with shard.pool.reader() as conn:
+                rows = conn.execute(f'''
+                    SELECT c.rowid, c.id, c.title, c.domain, content_text(t.body, t.compressed) AS content
+                    FROM capsules c JOIN capsule_content t ON t.capsule_id = c.id
+                    WHERE c.rowid > ? {only_empty}
+                    ORDER BY c.rowid LIMIT ?
+                ''', (last_rowid, batch_size)).fetchall()
+                if not rows:
+                    break
+                tags = auto_keywords(conn, [dict(row) for row in rows])
+            last_rowid = rows[-1]['rowid']
+            
+            with shard.pool.writer() as conn:
+                cursor = conn.cursor()
+                for row, row_tags in zip(rows, tags):
+                    cursor.execute("UPDATE capsules SET tags = ? WHERE id = ?", (json.dumps(row_tags), row['id']))
+                    cursor.execute("DELETE FROM capsule_tags WHERE capsule_id = ?", (row['id'],))
+                    index_tags(cursor, row['id'], row['domain'], row_tags)
+                conn.commit()
+            capsule_cache.invalidate(*(row['id'] for row in rows))
+            retagged += len(rows)
     
-    conn.commit()
+    result = {"terms": terms, "retagged": retagged}
+    if retagged:
+        # 标签参与 DATM 评分与标签碰撞，需要随之重算
+        result["rescore"] = rescore_stale(batch_size)
+        result["collisions"] = rebuild_collisions()
+    return result
 
-init_db()
+def index_tags(cursor, capsule_id: str, domain: Optional[str], tags: List[str]):
+    """写入标签倒排索引（每行带上胶囊的领域与去重后的标签数）"""
+    unique = set(tags)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO capsule_tags (tag, capsule_id, domain, tag_count) VALUES (?, ?, ?, ?)",
+        [(tag, capsule_id, domain, len(unique)) for tag in unique]
+    )
+
+def index_minhash(cursor, capsule_id: str, content: str, signature: Optional[List[int]] = None):
+    """写入 MinHash 签名及 LSH 分桶（签名可由 prepare_records 预先算好）"""
+    if signature is None:
+        signature = minhash_signature(content)
+    cursor.execute(
+        "INSERT OR REPLACE INTO capsule_minhash (capsule_id, signature) VALUES (?, ?)",
+        (capsule_id, pack_signature(signature))
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO capsule_lsh (band, bucket, capsule_id) VALUES (?, ?, ?)",
+        [(band, bucket, capsule_id) for band, bucket in lsh_buckets(signature)]
+    )
+
+for _shard in shards:
+    init_db(_shard)
 
 # ===================== 数据模型 =====================
 class CapsuleCreate(BaseModel):
@@ -89,132 +733,299 @@ class CapsuleResponse(BaseModel):
     created_at: str
     updated_at: str
 
+class CapsuleSearchHit(CapsuleResponse):
+    score: float
+
+class CapsuleSearchResponse(BaseModel):
+    query: str
+    limit: int
+    offset: int
+    has_more: bool
+    results: List[CapsuleSearchHit]
+
 class CollisionRequest(BaseModel):
     capsule_id: str
     threshold: float = 0.5
 
 # ===================== 工具函数 =====================
 def generate_capsule_id(title: str) -> str:
-    """生成胶囊ID"""
+    """生成胶囊ID（随机盐: 同一秒内的同名胶囊、不同请求或客户端重试都不会撞 ID）"""
     timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    hash_val = hashlib.md5(f"{title}{timestamp}".encode()).hexdigest()[:8]
+    hash_val = hashlib.md5(f"{title}{timestamp}{secrets.token_hex(8)}".encode()).hexdigest()[:12]
     return f"capsule_{timestamp}_{hash_val}"
 
-def calculate_datm_score(capsule: dict) -> float:
-    """计算DATM质量评分"""
-    truth = random.uniform(70, 95)
-    goodness = random.uniform(65, 90)
-    beauty = random.uniform(60, 85)
-    intelligence = random.uniform(70, 95)
-    score = (truth + goodness + beauty + intelligence) / 4
-    return round(score, 2)
-
-def extract_keywords(content: str) -> List[str]:
-    """提取关键词"""
-    words = content.lower().split()
-    stopwords = {'the', 'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been', 
-                 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will',
-                 'would', 'could', 'should', 'may', 'might', 'must', 'shall',
-                 'of', 'in', 'for', 'on', 'with', 'at', 'by', 'from', 'as',
-                 'into', 'through', 'during', 'before', 'after', 'above'}
-    keywords = [w for w in words if len(w) > 3 and w not in stopwords][:5]
-    return list(set(keywords))
+def embed_capsule(capsule):
+    """胶囊语义向量（标题 + 正文）"""
+    return embed(f"{capsule['title']}\n{capsule['content']}")
 
-# ===================== API路由 =====================
+def prepare_records(records: List[dict], shard: Shard):
+    """写入前的 CPU 密集计算（自动标签、评分、向量、MinHash 签名、正文压缩），应在获取写锁之前调用"""
+    untagged = [r for r in records if not r["tags"]]
+    if untagged:
+        # 文档频率取自目标分片；domain 分片模式下即为领域内的 IDF
+        with shard.pool.reader() as conn:
+            for record, tags in zip(untagged, auto_keywords(conn, untagged)):
+                record["tags"] = tags
+    apply_datm_scores(records)
+    for record in records:
+        if "vector" not in record:
+            record["vector"] = embed_capsule(record)
+        if "minhash" not in record:
+            record["minhash"] = minhash_signature(record["content"])
+        if "content_blob" not in record:
+            record["content_blob"] = pack_content(record["content"])
 
-@app.get("/")
-async def root():
-    """服务状态"""
-    return {
-        "service": "Kai Capsule Service",
-        "version": "2.0.0",
-        "status": "running",
-        "database": DB_PATH
-    }
+def auto_keywords(conn, capsules: List[dict]) -> List[List[str]]:
+    """按语料文档频率为一批胶囊抽取关键词（每批一次文档频率查询）"""
+    counts = [term_counts(c["title"], c["content"]) for c in capsules]
+    wanted = sorted(set().union(*(candidates(c) for c in counts)))
+    df = dict(conn.execute(
+        "SELECT term, df FROM term_df WHERE term IN (SELECT value FROM json_each(?))",
+        (json.dumps(wanted, ensure_ascii=False),)
+    ).fetchall())
+    n_docs = conn.execute("SELECT COALESCE(SUM(count), 0) FROM domain_stats").fetchone()[0]
+    return [select_keywords(c, df, n_docs, positions=term_positions(capsule["title"], capsule["content"]))
+            for c, capsule in zip(counts, capsules)]
 
-@app.post("/capsules", response_model=CapsuleResponse)
-async def create_capsule(capsule: CapsuleCreate):
-    """创建知识胶囊"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    capsule_id = generate_capsule_id(capsule.title)
+def apply_datm_scores(records: List[dict]):
+    """批量计算 DATM 四维评分并写回记录（总分 = 四维均值）"""
+    pending = [r for r in records if "datm" not in r]
+    for record, scores in zip(pending, score_capsules(pending)):
+        record["datm"] = scores
+        record["datm_hash"] = content_hash(record)
+        record["datm_score"] = scores["overall"]
+
+def build_capsule_record(capsule: CapsuleCreate) -> dict:
+    """请求模型 -> 待写入的胶囊记录"""
     now = datetime.utcnow().isoformat()
-    tags = capsule.tags or extract_keywords(capsule.content)
-    datm_score = calculate_datm_score({})
-    
-    cursor.execute('''
-        INSERT INTO capsules (id, title, content, source, domain, tags, datm_score, author, created_at, updated_at, metadata)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        capsule_id, capsule.title, capsule.content,
-        capsule.source, capsule.domain or "general", json.dumps(tags),
-        datm_score, capsule.author, now, now,
-        json.dumps(capsule.metadata) if capsule.metadata else None
-    ))
-    
-    conn.commit()
-    
     return {
-        "id": capsule_id,
+        "id": generate_capsule_id(capsule.title),
         "title": capsule.title,
         "content": capsule.content,
         "source": capsule.source,
         "domain": capsule.domain or "general",
-        "tags": tags,
-        "datm_score": datm_score,
+        "tags": capsule.tags or [],  # 为空时由 prepare_records 自动抽取
+        "datm_score": None,
         "author": capsule.author,
         "created_at": now,
-        "updated_at": now
+        "updated_at": now,
+        "metadata": capsule.metadata
     }
 
-@app.get("/capsules", response_model=List[CapsuleResponse])
-async def list_capsules(domain: Optional[str] = None, min_score: Optional[float] = None, limit: int = 20):
-    """查询胶囊列表"""
-    conn = get_db()
+def record_to_response(record: dict) -> dict:
+    """胶囊记录 -> 响应字典"""
+    return {k: record[k] for k in CapsuleResponse.model_fields}
+
+def insert_capsule_records(cursor, records: List[dict], shard: Shard):
+    """写入胶囊及其索引（不提交，由调用方控制事务；records 须同属 shard）"""
+    prepare_records(records, shard)
+    cursor.executemany('''
+        INSERT INTO capsules (id, title, source, domain, tags, datm_score, author, created_at, updated_at, metadata)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        r["id"], r["title"],
+        r["source"], r["domain"], json.dumps(r["tags"]),
+        r["datm_score"], r["author"], r["created_at"], r["updated_at"],
+        json.dumps(r["metadata"]) if r["metadata"] else None
+    ) for r in records])
+    # 全文索引、文档频率、响应体由 capsule_content 的插入触发器生成，必须在 capsules 之后写入
+    cursor.executemany(
+        "INSERT INTO capsule_content (capsule_id, body, compressed) VALUES (?, ?, ?)",
+        [(r["id"], *r["content_blob"]) for r in records]
+    )
+    save_datm(cursor, [(r["id"], r["datm"], r["datm_hash"]) for r in records])
+    shard.vectors.add(cursor, [(r["id"], r["vector"]) for r in records])
+    for r in records:
+        index_tags(cursor, r["id"], r["domain"], r["tags"])
+        index_minhash(cursor, r["id"], r["content"], r["minhash"])
+    if SHARD_COUNT == 1:
+        # 碰撞计算随语料增长变慢，不占写锁: 只登记 ID，提交后由 CollisionBuilder 在后台计算
+        # （分片模式下碰撞跨分片实时计算，不落库）
+        cursor.executemany("INSERT OR IGNORE INTO collision_queue (capsule_id) VALUES (?)", [(r["id"],) for r in records])
+
+def insert_capsule_chunk(conn, chunk: List[tuple], shard: Shard) -> List[dict]:
+    """单事务写入一个分块；整块失败时回滚并逐条重试以定位出错条目"""
     cursor = conn.cursor()
+    try:
+        insert_capsule_records(cursor, [record for _, record in chunk], shard)
+        conn.commit()
+        return [{"index": index, "id": record["id"], "error": None} for index, record in chunk]
+    except sqlite3.Error:
+        conn.rollback()
+        shard.vectors.load(conn)
     
-    query = "SELECT * FROM capsules WHERE 1=1"
-    params = []
+    results = []
+    for index, record in chunk:
+        try:
+            insert_capsule_records(cursor, [record], shard)
+            conn.commit()
+            results.append({"index": index, "id": record["id"], "error": None})
+        except sqlite3.Error as e:
+            conn.rollback()
+            shard.vectors.load(conn)
+            results.append({"index": index, "id": None, "error": str(e)})
+    return results
+
+def write_capsule_chunk(chunk: List[tuple], shard: Shard, skip_existing: bool = False) -> List[dict]:
+    """预计算后单事务写入同一分片的一个分块（阻塞）；skip_existing 时已存在的 ID 标记为跳过"""
+    results = []
+    if skip_existing:
+        with shard.pool.reader() as conn:
+            ids = [record["id"] for _, record in chunk]
+            existing = {row[0] for row in conn.execute(
+                f"SELECT id FROM capsules WHERE id IN ({','.join('?' * len(ids))})", ids
+            )}
+        results = [{"index": i, "id": r["id"], "error": None, "skipped": True} for i, r in chunk if r["id"] in existing]
+        chunk = [(i, r) for i, r in chunk if r["id"] not in existing]
+    if chunk:
+        prepare_records([record for _, record in chunk], shard)
+        with shard.pool.writer() as conn:
+            results.extend(insert_capsule_chunk(conn, chunk, shard))
+    return results
+
+def write_group(records: List[dict], shard: Shard) -> List[dict]:
+    """组提交的写入函数: 一组单条创建请求合并为一个事务（单条出错时逐条重试，互不影响）"""
+    with shard.pool.writer() as conn:
+        return insert_capsule_chunk(conn, list(enumerate(records)), shard)
+
+async def write_chunk(chunk: List[tuple], skip_existing: bool = False) -> List[dict]:
+    """按分片拆分后在各分片的写线程上并行写入，结果按原始序号排列"""
+    parts = await asyncio.gather(*(
+        shard.db.run_blocking(write_capsule_chunk, sub, shard, skip_existing) for shard, sub in group_by_shard(chunk)
+    ))
+    if collision_builder is not None:
+        collision_builder.notify()
+    return sorted((r for part in parts for r in part), key=lambda r: r["index"])
+
+class V2ImportJob:
+    """v2 胶囊导入：逐条映射，按分块单事务写入，已存在的 ID 跳过（可断点重跑），统计吞吐"""
     
-    if domain:
-        query += " AND domain = ?"
-        params.append(domain)
+    def __init__(self, progress: Optional[Callable[[dict], None]] = None):
+        self.progress = progress
+        self.started = time.perf_counter()
+        self.bytes_read = 0
+        self.parsed = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+        self.pending: List[tuple] = []
     
-    if min_score:
-        query += " AND datm_score >= ?"
-        params.append(min_score)
+    def fail(self, index: int, error: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"index": index, "error": error})
     
-    query += " ORDER BY created_at DESC LIMIT ?"
-    params.append(min(limit, 100))
+    def add(self, item):
+        index = self.parsed
+        self.parsed += 1
+        try:
+            mapped = map_v2_capsule(item)
+            capsule = CapsuleCreate.model_validate({k: v for k, v in mapped.items() if v is not None})
+        except ValueError as e:
+            # pydantic 的 ValidationError 也是 ValueError 子类
+            self.fail(index, e.errors(include_url=False)[0]["msg"] if isinstance(e, ValidationError) else str(e))
+            return
+        record = build_capsule_record(capsule)
+        for key in ("id", "created_at", "updated_at"):
+            if mapped[key]:
+                record[key] = str(mapped[key])
+        if mapped["datm"]:
+            record["datm"] = mapped["datm"]
+            record["datm_hash"] = content_hash(record)
+            record["datm_score"] = mapped["datm"]["overall"]
+        self.pending.append((index, record))
     
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
+    @property
+    def ready(self) -> bool:
+        """攒满一个分块，调用方应 flush"""
+        return len(self.pending) >= BULK_CHUNK_SIZE
     
-    return [{
-        "id": row['id'],
-        "title": row['title'],
-        "content": row['content'],
-        "source": row['source'],
-        "domain": row['domain'],
-        "tags": json.loads(row['tags']) if row['tags'] else [],
-        "datm_score": row['datm_score'],
-        "author": row['author'],
-        "created_at": row['created_at'],
-        "updated_at": row['updated_at']
-    } for row in rows]
+    def take(self) -> List[tuple]:
+        """取出待写入的分块（批内重复 ID 只保留第一条；与库中已有 ID 的比对在写入时按分片进行）"""
+        chunk, seen = [], set()
+        for index, record in self.pending:
+            if record["id"] in seen:
+                self.skipped += 1
+            else:
+                seen.add(record["id"])
+                chunk.append((index, record))
+        self.pending = []
+        return chunk
+    
+    def record(self, results: List[dict]):
+        for result in results:
+            if result.get("skipped"):
+                self.skipped += 1
+            elif result["error"] is None:
+                self.inserted += 1
+            else:
+                self.fail(result["index"], result["error"])
+        if self.progress:
+            self.progress(self.summary())
+    
+    def flush(self):
+        """同步写入（命令行导入），逐分片执行"""
+        chunk = self.take()
+        if chunk:
+            self.record([r for shard, sub in group_by_shard(chunk)
+                         for r in write_capsule_chunk(sub, shard, skip_existing=True)])
+    
+    async def flush_async(self):
+        """路由中使用: 各分片并行写入"""
+        chunk = self.take()
+        if chunk:
+            self.record(await write_chunk(chunk, skip_existing=True))
+    
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "parsed": self.parsed,
+            "inserted": self.inserted,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "errors": self.errors,
+            "bytes": self.bytes_read,
+            "elapsed_s": round(elapsed, 3),
+            "capsules_per_s": round(self.parsed / elapsed, 1) if elapsed else 0,
+            "mb_per_s": round(self.bytes_read / elapsed / 1e6, 3) if elapsed else 0,
+        }
 
-@app.get("/capsules/{capsule_id}", response_model=CapsuleResponse)
-async def get_capsule(capsule_id: str):
-    """获取单个胶囊"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM capsules WHERE id = ?", (capsule_id,))
-    row = cursor.fetchone()
+class CountingReader:
+    """统计已读取字节数的文件包装"""
     
-    if row is None:
-        raise HTTPException(status_code=404, detail="胶囊不存在")
+    def __init__(self, fp, job: V2ImportJob):
+        self.fp = fp
+        self.job = job
     
+    def read(self, size: int = -1) -> bytes:
+        data = self.fp.read(size)
+        self.job.bytes_read += len(data)
+        return data
+
+def import_v2_file(path: str, progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """从文件导入 v2 胶囊（流式解析，内存占用与文件大小无关）"""
+    job = V2ImportJob(progress)
+    with open(path, "rb") as fp:
+        counted = CountingReader(fp, job)
+        for item in iter_json_array(counted):
+            job.add(item)
+            if job.ready:
+                job.flush()
+    job.flush()
+    if collision_builder is not None:
+        collision_builder.drain()
+    return job.summary()
+
+def load_content(cursor, capsule_id: str) -> str:
+    """按需读取单个胶囊的正文"""
+    row = cursor.execute(
+        "SELECT content_text(body, compressed) FROM capsule_content WHERE capsule_id = ?", (capsule_id,)
+    ).fetchone()
+    return row[0] if row else ""
+
+def row_to_capsule(row) -> dict:
+    """数据库行 -> 胶囊字典"""
     return {
         "id": row['id'],
         "title": row['title'],
@@ -228,48 +1039,461 @@ async def get_capsule(capsule_id: str):
         "updated_at": row['updated_at']
     }
 
+def row_to_export(row) -> dict:
+    """数据库行 -> 导出记录（包含全部列）"""
+    record = dict(row)
+    record["tags"] = json.loads(row['tags']) if row['tags'] else []
+    record["metadata"] = json.loads(row['metadata']) if row['metadata'] else None
+    return record
+
+def json_array(bodies) -> bytes:
+    """拼接预序列化的 JSON 对象为数组"""
+    return b"[" + b",".join(bodies) + b"]"
+
+def projection_sql(fields: Optional[str]) -> Optional[tuple]:
+    """fields=id,title,... -> (json_object 表达式, 是否需要正文)；未指定时返回 None，使用完整的预序列化响应体"""
+    if fields is None:
+        return None
+    names = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    if not names:
+        raise HTTPException(status_code=400, detail="fields 不能为空")
+    unknown = [name for name in names if name not in CapsuleResponse.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知字段: {', '.join(unknown)}")
+    columns = {"tags": "COALESCE(json(c.tags), json('[]'))", "content": "content_text(t.body, t.compressed)"}
+    pairs = ", ".join(f"'{name}', {columns.get(name, 'c.' + name)}" for name in names)
+    return f"CAST(json_object({pairs}) AS BLOB)", "content" in names
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 比较（弱比较，支持列表与 *）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def encode_cursor(created_at: str, capsule_id: str) -> str:
+    """分页游标编码（对客户端不透明）"""
+    return base64.urlsafe_b64encode(json.dumps([created_at, capsule_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> List[str]:
+    """分页游标解码"""
+    try:
+        created_at, capsule_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return [str(created_at), str(capsule_id)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+def fts_query(q: str) -> str:
+    """用户查询 -> FTS5 MATCH 表达式（每个词作为二元组短语，词间 AND）
+    单个汉字不会出现在二元组索引里（除非原文中前后都不是汉字），改为前缀查询匹配以它开头的二元组"""
+    phrases = []
+    for term in q.split():
+        tokens = cjk_bigrams(term).split()
+        singles = [t for t in tokens if len(t) == 1 and _CJK_CHAR.match(t)]
+        rest = [t for t in tokens if t not in singles]
+        if rest:
+            phrases.append('"' + " ".join(t.replace('"', '""') for t in rest) + '"')
+        phrases.extend(f'"{t}"*' for t in dict.fromkeys(singles))
+    return " AND ".join(phrases)
+
+# 向量索引依赖上面的嵌入函数，放在工具函数之后加载
+for _shard in shards:
+    sync_vectors(_shard)
+
+# ===================== API路由 =====================
+
+@app.get("/")
+async def root():
+    """服务状态"""
+    return {
+        "service": "Kai Capsule Service",
+        "version": "2.0.0",
+        "status": "running",
+        "database": DB_PATH,
+        "read_pool_size": READ_POOL_SIZE,
+        "shards": SHARD_COUNT,
+        "shard_by": SHARD_BY if SHARD_COUNT > 1 else None
+    }
+
+@app.post("/capsules", response_model=CapsuleResponse)
+async def create_capsule(capsule: CapsuleCreate):
+    """创建知识胶囊"""
+    record = build_capsule_record(capsule)
+    shard = home_shard(record)
+    # 预计算是纯 CPU 与只读查询，放到默认线程池，不占用分片唯一的写线程
+    await asyncio.to_thread(prepare_records, [record], shard)
+    if shard.group is None:
+        await shard.db.run_write(lambda conn: insert_capsule_records(conn.cursor(), [record], shard))
+    else:
+        result = await shard.group.submit(record)
+        if result["error"] is not None:
+            raise HTTPException(status_code=500, detail=f"写入失败: {result['error']}")
+    if collision_builder is not None:
+        collision_builder.notify()
+    return record_to_response(record)
+
+@app.post("/capsules/bulk")
+async def bulk_create_capsules(request: Request):
+    """批量创建胶囊（JSON 数组或 NDJSON 流），每个分块一个事务"""
+    content_type = request.headers.get("content-type", "")
+    results = []
+    pending = []
+    
+    async def flush():
+        chunk = pending[:]
+        pending.clear()
+        results.extend(await write_chunk(chunk))
+    
+    async def accept(index: int, item):
+        try:
+            capsule = CapsuleCreate.model_validate(item)
+        except ValidationError as e:
+            results.append({"index": index, "id": None, "error": e.errors(include_url=False)[0]["msg"]})
+            return
+        pending.append((index, build_capsule_record(capsule)))
+        if len(pending) >= BULK_CHUNK_SIZE:
+            await flush()
+    
+    if "ndjson" in content_type or "jsonl" in content_type:
+        # 按行流式解析，内存只保留当前分块
+        index = 0
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    await accept(index, json.loads(line))
+                except json.JSONDecodeError as e:
+                    results.append({"index": index, "id": None, "error": f"JSON解析失败: {e.msg}"})
+                index += 1
+        if buffer.strip():
+            try:
+                await accept(index, json.loads(buffer))
+            except json.JSONDecodeError as e:
+                results.append({"index": index, "id": None, "error": f"JSON解析失败: {e.msg}"})
+    else:
+        try:
+            items = json.loads(await request.body())
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="请求体不是合法JSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="请求体必须是JSON数组")
+        for index, item in enumerate(items):
+            await accept(index, item)
+    
+    if pending:
+        await flush()
+    
+    results.sort(key=lambda x: x["index"])
+    inserted = sum(1 for r in results if r["error"] is None)
+    return {"inserted": inserted, "failed": len(results) - inserted, "results": results}
+
+@app.post("/capsules/import/v2")
+async def import_v2_capsules(request: Request):
+    """导入 capsules_v2.0.json 格式（顶层数组），请求体流式解析，返回吞吐统计与前若干条错误"""
+    job = V2ImportJob()
+    stream = JSONArrayStream()
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    try:
+        async for chunk in request.stream():
+            job.bytes_read += len(chunk)
+            for item in stream.feed(decoder.decode(chunk)):
+                job.add(item)
+                if job.ready:
+                    await job.flush_async()
+        for item in stream.feed(decoder.decode(b"", final=True), final=True):
+            job.add(item)
+    except (ValueError, UnicodeDecodeError) as e:
+        await job.flush_async()
+        raise HTTPException(status_code=400, detail={"error": f"导入中止: {e}", **job.summary()})
+    await job.flush_async()
+    return job.summary()
+
+@app.get("/capsules", response_class=Response, responses={200: {
+    "model": List[CapsuleResponse], "description": "胶囊数组；指定 fields 时每项只含所选字段"}})
+async def list_capsules(domain: Optional[str] = None, min_score: Optional[float] = None,
+                        limit: int = 20, cursor: Optional[str] = None, fields: Optional[str] = None):
+    """查询胶囊列表（按 created_at, id 倒序的游标分页，下一页游标见 X-Next-Cursor 响应头）
+    响应体由预序列化的 JSON 直接拼接，不经 response_model 校验；
+    fields=id,title,... 只返回指定字段（投影结果是 CapsuleResponse 的子集）；不含 content 时完全不读正文表"""
+    limit = max(1, min(limit, 100))
+    projection = projection_sql(fields)
+    
+    if projection is None:
+        query = f'''
+            SELECT c.created_at, c.id, {CAPSULE_BODY_SQL} AS body
+            FROM capsules c
+            JOIN capsule_json j ON j.capsule_id = c.id
+            JOIN capsule_content t ON t.capsule_id = c.id
+            WHERE 1=1'''
+    else:
+        expr, needs_content = projection
+        query = f"SELECT c.created_at, c.id, {expr} AS body FROM capsules c"
+        if needs_content:
+            query += " JOIN capsule_content t ON t.capsule_id = c.id"
+        query += " WHERE 1=1"
+    params = []
+    
+    if domain:
+        query += " AND c.domain = ?"
+        params.append(domain)
+    
+    if min_score is not None:
+        query += " AND c.datm_score >= ?"
+        params.append(min_score)
+    
+    if cursor:
+        query += " AND (c.created_at, c.id) < (?, ?)"
+        params.extend(decode_cursor(cursor))
+    
+    query += " ORDER BY c.created_at DESC, c.id DESC LIMIT ?"
+    params.append(limit + 1)
+    
+    # 各分片按相同游标条件各取一页，再按 (created_at, id) 归并
+    parts = await fan_out([shard.db for shard in shards_for(domain)], lambda conn: conn.execute(query, params).fetchall())
+    rows = list(itertools.islice(
+        heapq.merge(*parts, key=lambda r: (r['created_at'], r['id']), reverse=True), limit + 1
+    ))
+    
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    
+    # 直接拼接预序列化的响应体，跳过逐行解析与模型校验
+    return Response(content=json_array(row['body'] for row in rows), media_type="application/json", headers=headers)
+
+@app.get("/capsules/export")
+async def export_capsules(domain: Optional[str] = None, min_score: Optional[float] = None,
+                          since: Optional[str] = None, until: Optional[str] = None, gzip: bool = False):
+    """流式导出全部胶囊（NDJSON，可选 gzip），内存占用与语料规模无关"""
+    query = "SELECT * FROM capsules_full WHERE 1=1"
+    params = []
+    
+    if domain:
+        query += " AND domain = ?"
+        params.append(domain)
+    
+    if min_score is not None:
+        query += " AND datm_score >= ?"
+        params.append(min_score)
+    
+    if since:
+        query += " AND created_at >= ?"
+        params.append(since)
+    
+    if until:
+        query += " AND created_at < ?"
+        params.append(until)
+    
+    order = " ORDER BY created_at, id LIMIT ?"
+    
+    def pages(shard: Shard):
+        """按 (created_at, id) 键集分页读取一个分片: 每批单独借用只读连接，批间不占连接、不持有读事务，
+        慢客户端不会拖住连接池或阻止 WAL 检查点（代价是各批不在同一快照内）"""
+        rows = None
+        while rows is None or len(rows) == EXPORT_BATCH_SIZE:
+            if rows is None:
+                sql, args = query + order, [*params, EXPORT_BATCH_SIZE]
+            else:
+                sql = query + " AND (created_at, id) > (?, ?)" + order
+                args = [*params, rows[-1]['created_at'], rows[-1]['id'], EXPORT_BATCH_SIZE]
+            with shard.pool.reader() as conn:
+                rows = conn.execute(sql, args).fetchall()
+            yield from rows
+    
+    def lines():
+        # 各分片按 (created_at, id) 有序分页，流式归并
+        merged = heapq.merge(*(pages(shard) for shard in shards_for(domain)), key=lambda r: (r['created_at'], r['id']))
+        while True:
+            rows = list(itertools.islice(merged, EXPORT_BATCH_SIZE))
+            if not rows:
+                break
+            yield "".join(
+                json.dumps(row_to_export(row), ensure_ascii=False) + "\n" for row in rows
+            ).encode()
+    
+    def gzipped():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip 格式
+        for chunk in lines():
+            # 每批 SYNC_FLUSH 一次，保证数据尽快到达客户端
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    
+    if gzip:
+        return StreamingResponse(gzipped(), media_type="application/gzip", headers={
+            "Content-Disposition": 'attachment; filename="capsules.ndjson.gz"'
+        })
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/capsules/search", response_model=CapsuleSearchResponse)
+async def search_capsules(q: str = Query(..., min_length=1), limit: int = 20, offset: int = 0):
+    """全文搜索（BM25 排序，标题权重更高）"""
+    match = fts_query(q)
+    if not match:
+        raise HTTPException(status_code=400, detail="搜索词无效")
+    
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    
+    # 多分片时每个分片取前 offset+limit+1 条再按 rank 归并（BM25 的 IDF 按分片统计，分数为近似可比）
+    fanned = len(shards) > 1
+    window = (match, offset + limit + 1, 0) if fanned else (match, limit + 1, offset)
+    parts = await fan_out([shard.db for shard in shards], lambda conn: conn.execute(f'''
+        SELECT {CAPSULE_BODY_SQL} AS body, bm25(capsules_fts, 2.0, 1.0) AS rank
+        FROM capsules_fts
+        JOIN capsules c ON c.rowid = capsules_fts.rowid
+        JOIN capsule_json j ON j.capsule_id = c.id
+        JOIN capsule_content t ON t.capsule_id = c.id
+        WHERE capsules_fts MATCH ?
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    ''', window).fetchall())
+    rows = list(itertools.islice(heapq.merge(*parts, key=lambda r: r['rank']), offset if fanned else 0, None))
+    
+    head = json.dumps({"query": q, "limit": limit, "offset": offset, "has_more": len(rows) > limit},
+                      ensure_ascii=False, separators=(",", ":")).encode()
+    results = json_array(
+        row['body'][:-1] + b',"score":' + repr(round(-row['rank'], 4)).encode() + b"}"
+        for row in rows[:limit]
+    )
+    return Response(content=head[:-1] + b',"results":' + results + b"}", media_type="application/json")
+
+@app.get("/capsules/{capsule_id}", response_class=Response, responses={200: {
+    "model": CapsuleResponse, "description": "胶囊；指定 fields 时只含所选字段"}})
+async def get_capsule(capsule_id: str, request: Request, fields: Optional[str] = None):
+    """获取单个胶囊（LRU 缓存预序列化响应体，支持 ETag / If-None-Match；fields=id,title,... 字段投影不走缓存）"""
+    projection = projection_sql(fields)
+    if projection is not None:
+        expr, needs_content = projection
+        join = " JOIN capsule_content t ON t.capsule_id = c.id" if needs_content else ""
+        shard = await locate(capsule_id)
+        row = shard and await shard.db.fetchone(f"SELECT {expr} AS body FROM capsules c{join} WHERE c.id = ?", (capsule_id,))
+        if row is None:
+            raise HTTPException(status_code=404, detail="胶囊不存在")
+        cached = (row['body'], '"' + hashlib.sha256(row['body']).hexdigest()[:32] + '"')
+    else:
+        cached = capsule_cache.get(capsule_id)
+    if cached is None:
+        # 先取代数再回源: 读取期间胶囊被删除或改写（缓存被失效）时不把旧值放回缓存
+        generation = capsule_cache.generation(capsule_id)
+        shard = await locate(capsule_id)
+        row = shard and await shard.db.fetchone(f'''
+            SELECT {CAPSULE_BODY_SQL} AS body
+            FROM capsule_json j JOIN capsule_content t ON t.capsule_id = j.capsule_id
+            WHERE j.capsule_id = ?
+        ''', (capsule_id,))
+        
+        if row is None:
+            raise HTTPException(status_code=404, detail="胶囊不存在")
+        
+        body = row['body']
+        cached = (body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+        capsule_cache.put_if_current(capsule_id, cached, generation)
+    
+    body, etag = cached
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
 @app.delete("/capsules/{capsule_id}")
 async def delete_capsule(capsule_id: str):
     """删除胶囊"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM capsules WHERE id = ?", (capsule_id,))
-    conn.commit()
+    def delete(conn):
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM capsules WHERE id = ?", (capsule_id,))
+        deleted = cursor.rowcount
+        cursor.execute("DELETE FROM capsule_content WHERE capsule_id = ?", (capsule_id,))
+        cursor.execute("DELETE FROM capsule_tags WHERE capsule_id = ?", (capsule_id,))
+        cursor.execute("DELETE FROM capsule_minhash WHERE capsule_id = ?", (capsule_id,))
+        cursor.execute("DELETE FROM capsule_lsh WHERE capsule_id = ?", (capsule_id,))
+        cursor.execute("DELETE FROM capsule_datm WHERE capsule_id = ?", (capsule_id,))
+        shard.vectors.remove(cursor, [capsule_id])
+        cursor.execute("DELETE FROM collisions WHERE capsule_a_id = ?", (capsule_id,))
+        cursor.execute("DELETE FROM collisions WHERE capsule_b_id = ?", (capsule_id,))
+        cursor.execute("DELETE FROM collision_queue WHERE capsule_id = ?", (capsule_id,))
+        return deleted
+    
+    shard = await locate(capsule_id)
+    deleted = await shard.db.run_write(delete) if shard else 0
+    capsule_cache.invalidate(capsule_id)
+    shard_routes.invalidate(capsule_id)
     
-    if cursor.rowcount == 0:
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="胶囊不存在")
     
     return {"status": "deleted", "id": capsule_id}
 
-@app.get("/collisions/{capsule_id}")
-async def detect_collisions(capsule_id: str, threshold: float = 0.5):
-    """碰撞检测"""
-    conn = get_db()
-    cursor = conn.cursor()
+@app.get("/capsules/{capsule_id}/datm")
+async def get_capsule_datm(capsule_id: str):
+    """胶囊的 DATM 四维评分"""
+    shard = await locate(capsule_id)
+    row = shard and await shard.db.fetchone('''
+        SELECT c.datm_score, d.*
+        FROM capsules c
+        LEFT JOIN capsule_datm d ON d.capsule_id = c.id
+        WHERE c.id = ?
+    ''', (capsule_id,))
     
-    cursor.execute("SELECT * FROM capsules WHERE id = ?", (capsule_id,))
-    target = cursor.fetchone()
-    
-    if target is None:
+    if row is None:
         raise HTTPException(status_code=404, detail="胶囊不存在")
     
+    scored = row['scorer_version'] is not None
+    return {
+        "id": capsule_id,
+        "datm_score": row['datm_score'],
+        "dimensions": {dim: row[dim] for dim in DIMENSIONS} if scored else None,
+        "scorer_version": row['scorer_version'],
+        "stale": (bool(row['stale']) or row['scorer_version'] != SCORER_VERSION) if scored else True,
+        "scored_at": row['scored_at']
+    }
+
+@app.post("/datm/rescore")
+async def trigger_rescore(background_tasks: BackgroundTasks, batch_size: int = 500):
+    """后台重评过期的 DATM 评分"""
+    background_tasks.add_task(rescore_stale, max(1, min(batch_size, 5000)))
+    return {"status": "scheduled", "scorer_version": SCORER_VERSION}
+
+def target_content(cursor, target) -> str:
+    """碰撞目标的正文: 写入路径与跨分片查询已随目标带上，否则按需读取"""
+    return target['content'] if "content" in target.keys() else load_content(cursor, target['id'])
+
+def find_tag_collisions(cursor, shard: Shard, target, threshold: float) -> List[dict]:
+    """标签碰撞: 只对至少共享一个标签的胶囊打分（倒排索引求交）
+    常见标签的倒排表随语料线性增长，打分、过滤与取前 COLLISION_MAX_PER_TYPE 条都在 SQL 内完成，只把入选的行交给 Python"""
     target_tags = set(json.loads(target['tags']) if target['tags'] else [])
-    target_domain = target['domain']
     
-    cursor.execute("SELECT * FROM capsules WHERE id != ?", (capsule_id,))
-    all_capsules = cursor.fetchall()
+    if not target_tags:
+        return []
+    
+    # 打分只扫倒排表（行内带领域与标签数），入选的前若干条才回表取标题；
+    # 排序用未取整的分数，入选后再按原口径取整比较阈值（留出取整的余量）
+    cursor.execute('''
+        SELECT c.id, c.title, c.domain, x.overlap, x.tag_count
+        FROM (
+            SELECT capsule_id, tag_count, COUNT(*) AS overlap,
+                   COUNT(*) * 1.0 / MAX(tag_count, :n) * (CASE WHEN domain = :domain THEN 1.2 ELSE 1.0 END) AS raw
+            FROM capsule_tags
+            WHERE tag IN (SELECT value FROM json_each(:tags)) AND capsule_id != :id
+            GROUP BY capsule_id
+            HAVING raw >= :threshold - 0.0005
+            ORDER BY raw DESC, capsule_id
+            LIMIT :limit
+        ) x
+        JOIN capsules c ON c.id = x.capsule_id
+        ORDER BY x.raw DESC, c.id
+    ''', {"n": len(target_tags), "domain": target['domain'], "tags": json.dumps(sorted(target_tags), ensure_ascii=False),
+          "id": target['id'], "threshold": threshold, "limit": COLLISION_MAX_PER_TYPE})
     
     collisions = []
-    for capsule in all_capsules:
-        capsule_tags = set(json.loads(capsule['tags']) if capsule['tags'] else [])
-        
-        if target_tags and capsule_tags:
-            overlap = len(target_tags & capsule_tags)
-            similarity = overlap / max(len(target_tags), len(capsule_tags))
-        else:
-            similarity = 0
+    for capsule in cursor.fetchall():
+        similarity = capsule['overlap'] / max(len(target_tags), capsule['tag_count'])
         
-        domain_bonus = 1.2 if capsule['domain'] == target_domain else 1.0
+        domain_bonus = 1.2 if capsule['domain'] == target['domain'] else 1.0
         final_score = round(similarity * domain_bonus, 3)
         
         if final_score >= threshold:
@@ -279,28 +1503,375 @@ async def detect_collisions(capsule_id: str, threshold: float = 0.5):
                 "domain": capsule['domain'],
                 "score": final_score
             })
+    return collisions
+
+def content_candidates_sql(n_buckets: int) -> str:
+    """LSH 候选召回: 由目标的 (band, bucket) 列表驱动，逐个按主键查找 capsule_lsh
+    查询计划必须是 SEARCH capsule_lsh USING PRIMARY KEY；写成 (band, bucket) IN (VALUES ...) 会退化为全表扫描"""
+    values = ",".join("(?, ?)" for _ in range(n_buckets))
+    return f'''
+        SELECT c.id, c.title, c.domain, m.signature
+        FROM (
+            SELECT DISTINCT l.capsule_id
+            FROM (VALUES {values}) AS v
+            JOIN capsule_lsh l ON l.band = v.column1 AND l.bucket = v.column2 AND l.capsule_id != ?
+        ) x
+        JOIN capsule_minhash m ON m.capsule_id = x.capsule_id
+        JOIN capsules c ON c.id = x.capsule_id
+    '''
+
+def find_content_collisions(cursor, shard: Shard, target, threshold: float) -> List[dict]:
+    """内容碰撞: LSH 分桶召回候选，再用 MinHash 估计 Jaccard 相似度"""
+    cursor.execute("SELECT signature FROM capsule_minhash WHERE capsule_id = ?", (target['id'],))
+    row = cursor.fetchone()
+    target_sig = unpack_signature(row['signature']) if row else minhash_signature(target_content(cursor, target))
+    buckets = lsh_buckets(target_sig)
+    cursor.execute(content_candidates_sql(len(buckets)), (*[v for bucket in buckets for v in bucket], target['id']))
+    
+    candidates = cursor.fetchall()
+    
+    collisions = []
+    for capsule, similarity in zip(candidates, estimate_similarities(target_sig, [c['signature'] for c in candidates])):
+        score = round(similarity, 3)
+        if score >= threshold:
+            collisions.append({
+                "capsule_id": capsule['id'],
+                "title": capsule['title'],
+                "domain": capsule['domain'],
+                "score": score
+            })
+    return collisions
+
+def find_semantic_collisions(cursor, shard: Shard, target, threshold: float) -> List[dict]:
+    """语义碰撞: 向量矩阵一次矩阵-向量乘积取 top-k TF-IDF 余弦相似度（对称，A→B 与 B→A 同分）"""
+    shard.vectors.refresh(cursor)
+    vector = shard.vectors.vector(target['id'])
+    if vector is None:
+        vector = embed_capsule({"title": target['title'], "content": target_content(cursor, target)})
+    hits = [(cid, score) for cid, score in shard.vectors.search(vector, k=20, exclude=target['id']) if score >= threshold]
+    if not hits:
+        return []
+    
+    placeholders = ",".join("?" * len(hits))
+    cursor.execute(f"SELECT id, title, domain FROM capsules WHERE id IN ({placeholders})", [cid for cid, _ in hits])
+    meta = {row['id']: row for row in cursor.fetchall()}
+    return [
+        {
+            "capsule_id": cid,
+            "title": meta[cid]['title'],
+            "domain": meta[cid]['domain'],
+            "score": round(score, 3)
+        }
+        for cid, score in hits if cid in meta
+    ]
+
+COLLISION_FINDERS = {
+    "tags": find_tag_collisions,
+    "content": find_content_collisions,
+    "semantic": find_semantic_collisions,
+}
+
+def collect_collisions(cursor, shard: Shard, targets) -> List[tuple]:
+    """计算目标胶囊与现有语料的碰撞，返回待落库的 (a, b, type, score) 行"""
+    rows = []
+    for target in targets:
+        for mode, finder in COLLISION_FINDERS.items():
+            found = sorted(finder(cursor, shard, target, COLLISION_MIN_SCORE), key=lambda x: x['score'], reverse=True)
+            for hit in found[:COLLISION_MAX_PER_TYPE]:
+                a, b = sorted((target['id'], hit['capsule_id']))
+                rows.append((a, b, mode, hit['score']))
+    return rows
+
+def save_collisions(cursor, rows: List[tuple]):
+    """碰撞落库（同一对胶囊同一类型只保留一行）；碰撞在只读快照上算出，落库前任一方已被删除的跳过"""
+    now = datetime.utcnow().isoformat()
+    cursor.executemany('''
+        INSERT INTO collisions (capsule_a_id, capsule_b_id, collision_type, score, created_at)
+        SELECT ?1, ?2, ?3, ?4, ?5
+        WHERE EXISTS (SELECT 1 FROM capsules WHERE id = ?1) AND EXISTS (SELECT 1 FROM capsules WHERE id = ?2)
+        ON CONFLICT(capsule_a_id, capsule_b_id, collision_type)
+        DO UPDATE SET score = excluded.score, created_at = excluded.created_at
+    ''', [(*row, now) for row in rows])
+
+class CollisionBuilder:
+    """后台碰撞计算: 写入事务只把新胶囊登记到 collision_queue，提交后按批在只读连接上计算、
+    在写连接上落库并出队，写锁只覆盖碰撞行的插入。后台任务在首次 notify 时按当前事件循环启动"""
+    
+    def __init__(self, shard: Shard, batch_size: int = COLLISION_BATCH_SIZE):
+        self.shard = shard
+        self.batch_size = max(1, batch_size)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"batches": 0, "processed": 0, "pairs": 0, "failed_batches": 0, "last_error": None}
+    
+    def compute(self, conn) -> tuple:
+        """取队首一批（只读连接）: 返回 (出队 ID, 待落库碰撞行)；已删除的胶囊只出队"""
+        cursor = conn.cursor()
+        queued = cursor.execute('''
+            SELECT q.capsule_id AS queued, c.* FROM collision_queue q
+            LEFT JOIN capsules c ON c.id = q.capsule_id
+            ORDER BY q.rowid LIMIT ?
+        ''', (self.batch_size,)).fetchall()
+        targets = [row for row in queued if row['id'] is not None]
+        return [row['queued'] for row in queued], collect_collisions(cursor, self.shard, targets)
+    
+    def save(self, conn, ids: List[str], rows: List[tuple]):
+        """落库并出队（写连接，调用方提交）"""
+        cursor = conn.cursor()
+        save_collisions(cursor, rows)
+        cursor.executemany("DELETE FROM collision_queue WHERE capsule_id = ?", [(i,) for i in ids])
+        self._stats["batches"] += 1
+        self._stats["processed"] += len(ids)
+        self._stats["pairs"] += len(rows)
+    
+    def drain(self) -> int:
+        """同步处理完整个队列（命令行导入、重建、基准灌库），返回处理的胶囊数"""
+        processed = 0
+        while True:
+            with self.shard.pool.reader() as conn:
+                ids, rows = self.compute(conn)
+            if not ids:
+                return processed
+            with self.shard.pool.writer() as conn:
+                self.save(conn, ids, rows)
+                conn.commit()
+            processed += len(ids)
+    
+    def notify(self):
+        """写入提交后调用: 唤醒后台任务（须在事件循环中调用）"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        self._wake.set()
+    
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                while True:
+                    ids, rows = await self.shard.db.run_read(self.compute)
+                    if not ids:
+                        break
+                    await self.shard.db.run_write(self.save, ids, rows)
+            except Exception as e:
+                # 队列是持久的，失败的批次留在队首，下次 notify 时重试
+                self._stats["failed_batches"] += 1
+                self._stats["last_error"] = str(e)
     
-    collisions.sort(key=lambda x: x['score'], reverse=True)
-    return {"collisions": collisions[:20]}
+    async def close(self):
+        """停止后台任务（须在同一事件循环中调用）；未处理的队列留待下次启动"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+    
+    def stats(self) -> dict:
+        with self.shard.pool.reader() as conn:
+            queued = conn.execute("SELECT COUNT(*) FROM collision_queue").fetchone()[0]
+        return {"queued": queued, "running": self._task is not None and not self._task.done(), **self._stats}
+
+# 分片模式下碰撞实时计算，不落库，没有后台任务
+collision_builder = CollisionBuilder(shards[0]) if SHARD_COUNT == 1 else None
+
+def mark_collisions_built(conn):
+    """持久标记碰撞表已建成（或全量回填已入队），重启时不再重建"""
+    conn.execute(
+        "INSERT OR REPLACE INTO service_meta (key, value) VALUES ('collisions_built', ?)",
+        (datetime.utcnow().isoformat(),)
+    )
+
+def rebuild_collisions() -> dict:
+    """修复: 清空碰撞表，全部胶囊重新入队后分批计算、分批写入（分片模式下碰撞实时计算，不落库）"""
+    if collision_builder is None:
+        return {"processed": 0, "pairs": 0}
+    shard = collision_builder.shard
+    with shard.pool.writer() as conn:
+        conn.execute("DELETE FROM collisions")
+        conn.execute("INSERT OR IGNORE INTO collision_queue (capsule_id) SELECT id FROM capsules ORDER BY rowid")
+        conn.commit()
+    
+    processed = collision_builder.drain()
+    
+    with shard.pool.writer() as conn:
+        mark_collisions_built(conn)
+        conn.commit()
+        stored = conn.execute("SELECT COUNT(*) FROM collisions").fetchone()[0]
+    return {"processed": processed, "pairs": stored}
+
+async def fan_out_collisions(home: Shard, capsule_id: str, mode: str, threshold: float) -> List[dict]:
+    """分片模式: 目标胶囊（连同正文）取自所在分片，各分片并行实时计算碰撞，再按分数归并取前 20"""
+    target = await home.db.fetchone('''
+        SELECT c.*, content_text(t.body, t.compressed) AS content
+        FROM capsules c JOIN capsule_content t ON t.capsule_id = c.id
+        WHERE c.id = ?
+    ''', (capsule_id,))
+    if target is None:
+        raise HTTPException(status_code=404, detail="胶囊不存在")
+    
+    finder = COLLISION_FINDERS[mode]
+    parts = await asyncio.gather(*(
+        shard.db.run_read(lambda conn, shard=shard: finder(conn.cursor(), shard, target, threshold)) for shard in shards
+    ))
+    return heapq.nlargest(20, (hit for part in parts for hit in part), key=lambda x: x['score'])
+
+@app.get("/collisions/{capsule_id}")
+async def detect_collisions(capsule_id: str, threshold: float = 0.5,
+                            mode: str = Query("tags", pattern="^(tags|content|semantic)$")):
+    """碰撞检测（mode=tags 标签重叠 / mode=content 内容近重复 / mode=semantic 语义相似）"""
+    shard = await locate(capsule_id)
+    if shard is None:
+        raise HTTPException(status_code=404, detail="胶囊不存在")
+    if SHARD_COUNT > 1:
+        return {"collisions": await fan_out_collisions(shard, capsule_id, mode, threshold)}
+    
+    def detect(conn):
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT * FROM capsules WHERE id = ?", (capsule_id,))
+        target = cursor.fetchone()
+        
+        if target is None:
+            raise HTTPException(status_code=404, detail="胶囊不存在")
+        
+        # 低于落库下限的阈值无法从碰撞表得到完整结果、胶囊仍在后台计算队列中时，退回实时计算
+        if threshold < COLLISION_MIN_SCORE or cursor.execute(
+            "SELECT 1 FROM collision_queue WHERE capsule_id = ?", (capsule_id,)
+        ).fetchone():
+            collisions = COLLISION_FINDERS[mode](cursor, shard, target, threshold)
+            collisions.sort(key=lambda x: x['score'], reverse=True)
+            return {"collisions": collisions[:20]}
+        
+        cursor.execute('''
+            SELECT c.id, c.title, c.domain, x.score
+            FROM (
+                SELECT capsule_b_id AS other, score FROM collisions
+                WHERE capsule_a_id = ? AND collision_type = ? AND score >= ?
+                UNION ALL
+                SELECT capsule_a_id AS other, score FROM collisions
+                WHERE capsule_b_id = ? AND collision_type = ? AND score >= ?
+            ) x
+            JOIN capsules c ON c.id = x.other
+            ORDER BY x.score DESC
+            LIMIT 20
+        ''', (capsule_id, mode, threshold) * 2)
+        
+        return {"collisions": [{
+            "capsule_id": row['id'],
+            "title": row['title'],
+            "domain": row['domain'],
+            "score": row['score']
+        } for row in cursor.fetchall()]}
+    
+    return await shard.db.run_read(detect)
+
+# 旧库迁移: 以持久标记判断碰撞表是否建成过（碰撞表为空不代表没建过）。没有标记时，
+# 已有碰撞数据的旧库直接补标记；否则全部胶囊入队，由后台任务在服务启动后计算，不阻塞启动
+if collision_builder is not None:
+    with collision_builder.shard.pool.writer() as _conn:
+        if _conn.execute("SELECT 1 FROM service_meta WHERE key = 'collisions_built'").fetchone() is None:
+            if _conn.execute("SELECT 1 FROM collisions LIMIT 1").fetchone() is None:
+                _conn.execute("INSERT OR IGNORE INTO collision_queue (capsule_id) SELECT id FROM capsules ORDER BY rowid")
+            mark_collisions_built(_conn)
+            _conn.commit()
+
+@app.get("/stats/collisions")
+async def get_collision_stats():
+    """后台碰撞计算: 队列长度与处理统计（分片模式下碰撞实时计算，无队列）"""
+    if collision_builder is None:
+        return {"queued": 0, "running": False}
+    return await asyncio.to_thread(collision_builder.stats)
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+    """单胶囊响应缓存命中率"""
+    return capsule_cache.stats()
+
+@app.get("/stats/pool")
+async def get_pool_stats():
+    """连接池利用率（含排队等待执行的读写任务数与组提交统计）；分片模式下按分片列出"""
+    def shard_stats(shard: Shard) -> dict:
+        stats = shard.db.stats()
+        if shard.group is not None:
+            stats["group_commit"] = shard.group.stats()
+        return stats
+    
+    if SHARD_COUNT == 1:
+        return shard_stats(shards[0])
+    return {"shards": [{"shard": shard.index, "path": shard.path, **shard_stats(shard)} for shard in shards]}
 
 @app.get("/stats")
 async def get_stats():
-    """统计信息"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM capsules")
-    total = cursor.fetchone()[0]
+    """统计信息（读增量维护的 domain_stats，O(领域数)；分片模式下并行读取各分片后按领域合并）"""
+    parts = await fan_out([shard.db for shard in shards], lambda conn: conn.execute("SELECT * FROM domain_stats").fetchall())
+    merged: Dict[str, dict] = {}
+    for row in itertools.chain.from_iterable(parts):
+        domain = row['domain'] or None  # 无领域的胶囊在 domain_stats 中记为 ''
+        acc = merged.setdefault(domain, {"domain": domain, "count": 0, "scored": 0, "score_sum": 0.0, "score_sq_sum": 0.0})
+        for key in ("count", "scored", "score_sum", "score_sq_sum"):
+            acc[key] += row[key]
+    rows = list(merged.values())
     
-    cursor.execute("SELECT AVG(datm_score) FROM capsules")
-    avg_score = cursor.fetchone()[0] or 0
+    total = sum(row['count'] for row in rows)
+    scored = sum(row['scored'] for row in rows)
+    avg_score = sum(row['score_sum'] for row in rows) / scored if scored else 0
     
-    cursor.execute("SELECT domain, COUNT(*) FROM capsules GROUP BY domain")
-    domains = {row['domain']: row[1] for row in cursor.fetchall()}
+    domain_scores = {}
+    for row in rows:
+        if row['scored']:
+            mean = row['score_sum'] / row['scored']
+            variance = max(row['score_sq_sum'] / row['scored'] - mean * mean, 0)
+            domain_scores[row['domain']] = {"avg": round(mean, 2), "std": round(math.sqrt(variance), 2)}
     
-    return {"total_capsules": total, "avg_datm_score": round(avg_score, 2), "domains": domains}
+    return {
+        "total_capsules": total,
+        "avg_datm_score": round(avg_score, 2),
+        "domains": {row['domain']: row['count'] for row in rows},
+        "domain_scores": domain_scores
+    }
 
 # ===================== 启动 =====================
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8005)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Kai Capsule Service")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("serve", help="启动服务（默认）")
+    sub.add_parser("rebuild-stats", help="从 capsules 全量重建统计表")
+    rescore = sub.add_parser("rescore", help="重评未评分或内容已变更的胶囊")
+    rescore.add_argument("--batch-size", type=int, default=500)
+    sub.add_parser("rebuild-collisions", help="清空并全量重算碰撞表")
+    keywords = sub.add_parser("rebuild-keywords", help="全量重建关键词文档频率表，可选重新生成自动标签")
+    keywords.add_argument("--retag", choices=["empty", "all"], help="empty: 仅无标签胶囊；all: 全部胶囊")
+    import_v2 = sub.add_parser("import-v2", help="流式导入 capsules_v2.0.json 格式文件")
+    import_v2.add_argument("path")
+    args = parser.parse_args()
+    
+    if args.command == "rebuild-stats":
+        for shard in shards:
+            with shard.pool.writer() as conn:
+                rebuild_stats(conn.cursor())
+                conn.commit()
+        print("domain_stats 已重建")
+    elif args.command == "rescore":
+        print(rescore_stale(args.batch_size))
+    elif args.command == "rebuild-collisions":
+        print(rebuild_collisions())
+    elif args.command == "rebuild-keywords":
+        print(rebuild_keywords(args.retag))
+    elif args.command == "import-v2":
+        def report(summary):
+            print(f"已解析 {summary['parsed']} 条，写入 {summary['inserted']}，跳过 {summary['skipped']}，"
+                  f"失败 {summary['failed']}，{summary['capsules_per_s']} 条/秒，{summary['mb_per_s']} MB/秒",
+                  file=sys.stderr)
+        summary = import_v2_file(args.path, progress=report)
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8005)
@@ -0,0 +1,91 @@
+"""
+MinHash + LSH 内容相似度
+基于字符 shingle 计算 MinHash 签名，按 band 分桶做局部敏感哈希候选召回
+"""
+from array import array
+from typing import Iterable, List, Set, Tuple
+import hashlib
+import random
+import re
+
+import numpy as np
+
+# ===================== 参数 =====================
+SHINGLE_SIZE = 3          # 字符 n-gram 长度（对中文友好）
+NUM_PERM = 128            # 签名长度
+LSH_BANDS = 32            # band 数
+LSH_ROWS = NUM_PERM // LSH_BANDS  # 每个 band 的行数，召回阈值约 (1/b)^(1/r) ≈ 0.42
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = random.Random(20260202)  # 固定种子，保证签名跨进程可比
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+_NOISE = re.compile(r"[\s\W_]+", re.UNICODE)
+# 向量化计算用: a 拆成高 29 位与低 32 位，保证每一步乘积都不超出 uint64
+_A = np.array([a for a, _ in _PERMUTATIONS], dtype=np.uint64)
+_A_HI = (_A >> np.uint64(32))[:, None]
+_A_LO = (_A & np.uint64(_MAX_HASH))[:, None]
+_B = np.array([b for _, b in _PERMUTATIONS], dtype=np.uint64)[:, None]
+_P = np.uint64(_MERSENNE_PRIME)
+
+# ===================== 签名 =====================
+def shingles(text: str, k: int = SHINGLE_SIZE) -> Set[str]:
+    """字符 shingle（去除空白与标点）"""
+    text = _NOISE.sub("", text.lower())
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+def _hash32(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), "little")
+
+def _mod_p(x: np.ndarray) -> np.ndarray:
+    """x mod (2^61 - 1)，x < 2^64；梅森素数取模只需移位与加法"""
+    x = (x & _P) + (x >> np.uint64(61))
+    return np.where(x >= _P, x - _P, x)
+
+def minhash_signature(text: str) -> List[int]:
+    """计算 MinHash 签名，空文本返回全最大值签名
+    全部排列一次矩阵运算: (a·h + b) mod P 按 a = a_hi·2^32 + a_lo 拆分后在 uint64 内精确求值，结果与逐个整数计算一致"""
+    hashes = np.fromiter((_hash32(s) for s in shingles(text)), dtype=np.uint64)
+    if not hashes.size:
+        return [_MAX_HASH] * NUM_PERM
+    h = hashes[None, :]
+    low = _mod_p(_A_LO * h)                       # a_lo·h < 2^64
+    high = _A_HI * h                              # a_hi·h < 2^61，再乘 2^32: 2^61 ≡ 1 (mod P)
+    high = _mod_p((high >> np.uint64(29)) + ((high & np.uint64((1 << 29) - 1)) << np.uint64(32)))
+    values = _mod_p(low + high + _B) & np.uint64(_MAX_HASH)
+    return values.min(axis=1).tolist()
+
+def lsh_buckets(signature: List[int]) -> List[Tuple[int, int]]:
+    """签名 -> [(band, bucket)]"""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = array("I", signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]).tobytes()
+        bucket = int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), "little", signed=True)
+        buckets.append((band, bucket))
+    return buckets
+
+def estimate_similarity(sig_a: Iterable[int], sig_b: Iterable[int]) -> float:
+    """估计 Jaccard 相似度"""
+    sig_a, sig_b = list(sig_a), list(sig_b)
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+def estimate_similarities(signature: List[int], packed: List[bytes]) -> List[float]:
+    """一个签名对一批打包签名（pack_signature）的 Jaccard 估计，逐位比较一次完成"""
+    if not packed:
+        return []
+    others = np.frombuffer(b"".join(packed), dtype=np.uint32).reshape(len(packed), NUM_PERM)
+    return (others == np.asarray(signature, dtype=np.uint32)).mean(axis=1).tolist()
+
+# ===================== 序列化 =====================
+def pack_signature(signature: List[int]) -> bytes:
+    return array("I", signature).tobytes()
+
+def unpack_signature(blob: bytes) -> List[int]:
+    sig = array("I")
+    sig.frombytes(blob)
+    return sig.tolist()
@@ -12,6 +12,7 @@ import random
 # 配置
 OLLAMA_URL = "http://localhost:11434"
 CAPSULE_API = "http://localhost:8005"
+BATCH_SIZE = 20  # 每次批量写入的胶囊数
 
 # 100个主题
 TOPICS = [
@@ -167,23 +168,35 @@ def generate_capsule_content(topic: str) -> str:
     content = call_llm(prompt)
     return content
 
-def save_capsule(title: str, content: str, domain: str) -> dict:
-    """保存胶囊"""
+def save_capsules(capsules: list) -> list:
+    """批量保存胶囊，返回逐条结果"""
     try:
         resp = requests.post(
-            f"{CAPSULE_API}/capsules",
-            json={"title": title, "content": content, "domain": domain},
-            timeout=30
+            f"{CAPSULE_API}/capsules/bulk",
+            json=capsules,
+            timeout=60
         )
-        return resp.json()
+        return resp.json()["results"]
     except Exception as e:
-        return {"error": str(e)}
+        return [{"id": None, "error": str(e)} for _ in capsules]
 
 def main():
     print(f"开始生成 {len(TOPICS)} 个知识胶囊...")
     
     success = 0
     failed = 0
+    pending = []
+    
+    def flush():
+        nonlocal success, failed
+        for capsule, result in zip(pending, save_capsules(pending)):
+            if result.get("error"):
+                print(f"  ❌ 保存失败: {capsule['title']} - {result['error']}")
+                failed += 1
+            else:
+                print(f"  ✅ 已创建: {result.get('id', 'unknown')}")
+                success += 1
+        pending.clear()
     
     for i, topic in enumerate(TOPICS):
         print(f"[{i+1}/100] 生成: {topic}")
@@ -196,19 +209,16 @@ def main():
             failed += 1
             continue
             
-        # 保存胶囊
-        domain = get_domain(topic)
-        result = save_capsule(topic, content, domain)
-        
-        if "error" in result:
-            print(f"  ❌ 保存失败: {result['error']}")
-            failed += 1
-        else:
-            print(f"  ✅ 已创建: {result.get('id', 'unknown')}")
-            success += 1
+        # 攒批保存胶囊
+        pending.append({"title": topic, "content": content, "domain": get_domain(topic)})
+        if len(pending) >= BATCH_SIZE:
+            flush()
             
         # 避免过快
         time.sleep(1)
+    
+    if pending:
+        flush()
         
     print(f"\n完成! 成功: {success}, 失败: {failed}")
 
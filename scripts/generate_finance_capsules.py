@@ -59,26 +59,30 @@ def generate_finance_capsule(topic: str) -> str:
     
     return call_llm(prompt)
 
-def save_capsule(title: str, content: str) -> dict:
-    """保存胶囊"""
+def save_capsules(capsules: list) -> list:
+    """批量保存胶囊，返回逐条结果"""
     try:
         resp = requests.post(
-            f"{CAPSULE_API}/capsules",
-            json={
-                "title": title, 
-                "content": content, 
-                "domain": "金融",
-                "tags": ["金融", "投资", "股票"]
-            },
-            timeout=30
+            f"{CAPSULE_API}/capsules/bulk",
+            json=[
+                {
+                    "title": c["title"],
+                    "content": c["content"],
+                    "domain": "金融",
+                    "tags": ["金融", "投资", "股票"]
+                }
+                for c in capsules
+            ],
+            timeout=60
         )
-        return resp.json()
+        return resp.json()["results"]
     except Exception as e:
-        return {"error": str(e)}
+        return [{"id": None, "error": str(e)} for _ in capsules]
 
 def main():
     print(f"开始生成10个金融胶囊...\n")
     
+    capsules = []
     for i, topic in enumerate(TOPICS):
         print(f"[{i+1}/10] {topic}")
         
@@ -88,14 +92,15 @@ def main():
         if "Error" in content:
             print(f"  ❌ 生成失败")
             continue
-            
-        # 保存胶囊
-        result = save_capsule(topic, content)
         
-        if "error" in result:
-            print(f"  ❌ 保存失败")
+        capsules.append({"title": topic, "content": content})
+    
+    # 一次请求批量保存
+    for capsule, result in zip(capsules, save_capsules(capsules)):
+        if result.get("error"):
+            print(f"  ❌ 保存失败: {capsule['title']}")
         else:
-            print(f"  ✅ 已创建")
+            print(f"  ✅ 已创建: {capsule['title']}")
             
     print("\n完成!")
 
@@ -0,0 +1,4 @@
+"""
+Kai 各服务共用的基础组件
+storage: SQLite WAL 连接池、异步适配层、组提交与分片工具
+"""
@@ -0,0 +1,293 @@
+"""
+SQLite 存储层 - WAL 模式连接池
+每个进程持有一组只读连接和一个串行化的写连接，读写互不阻塞；
+AsyncStorage 把查询放到有界线程池执行，供 async 路由使用而不阻塞事件循环；
+可选按键哈希分片到多个文件，各分片写锁独立，跨分片读并行扇出
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, List, Optional, Sequence
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+# ===================== PRAGMA =====================
+PRAGMAS = {
+    "journal_mode": "WAL",        # 读不阻塞写，写不阻塞读
+    "synchronous": "NORMAL",      # WAL 下仅在 checkpoint 时 fsync，崩溃不丢已提交事务
+    "cache_size": "-65536",       # 64MB 页缓存（负数单位为 KiB）
+    "mmap_size": "268435456",     # 256MB 内存映射读
+    "temp_store": "MEMORY",
+    "busy_timeout": "5000",
+}
+
+# ===================== 连接池 =====================
+class ConnectionPool:
+    """读连接池 + 单写连接"""
+
+    def __init__(self, path: str, readers: int = 4,
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.path = path
+        self.size = readers
+        self._on_connect = on_connect
+        self._writer = self._connect(readonly=False)
+        self._write_lock = threading.Lock()
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(readers):
+            self._readers.put(self._connect(readonly=True))
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "read_acquired": 0,
+            "read_waits": 0,
+            "read_wait_ms": 0.0,
+            "read_in_use": 0,
+            "read_peak_in_use": 0,
+            "write_acquired": 0,
+            "write_waits": 0,
+            "write_wait_ms": 0.0,
+            "write_held_ms": 0.0,
+        }
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        if readonly:
+            conn.execute("PRAGMA query_only=1")
+        if self._on_connect:
+            self._on_connect(conn)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """借出一个只读连接"""
+        start = time.perf_counter()
+        try:
+            conn = self._readers.get_nowait()
+            waited = False
+        except queue.Empty:
+            conn = self._readers.get()
+            waited = True
+        with self._stats_lock:
+            self._stats["read_acquired"] += 1
+            self._stats["read_in_use"] += 1
+            self._stats["read_peak_in_use"] = max(self._stats["read_peak_in_use"], self._stats["read_in_use"])
+            if waited:
+                self._stats["read_waits"] += 1
+                self._stats["read_wait_ms"] += (time.perf_counter() - start) * 1000
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._stats_lock:
+                self._stats["read_in_use"] -= 1
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """独占写连接；提交由调用方负责，异常时回滚"""
+        start = time.perf_counter()
+        waited = not self._write_lock.acquire(blocking=False)
+        if waited:
+            self._write_lock.acquire()
+        acquired = time.perf_counter()
+        try:
+            yield self._writer
+        except BaseException:
+            self._writer.rollback()
+            raise
+        finally:
+            if self._writer.in_transaction:
+                self._writer.rollback()
+            with self._stats_lock:
+                self._stats["write_acquired"] += 1
+                self._stats["write_held_ms"] += (time.perf_counter() - acquired) * 1000
+                if waited:
+                    self._stats["write_waits"] += 1
+                    self._stats["write_wait_ms"] += (acquired - start) * 1000
+            self._write_lock.release()
+
+    def stats(self) -> dict:
+        """连接池利用率统计"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["read_pool_size"] = self.size
+        stats["read_utilization"] = round(stats["read_in_use"] / self.size, 3) if self.size else 0
+        stats["write_locked"] = self._write_lock.locked()
+        for key in ("read_wait_ms", "write_wait_ms", "write_held_ms"):
+            stats[key] = round(stats[key], 3)
+        return stats
+
+    def close(self):
+        self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+# ===================== 异步适配 =====================
+class AsyncStorage:
+    """ConnectionPool 的异步包装: 读在 size 个线程上并发，写在单线程上串行，事件循环只 await 结果"""
+    
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self._read_executor = ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix="sqlite-read")
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-write")
+        self._pending = {"read": 0, "write": 0}
+    
+    async def _submit(self, kind: str, executor: ThreadPoolExecutor, fn: Callable, *args) -> Any:
+        self._pending[kind] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        finally:
+            self._pending[kind] -= 1
+    
+    def _read_call(self, fn: Callable, args: tuple) -> Any:
+        with self.pool.reader() as conn:
+            return fn(conn, *args)
+    
+    def _write_call(self, fn: Callable, args: tuple) -> Any:
+        with self.pool.writer() as conn:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+    
+    async def run_read(self, fn: Callable[..., Any], *args) -> Any:
+        """fn(conn, *args) 在只读连接上执行"""
+        return await self._submit("read", self._read_executor, self._read_call, fn, args)
+    
+    async def run_write(self, fn: Callable[..., Any], *args) -> Any:
+        """fn(conn, *args) 在写连接上作为一个事务执行，返回后提交，异常时回滚"""
+        return await self._submit("write", self._write_executor, self._write_call, fn, args)
+    
+    async def run_blocking(self, fn: Callable[..., Any], *args) -> Any:
+        """自行管理连接的阻塞函数（批量写入、重建等）放到写线程执行"""
+        return await self._submit("write", self._write_executor, fn, *args)
+    
+    async def fetchone(self, sql: str, params: Sequence = ()) -> Optional[sqlite3.Row]:
+        return await self.run_read(lambda conn: conn.execute(sql, params).fetchone())
+    
+    async def fetchall(self, sql: str, params: Sequence = ()) -> list:
+        return await self.run_read(lambda conn: conn.execute(sql, params).fetchall())
+    
+    async def execute(self, sql: str, params: Sequence = ()) -> dict:
+        """单条写语句，返回影响行数与 lastrowid"""
+        def call(conn):
+            cursor = conn.execute(sql, params)
+            return {"rowcount": cursor.rowcount, "lastrowid": cursor.lastrowid}
+        return await self.run_write(call)
+    
+    def stats(self) -> dict:
+        """排队/执行中的任务数，合并连接池统计"""
+        return {**self.pool.stats(), "async_pending_read": self._pending["read"],
+                "async_pending_write": self._pending["write"]}
+    
+    def close(self):
+        self._read_executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
+        self.pool.close()
+
+# ===================== 分片 =====================
+def shard_paths(path: str, count: int) -> List[str]:
+    """分片文件路径；单分片沿用原文件，与未分片的库兼容"""
+    if count <= 1:
+        return [path]
+    base, ext = os.path.splitext(path)
+    return [f"{base}.shard{i}{ext}" for i in range(count)]
+
+def shard_of(key: str, count: int) -> int:
+    """稳定哈希路由（crc32，跨进程、跨重启一致）"""
+    return zlib.crc32(key.encode()) % count if count > 1 else 0
+
+async def fan_out(dbs: Sequence[AsyncStorage], fn: Callable[..., Any], *args) -> list:
+    """在每个分片的只读连接上并行执行 fn(conn, *args)，按分片顺序返回结果"""
+    return list(await asyncio.gather(*(db.run_read(fn, *args) for db in dbs)))
+
+# ===================== 组提交 =====================
+class GroupCommitter:
+    """组提交: 写请求进入内存队列，后台任务攒够 max_rows 条或等满 max_wait_ms 后单事务写入，
+    提交完成后才逐个确认，用一次提交（fsync）摊薄整组请求"""
+    
+    def __init__(self, db: AsyncStorage, write: Callable[[list], list],
+                 max_rows: int = 64, max_wait_ms: float = 5.0):
+        self.db = db
+        self.write = write  # 阻塞函数: 条目列表 -> 等长结果列表，自行管理写连接与提交
+        self.max_rows = max(1, max_rows)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"groups": 0, "rows": 0, "max_group": 0, "failed_groups": 0}
+    
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+    
+    async def submit(self, item: Any) -> Any:
+        """排队写入，返回该条目的写入结果（所在组提交之后才返回）"""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+    
+    async def _collect(self) -> list:
+        group = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(group) < self.max_rows:
+            try:
+                group.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                group.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return group
+    
+    async def _run(self):
+        while True:
+            group = await self._collect()
+            items = [item for item, _ in group]
+            try:
+                results = await self.db.run_blocking(self.write, items)
+            except Exception as e:
+                self._stats["failed_groups"] += 1
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self._stats["groups"] += 1
+            self._stats["rows"] += len(group)
+            self._stats["max_group"] = max(self._stats["max_group"], len(group))
+            for (_, future), result in zip(group, results):
+                if not future.done():
+                    future.set_result(result)
+    
+    async def close(self):
+        """停止后台写入任务（须在同一事件循环中调用）"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+    
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["avg_group"] = round(stats["rows"] / stats["groups"], 2) if stats["groups"] else 0
+        stats["queued"] = self._queue.qsize() if self._queue is not None else 0
+        stats["max_rows"] = self.max_rows
+        stats["max_wait_ms"] = self.max_wait * 1000
+        return stats
@@ -0,0 +1,206 @@
+"""
+核心路径回归测试: 标签倒排碰撞、MinHash/LSH 阈值、跨分片游标分页、v2 导入幂等、缓存代数竞争、网关缓存键
+胶囊服务以双分片（按 ID 哈希）加载到临时目录，网关的上游换成 httpx.MockTransport，不依赖外部服务
+"""
+from pathlib import Path
+import asyncio
+import gzip
+import importlib.util
+import json
+import os
+import sys
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_service(name: str, directory: str):
+    """按文件加载服务的 main.py（各服务的入口同名，以不同模块名区分）"""
+    path = str(ROOT / directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(name, ROOT / directory / "main.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="module")
+def capsule_main(tmp_path_factory):
+    os.environ.update({
+        "CAPSULE_DB_PATH": str(tmp_path_factory.mktemp("capsules") / "capsules.db"),
+        "CAPSULE_SHARDS": "2",
+        "CAPSULE_SHARD_BY": "id",
+    })
+    return load_service("capsule_main", "capsule_service")
+
+
+@pytest.fixture(scope="module")
+def client(capsule_main):
+    with TestClient(capsule_main.app) as c:
+        yield c
+
+
+@pytest.fixture(scope="module")
+def gateway_main():
+    return load_service("gateway_main", "api_gateway")
+
+
+def create(client, title, content, domain="general", tags=None) -> str:
+    resp = client.post("/capsules", json={"title": title, "content": content, "domain": domain, "tags": tags})
+    assert resp.status_code == 200, resp.text
+    return resp.json()["id"]
+
+
+# ===================== 碰撞 =====================
+def test_tag_collisions_score_shared_tags_only(client):
+    target = create(client, "标签目标", "标签碰撞目标正文", "tagtest", ["ai", "ml", "nlp"])
+    same_domain = create(client, "同领域", "同领域的两个共同标签", "tagtest", ["ai", "ml"])
+    other_domain = create(client, "异领域", "异领域的一个共同标签", "tagtest-other", ["nlp"])
+    create(client, "无关", "没有共同标签", "tagtest", ["cooking"])
+
+    hits = client.get(f"/collisions/{target}", params={"mode": "tags", "threshold": 0.3}).json()["collisions"]
+    scores = {hit["capsule_id"]: hit["score"] for hit in hits}
+    # 重叠数 / max(两侧标签数) × 同领域 1.2
+    assert scores == {same_domain: 0.8, other_domain: 0.333}
+
+    hits = client.get(f"/collisions/{target}", params={"mode": "tags", "threshold": 0.5}).json()["collisions"]
+    assert [hit["capsule_id"] for hit in hits] == [same_domain]
+
+
+def test_minhash_lsh_threshold(capsule_main, client):
+    from minhash import estimate_similarity, lsh_buckets, minhash_signature
+
+    base = "局部敏感哈希把相似的文档分到同一个桶里，用来在大语料中快速召回近重复内容。" * 3
+    near = base.replace("快速召回", "高效召回")
+    unrelated = "今天的天气很好，适合去公园散步，顺便买一杯咖啡。" * 3
+
+    sig_base, sig_near, sig_unrelated = (minhash_signature(t) for t in (base, near, unrelated))
+    assert estimate_similarity(sig_base, sig_near) > 0.7
+    assert estimate_similarity(sig_base, sig_unrelated) < 0.1
+    assert set(lsh_buckets(sig_base)) & set(lsh_buckets(sig_near))
+    assert not set(lsh_buckets(sig_base)) & set(lsh_buckets(sig_unrelated))
+
+    target = create(client, "近重复原文", base, "lsh", ["lsh"])
+    duplicate = create(client, "近重复副本", near, "lsh", ["lsh"])
+    create(client, "无关正文", unrelated, "lsh", ["lsh"])
+
+    def content_hits(threshold):
+        return client.get(f"/collisions/{target}", params={"mode": "content", "threshold": threshold}).json()["collisions"]
+
+    hits = content_hits(0.5)
+    assert [hit["capsule_id"] for hit in hits] == [duplicate]
+    # 阈值按取整后的分数比较，等于分数时入选，高出时不入选
+    score = hits[0]["score"]
+    assert [hit["capsule_id"] for hit in content_hits(score)] == [duplicate]
+    assert content_hits(round(score + 0.001, 3)) == []
+
+
+# ===================== 分页 =====================
+def test_keyset_pagination_across_shards(capsule_main, client):
+    created = {create(client, f"分页 {i}", f"分页测试正文 {i}", "paging", ["paging"]) for i in range(23)}
+    assert len({capsule_main.home_shard({"id": cid, "domain": "paging"}).index for cid in created}) == 2
+
+    seen, cursor = [], None
+    while True:
+        params = {"domain": "paging", "limit": 5, "fields": "id,created_at"}
+        if cursor:
+            params["cursor"] = cursor
+        resp = client.get("/capsules", params=params)
+        page = resp.json()
+        assert len(page) <= 5
+        seen.extend(page)
+        cursor = resp.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+
+    ids = [row["id"] for row in seen]
+    assert len(ids) == len(set(ids)) and set(ids) == created
+    keys = [(row["created_at"], row["id"]) for row in seen]
+    assert keys == sorted(keys, reverse=True)
+
+
+# ===================== 导入 =====================
+def test_v2_import_is_idempotent(client):
+    payload = (ROOT / "capsules_v2.0.json").read_bytes()
+    first = client.post("/capsules/import/v2", content=payload).json()
+    assert first["inserted"] > 0 and first["failed"] == 0
+    total = client.get("/stats").json()["total_capsules"]
+
+    second = client.post("/capsules/import/v2", content=payload).json()
+    assert second["inserted"] == 0
+    assert second["skipped"] == first["inserted"] + first["skipped"]
+    assert client.get("/stats").json()["total_capsules"] == total
+
+
+# ===================== 缓存 =====================
+def test_capsule_cache_drops_reads_that_race_an_invalidation(capsule_main):
+    from cache import LRUCache
+
+    cache = LRUCache(2)
+    generation = cache.generation("a")
+    cache.invalidate("a")  # 回源读取期间胶囊被改写
+    assert not cache.put_if_current("a", "stale", generation)
+    assert cache.get("a") is None
+
+    # 失效记录超出容量被淘汰后，下限抬高，淘汰前取的代数仍然作废
+    generation = cache.generation("a")
+    cache.invalidate("a")
+    cache.invalidate("b", "c")
+    assert not cache.put_if_current("a", "stale", generation)
+    assert cache.put_if_current("a", "fresh", cache.generation("a"))
+    assert cache.get("a") == "fresh"
+
+
+def test_gateway_cache_drops_fill_that_races_a_write(gateway_main):
+    async def scenario():
+        cache = gateway_main.ResponseCache(8)
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def fetch():
+            started.set()
+            await release.wait()
+            return gateway_main.CacheEntry("trade", 200, [], b"old")
+
+        pending = asyncio.create_task(cache.get(("/market", "[]"), 5, 30, fetch))
+        await started.wait()
+        cache.invalidate("trade")  # 在途请求期间上游发生写入
+        release.set()
+        entry, state = await pending
+        assert (entry.body, state) == (b"old", "MISS")
+        assert cache.entries == {}
+
+    asyncio.run(scenario())
+
+
+def test_gateway_cache_key_ignores_encoding_and_query_order(gateway_main):
+    assert gateway_main.cache_key("/api/market", [("b", "2"), ("a", "1")]) == \
+        gateway_main.cache_key("/api/market", [("a", "1"), ("b", "2")])
+
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.headers.get("accept-encoding"))
+        body = json.dumps({"listings": [1, 2, 3]}).encode()
+        return httpx.Response(200, content=gzip.compress(body),
+                              headers={"content-encoding": "gzip", "content-type": "application/json"})
+
+    with TestClient(gateway_main.app) as c:
+        upstream = gateway_main.upstreams["trade"]
+        real_client = upstream.client
+        upstream.client = httpx.AsyncClient(base_url="http://trade", transport=httpx.MockTransport(handler),
+                                            headers={"accept-encoding": "identity"})
+        try:
+            first = c.get("/api/market", params={"b": "2", "a": "1"}, headers={"accept-encoding": "gzip"})
+            second = c.get("/api/market", params={"a": "1", "b": "2"}, headers={"accept-encoding": "identity"})
+        finally:
+            upstream.client = real_client
+
+    assert first.headers["x-cache"] == "MISS" and second.headers["x-cache"] == "HIT"
+    assert first.json() == second.json() == {"listings": [1, 2, 3]}
+    assert "content-encoding" not in second.headers
+    assert calls == ["identity"]